@@ -0,0 +1,82 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+"""Node handler dispatch: the former per node isinstance scan vs the type table"""
+
+import ast
+import time
+from pesci import *
+from pesci.errors import EnvExecEnd
+
+DISPATCHES = 200000
+SCRIPT = """
+t = 0
+for i in range(2000):
+    if i % 3 == 0:
+        t += i * 2
+    else:
+        t = t - 1
+"""
+
+def legacy_lookup(interpreter, node):
+    # rebuilt for every node, then scanned in order
+    op2fnmap = dict([(k, getattr(interpreter, name))
+        for k,name in Interpreter.HANDLERS.items()])
+    for k,v in op2fnmap.items():
+        if isinstance(node, k):
+            return v
+    return None
+
+def table_lookup(interpreter, node):
+    try:
+        return interpreter._handlers[type(node)]
+    except KeyError:
+        return interpreter._resolve_handler(type(node))
+
+def bench_lookup(name, lookup, interpreter, nodes):
+    start = time.time()
+    for i in xrange(DISPATCHES / len(nodes)):
+        for node in nodes:
+            lookup(interpreter, node)
+    elapsed = time.time() - start
+    print "%-12s %8.3f us/dispatch" % (name, elapsed * 1e6 / DISPATCHES)
+
+def bench_script(interpreter, code):
+    env = interpreter.create_env(code)
+    start = time.time()
+    steps = 0
+    while True:
+        try:
+            interpreter.step(env)
+        except EnvExecEnd:
+            break
+        steps += 1
+    elapsed = time.time() - start
+    print "%-12s %8.0f steps/s" % ("script", steps / elapsed)
+
+if __name__ == "__main__":
+    interpreter = Interpreter()
+    code = PesciCode.from_string(SCRIPT)
+    nodes = [node for node in ast.walk(code.get_ast()) if not isinstance(node, ast.Module)]
+
+    bench_lookup("legacy", legacy_lookup, interpreter, nodes)
+    bench_lookup("table", table_lookup, interpreter, nodes)
+    bench_script(interpreter, code)
@@ -0,0 +1,50 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+"""Calls per second of a predicate: statement path vs compiled expression"""
+
+import time
+from pesci import *
+
+PREDICATE = "price > 10 and region in allowed"
+CALLS = 20000
+
+def variables(i):
+    return {'price':i % 20, 'region':"eu", 'allowed':["eu", "us"]}
+
+def bench(name, f):
+    start = time.time()
+    for i in xrange(CALLS):
+        f(variables(i))
+    elapsed = time.time() - start
+    print "%-12s %10.0f calls/s" % (name, CALLS / elapsed)
+
+if __name__ == "__main__":
+    interpreter = Interpreter()
+    code = PesciCode.from_string("result = %s" % PREDICATE)
+
+    def statement(symbols):
+        env = interpreter.create_env(code, symbols=symbols)
+        interpreter.run(env)
+        return env.getvar("result")
+
+    bench("statement", statement)
+    bench("expression", interpreter.compile_expression(PREDICATE))
@@ -0,0 +1,68 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+"""Cold start cost of 'import pesci', with a per module breakdown like the
+   one of 'python -X importtime' (which python 2 lacks)"""
+
+import subprocess
+import sys
+import time
+
+RUNS = 20
+
+# run into a fresh interpreter: times every import, nested ones included
+IMPORTTIME = r"""
+import __builtin__, sys, time
+real_import = __builtin__.__import__
+stack = [0]
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules and sys.modules[name] is not None:
+        return real_import(name, *args, **kwargs)
+    stack.append(0)
+    start = time.time()
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        elapsed = (time.time() - start) * 1e6
+        nested = stack.pop()
+        stack[-1] += elapsed
+        sys.stderr.write("import time: %9d | %10d | %s%s\n" % (
+            elapsed - nested, elapsed, "  " * (len(stack) - 1), name))
+__builtin__.__import__ = timed_import
+import pesci
+"""
+
+def cold_start(code):
+    start = time.time()
+    for i in range(RUNS):
+        subprocess.check_call([sys.executable, "-c", code])
+    return (time.time() - start) / RUNS * 1000
+
+if __name__ == "__main__":
+    base = cold_start("pass")
+    pesci = cold_start("import pesci")
+    print "python startup  %7.1f ms" % base
+    print "import pesci    %7.1f ms (+%.1f ms)" % (pesci, pesci - base)
+    print
+    print "import time:  self [us] | cumulative | imported module"
+    sys.stdout.flush()
+    process = subprocess.Popen([sys.executable, "-c", IMPORTTIME], stderr=subprocess.PIPE)
+    sys.stdout.write(process.communicate()[1])
@@ -0,0 +1,69 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+"""Memory footprint of cached programs: ast trees against compact trees"""
+
+import ast
+import sys
+from pesci import *
+
+SCRIPT = """
+def score(price, qty, region="eu"):
+    total = price * qty
+    if total > 100 and region in ("eu", "us"):
+        total -= total / 10
+    return total
+
+results = []
+for i in range(10):
+    results.append(score(i, i + 1))
+print results
+"""
+
+def deep_sizeof(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, ast.AST):
+        for k in obj._fields + obj._attributes:
+            if hasattr(obj, k):
+                size += deep_sizeof(getattr(obj, k), seen)
+        if not hasattr(type(obj), "__slots__"):
+            # fields are kept into the node dict
+            size += sys.getsizeof(obj.__dict__)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            size += deep_sizeof(v, seen)
+    return size
+
+def footprint(programs):
+    seen = set()
+    return sum([deep_sizeof(p.get_ast(), seen) for p in programs]) / len(programs)
+
+if __name__ == "__main__":
+    count = 100
+    trees = [PesciCode.from_string(SCRIPT) for i in range(count)]
+    compacts = [PesciCode.from_string(SCRIPT).compact() for i in range(count)]
+
+    print "ast      %8d bytes/program" % footprint(trees)
+    print "compact  %8d bytes/program" % footprint(compacts)
@@ -0,0 +1,88 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+"""Source loading time on big generated scripts, against the former
+   regex based loader.
+"""
+
+import os
+import re
+import tempfile
+import time
+from pesci import *
+
+def legacy_escape_newlines(code):
+    replaces = [(m.start(0), m.end(0)) for m in re.finditer(r"['\"](.*?\n*?)['\"]", code) if "\n" in m.group(0)]
+    i = 0
+    parts = []
+    for start,end in replaces:
+        k = 0
+        while k != -1:
+            k = code.find("\n", start, end)
+            if k != -1:
+                parts.append(code[i:k])
+                i = k+1
+                start = i
+    parts.append(code[i:])
+    return "\\n".join(parts)
+
+def legacy_from_string(s):
+    lines = legacy_escape_newlines(s).split("\n")
+    return "\n".join(lines)
+
+def legacy_from_file(path):
+    lines = [line[:-1] for line in file(path)]
+    return "\n".join(lines)
+
+def generate(size):
+    chunk = ("total_%d = price * qty + 10 # compute the total\n"
+        "if total > 100:\n    label = \"high\"\nelse:\n    label = 'low'\n"
+        "for k in range(10):\n    total += k * 2 - 1\n")
+    parts = []
+    total = 0
+    i = 0
+    while total < size:
+        s = chunk % i
+        if i % 100 == 0:
+            s += "msg = 'it\\'s a string\nover two lines'\n"
+        parts.append(s)
+        total += len(s)
+        i += 1
+    return "".join(parts)
+
+def bench(name, f, arg):
+    start = time.time()
+    f(arg)
+    print "%-12s %8.3f s" % (name, time.time() - start)
+
+if __name__ == "__main__":
+    for mb in (1, 8, 32):
+        source = generate(mb << 20)
+        print "%d MB" % mb
+        bench("legacy", legacy_from_string, source)
+        bench("from_string", PesciCode.from_string, source)
+
+        fd, path = tempfile.mkstemp(suffix=".py")
+        os.write(fd, source)
+        os.close(fd)
+        bench("legacy file", legacy_from_file, path)
+        bench("from_file", PesciCode.from_file, path)
+        os.unlink(path)
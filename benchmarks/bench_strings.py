@@ -0,0 +1,67 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+"""String building loops: copying concatenation vs the StringBuilder values"""
+
+import time
+from pesci import *
+from pesci.output import NullSink
+
+PIECE = "x" * 99 + "\n"
+SCRIPT = """
+s = ""
+for i in range(%d):
+    s += piece
+t = ""
+for i in range(%d):
+    t = t + piece
+size = len(s) + len(t)
+"""
+
+class LegacyInterpreter(Interpreter):
+    # always build a new string, like before the StringBuilder values
+    def _is_append(self, node):
+        return False
+
+    def _statement_augassign(self, env, node):
+        itr = self._fold_expr(env, node.value)
+        if itr: yield itr
+
+        val = env.pop()
+        newval = self._perform_bin_op(env.getvar(node.target.id), node.op, val)
+        env.setvar(node.target.id, newval)
+        yield node
+
+def bench(name, interpreter, megabytes):
+    # half of the output for each loop
+    count = megabytes * (1 << 20) / len(PIECE) / 2
+    code = PesciCode.from_string(SCRIPT % (count, count))
+    env = interpreter.create_env(code, symbols={'piece':PIECE}, output=NullSink())
+    start = time.time()
+    interpreter.run(env)
+    elapsed = time.time() - start
+    print "%-8s %6.1f MB %8.3f s" % (name, env.getvar("size") / float(1 << 20), elapsed)
+
+if __name__ == "__main__":
+    for megabytes in (1, 2, 4):
+        bench("legacy", LegacyInterpreter(), megabytes)
+    for megabytes in (1, 2, 4, 16, 64):
+        bench("builder", Interpreter(), megabytes)
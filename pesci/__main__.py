@@ -19,46 +19,94 @@
 #  MA 02110-1301, USA.
 #
 
+import argparse
 import sys
 from pesci import *
+from pesci.interpreter import GRANULARITIES, GRANULARITY_NODE
 
 @pesci_function
 def pesci_help(**kargs):
     interpreter = kargs[PESCI_KEY_INTERPRETER]
     env = kargs[PESCI_KEY_ENV]
 
-    interpreter.print_line("No help available. Try with 'dir()'.")
+    interpreter.write_line(env, "No help available. Try with 'dir()'.")
 
 @pesci_function
 def pesci_dir(**kargs):
     interpreter = kargs[PESCI_KEY_INTERPRETER]
     env = kargs[PESCI_KEY_ENV]
-    interpreter.print_line(env.get_description())
+    interpreter.write_line(env, env.get_description())
 
 preloaded_symbols = {
     'help' : pesci_help,
     'dir' : pesci_dir
 }
 
+def parse_args():
+    parser = argparse.ArgumentParser(prog="pesci",
+        description="Runs PesciCode files, or the interactive mode.")
+    parser.add_argument("sources", nargs="*", metavar="source",
+        help="source files or glob patterns; a leading plus sign enables "
+            "debug mode for a single file")
+    parser.add_argument("--profile", type=int, metavar="N",
+        help="sample the call stack every N steps")
+    parser.add_argument("--profile-output", metavar="FILE",
+        help="write the collapsed stacks to FILE instead of stderr")
+    parser.add_argument("--granularity", choices=GRANULARITIES, default=GRANULARITY_NODE,
+        help="where the interpreter steps stop")
+
+    batch = parser.add_argument_group("batch mode",
+        "run many files, or a single one with any of these options, and "
+        "report their timings instead of their output")
+    batch.add_argument("--jobs", type=int, metavar="N",
+        help="run N files in parallel processes")
+    batch.add_argument("--repeat", type=int, metavar="K",
+        help="run each file K times")
+    batch.add_argument("--time", action="store_true",
+        help="report the timings of a single file")
+    batch.add_argument("--json", action="store_true",
+        help="report as JSON instead of a table")
+    batch.add_argument("--compare-native", action="store_true",
+        help="also time native mode and compare its results")
+    return parser.parse_args()
+
+def run_batch(args, files):
+    from pesci.runner import run_files, format_table, format_json
+    results = run_files(files, jobs=args.jobs or 1, repeat=args.repeat or 1,
+        granularity=args.granularity, native=args.compare_native)
+    if args.json:
+        print format_json(results)
+    else:
+        print format_table(results)
+    return not [r for r in results if 'error' in r]
+
 if __name__ == "__main__":
-    if len(sys.argv) > 2:
-        print "Usage: %s [+][source file]" % sys.argv[0]
-        print "NB: the plus sign enables debug mode"
-        exit(1)
+    args = parse_args()
+
+    if args.sources:
+        from pesci.runner import expand_sources
+        try:
+            files = expand_sources([source.lstrip("+") for source in args.sources])
+        except ValueError as e:
+            sys.exit("pesci: %s" % e)
+        if (len(files) != 1 or args.jobs or args.repeat or args.time or args.json or
+                args.compare_native):
+            sys.exit(0 if run_batch(args, files) else 1)
 
-    interpreter = Interpreter()
-    if len(sys.argv) == 1:
+    interpreter = Interpreter(granularity=args.granularity)
+    if args.profile:
+        from pesci.profiler import SamplingProfiler
+        profiler = SamplingProfiler(interval=args.profile)
+        profiler.attach(interpreter)
+
+    if not args.sources:
         # run in interactive mode
         env = interpreter.create_env(symbols=preloaded_symbols)
         interpreter.run_interactive(env)
     else:
         # run from file
-        if sys.argv[1].startswith("+"):
-            fname = sys.argv[1].lstrip("+")
-            debug = True
-        else:
-            fname = sys.argv[1]
-            debug = False
+        fname = files[0]
+        debug = args.sources[0].startswith("+")
         code = PesciCode.from_file(fname)
         env = interpreter.create_env(code)
 
@@ -83,3 +131,11 @@ if __name__ == "__main__":
 
             # Enter the interactive mode
             interpreter.run_interactive(env)
+
+    if args.profile:
+        profiler.detach()
+        if args.profile_output:
+            with open(args.profile_output, "w") as f:
+                profiler.write_collapsed(f)
+        else:
+            profiler.write_collapsed(sys.stderr)
@@ -0,0 +1,383 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import ast
+import operator
+from itertools import izip, repeat
+from pesci.interpreter import BUILTINS, BINARY_OPERATORS, COMPARISON_OPERATORS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Batch evaluation of a script over columnar inputs.
+
+The script runs once for all the rows: each input symbol is a column and top
+level statements made of straight-line arithmetic, comparisons, boolean and
+conditional logic are evaluated element-wise over whole columns. Statements
+which cannot be vectorized (loops, prints, function calls...) are interpreted
+once per row instead.
+
+NumPy arrays back the columns when numpy is available and the inputs are
+numeric, python lists otherwise. The NumPy operations must give the python
+results: floating point errors (e.g. a division by zero) raise, so that the
+rows are interpreted and fail as usual, and the integer operations which may
+overflow int64 are done element-wise, with python ints.
+
+NB: non column values are shared by all the rows.
+"""
+
+# as Interpreter._perform_unary: the other unary operators are not supported
+UNARY_OPERATORS = ((ast.Not, operator.not_), (ast.Invert, operator.invert))
+
+# builtins which are safe to call element-wise
+PURE_BUILTINS = ('abs', 'bool', 'cmp', 'float', 'hex', 'int', 'len', 'long',
+ 'max', 'min', 'oct', 'ord', 'pow', 'round', 'str')
+
+def _lookup(table, op):
+    for k,f in table:
+        if isinstance(op, k):
+            return f
+    raise NotVectorizable(op)
+
+class NotVectorizable(Exception):
+    def __init__(self, node):
+        self.node = node
+
+"""A whole column of per-row values"""
+class Column(object):
+    def __init__(self, data):
+        self.data = data
+
+class ListBackend(object):
+    def column(self, data):
+        return list(data)
+
+    def result(self, value, n):
+        if isinstance(value, Column):
+            return value.data
+        return [value] * n
+
+    def row(self, value, i):
+        if isinstance(value, Column):
+            return value.data[i]
+        return value
+
+    def _rows(self, values, n):
+        return [v.data if isinstance(v, Column) else repeat(v, n) for v in values]
+
+    """element-wise f(*values); vectorized tells f also works on arrays"""
+    def apply(self, f, values, n, vectorized=False):
+        return Column([f(*row) for row in izip(*self._rows(values, n))])
+
+    def truth(self, value, n):
+        return Column([bool(v) for v in value.data])
+
+    def where(self, cond, a, b, n):
+        return Column([x if c else y for c,x,y in izip(cond.data, *self._rows((a, b), n))])
+
+# integer operations which cannot overflow int64 if their operands are below
+# GROWING_LIMIT in absolute value
+GROWING_OPERATORS = (operator.add, operator.sub, operator.mul)
+GROWING_LIMIT = 1 << 31
+# integer operations which are always done element-wise
+UNBOUNDED_OPERATORS = (operator.pow, operator.lshift)
+# operations whose numpy bool results differ from python, e.g. True + True
+BOOL_SAFE_OPERATORS = (operator.and_, operator.or_, operator.xor, operator.not_,
+ operator.eq, operator.ne, operator.lt, operator.le, operator.gt, operator.ge)
+
+class NumpyBackend(ListBackend):
+    def column(self, data):
+        return numpy.asarray(data)
+
+    def result(self, value, n):
+        if isinstance(value, Column):
+            return value.data
+        return numpy.array([value] * n)
+
+    """can numpy give the python result of f over args?"""
+    def _is_exact(self, f, args):
+        for arg in args:
+            kind = numpy.asarray(arg).dtype.kind
+            if kind == "b" and not f in BOOL_SAFE_OPERATORS:
+                return False
+            elif kind in "iu":
+                if f in UNBOUNDED_OPERATORS:
+                    return False
+                elif f in GROWING_OPERATORS:
+                    if isinstance(arg, (int, long)):
+                        if not -GROWING_LIMIT < arg < GROWING_LIMIT:
+                            return False
+                    elif arg.size and not (-GROWING_LIMIT < arg.min() and arg.max() < GROWING_LIMIT):
+                        return False
+        return True
+
+    def apply(self, f, values, n, vectorized=False):
+        if vectorized:
+            args = [v.data if isinstance(v, Column) else v for v in values]
+            if self._is_exact(f, args):
+                with numpy.errstate(all="raise"):
+                    return Column(f(*args))
+        return Column(numpy.array(ListBackend.apply(self, f, values, n).data))
+
+    def truth(self, value, n):
+        return Column(value.data.astype(bool))
+
+    def where(self, cond, a, b, n):
+        return Column(numpy.where(cond.data, *[v.data if isinstance(v, Column) else v for v in (a, b)]))
+
+class BatchEvaluator(object):
+    def __init__(self, interpreter, code, symbols={}):
+        self.interpreter = interpreter
+        self.tree = code.get_ast()
+        self.symbols = symbols
+
+    def _select_backend(self, columns):
+        if numpy is None:
+            return ListBackend()
+        for data in columns.values():
+            if numpy.asarray(data).dtype.kind not in "biuf":
+                return ListBackend()
+        return NumpyBackend()
+
+    """Runs the script over the columns dict, returns the assigned names columns"""
+    def run(self, columns):
+        lengths = set([len(data) for data in columns.values()])
+        if len(lengths) > 1:
+            raise ValueError("columns length mismatch")
+        n = lengths.pop() if lengths else 0
+
+        self._backend = self._select_backend(columns)
+        self._n = n
+        self._env = None
+
+        scope = dict(BUILTINS)
+        scope.update(self.symbols)
+        for name,data in columns.items():
+            scope[name] = Column(self._backend.column(data))
+
+        written = []
+        for stmt in self.tree.body:
+            try:
+                changes = self._exec_vector(stmt, scope)
+            except NotVectorizable:
+                changes = self._exec_rows(stmt, scope)
+            except Exception:
+                # maybe an error of a single row, let the interpreter tell
+                changes = self._exec_rows(stmt, scope)
+
+            scope.update(changes)
+            for name in changes:
+                if not name in written:
+                    written.append(name)
+
+        return dict([(name, self._backend.result(scope[name], n)) for name in written])
+
+    ## Vectorized execution
+    def _exec_vector(self, stmt, scope):
+        changes = {}
+        self._exec_block([stmt], _Overlay(scope, changes))
+        return changes
+
+    def _exec_block(self, stmts, scope):
+        for stmt in stmts:
+            if isinstance(stmt, ast.Assign):
+                if len(stmt.targets) != 1 or not isinstance(stmt.targets[0], ast.Name):
+                    raise NotVectorizable(stmt)
+                scope[stmt.targets[0].id] = self._eval(stmt.value, scope)
+            elif isinstance(stmt, ast.AugAssign):
+                if not isinstance(stmt.target, ast.Name):
+                    raise NotVectorizable(stmt)
+                f = _lookup(BINARY_OPERATORS, stmt.op)
+                scope[stmt.target.id] = self._apply(f,
+                    (self._name(stmt.target.id, stmt.target, scope), self._eval(stmt.value, scope)),
+                    True)
+            elif isinstance(stmt, ast.If):
+                self._exec_if(stmt, scope)
+            elif not isinstance(stmt, ast.Pass):
+                raise NotVectorizable(stmt)
+
+    def _exec_if(self, stmt, scope):
+        cond = self._eval(stmt.test, scope)
+        if not isinstance(cond, Column):
+            # the same branch for all the rows
+            self._exec_block(stmt.body if cond else stmt.orelse, scope)
+            return
+
+        # run both the branches, then pick the values row by row
+        body = _Overlay(scope, {})
+        self._exec_block(stmt.body, body)
+        orelse = _Overlay(scope, {})
+        self._exec_block(stmt.orelse, orelse)
+
+        cond = self._backend.truth(cond, self._n)
+        for name in set(body.changes) | set(orelse.changes):
+            if not (name in body.changes and name in orelse.changes) and not name in scope:
+                # undefined into some rows
+                raise NotVectorizable(stmt)
+            scope[name] = self._backend.where(cond, body[name], orelse[name], self._n)
+
+    def _apply(self, f, values, vectorized=False):
+        for v in values:
+            if isinstance(v, Column):
+                return self._backend.apply(f, values, self._n, vectorized)
+        return f(*values)
+
+    def _name(self, name, node, scope):
+        try:
+            return scope[name]
+        except KeyError:
+            raise NotVectorizable(node)
+
+    def _eval(self, node, scope):
+        if isinstance(node, ast.Num):
+            return node.n
+        elif isinstance(node, ast.Str):
+            return node.s
+        elif isinstance(node, ast.Name):
+            return self._name(node.id, node, scope)
+        elif isinstance(node, ast.BinOp):
+            return self._apply(_lookup(BINARY_OPERATORS, node.op),
+                (self._eval(node.left, scope), self._eval(node.right, scope)), True)
+        elif isinstance(node, ast.UnaryOp):
+            operand = self._eval(node.operand, scope)
+            if isinstance(node.op, ast.Not) and isinstance(operand, Column):
+                # operator.not_ is not element-wise on arrays
+                return self._backend.where(self._backend.truth(operand, self._n), False, True, self._n)
+            return self._apply(_lookup(UNARY_OPERATORS, node.op), (operand,), True)
+        elif isinstance(node, ast.BoolOp):
+            return self._eval_boolop(node, scope)
+        elif isinstance(node, ast.Compare):
+            return self._eval_compare(node, scope)
+        elif isinstance(node, ast.IfExp):
+            cond = self._eval(node.test, scope)
+            if not isinstance(cond, Column):
+                return self._eval(node.body if cond else node.orelse, scope)
+            return self._backend.where(self._backend.truth(cond, self._n),
+                self._eval(node.body, scope), self._eval(node.orelse, scope), self._n)
+        elif isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Index):
+            return self._apply(operator.getitem,
+                (self._eval(node.value, scope), self._eval(node.slice.value, scope)))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            f = self._name(node.func.id, node.func, scope)
+            if (node.keywords or node.starargs or node.kwargs or
+                    not node.func.id in PURE_BUILTINS or f is not BUILTINS[node.func.id]):
+                raise NotVectorizable(node)
+            return self._apply(f, [self._eval(arg, scope) for arg in node.args])
+        raise NotVectorizable(node)
+
+    def _eval_boolop(self, node, scope):
+        result = self._eval(node.values[0], scope)
+        for value in node.values[1:]:
+            if not isinstance(result, Column):
+                # short circuit on a constant
+                if isinstance(node.op, ast.Or) and result:
+                    return result
+                elif isinstance(node.op, ast.And) and not result:
+                    return result
+                result = self._eval(value, scope)
+                continue
+
+            value = self._eval(value, scope)
+            cond = self._backend.truth(result, self._n)
+            if isinstance(node.op, ast.Or):
+                result = self._backend.where(cond, result, value, self._n)
+            else:
+                result = self._backend.where(cond, value, result, self._n)
+        return result
+
+    def _eval_compare(self, node, scope):
+        result = True
+        left = self._eval(node.left, scope)
+        for op,comp in zip(node.ops, node.comparators):
+            right = self._eval(comp, scope)
+            f = _lookup(COMPARISON_OPERATORS, op)
+            vectorized = not isinstance(op, (ast.Is, ast.IsNot, ast.In, ast.NotIn))
+            value = self._apply(f, (left, right), vectorized)
+            if result is True:
+                result = value
+            else:
+                result = self._apply(operator.and_,
+                    (self._truth(result), self._truth(value)), True)
+            left = right
+        return result
+
+    def _truth(self, value):
+        if isinstance(value, Column):
+            return self._backend.truth(value, self._n)
+        return bool(value)
+
+    ## Per row execution
+    def _exec_rows(self, stmt, scope):
+        if self._env is None:
+            self._env = self.interpreter.create_env(symbols=self.symbols)
+        env = self._env
+        module = ast.Module(body=[stmt])
+
+        names = [name for name in scope if name[0] != "_"]
+        rows = []
+        for i in range(self._n):
+            # load the row
+            loaded = {}
+            for name in names:
+                loaded[name] = self._backend.row(scope[name], i)
+            context = env.get_global_context()
+            context.clear()
+            context['__globals__'] = []
+            env.loadvars(loaded)
+
+            env.setup(module)
+            self.interpreter.run(env)
+
+            row = {}
+            # NB: joins the StringBuilder values
+            for name,val in env.get_global_context().items():
+                if name[0] != "_" and (not name in loaded or loaded[name] is not val):
+                    row[name] = val
+            rows.append(row)
+
+        # build the changed columns
+        changes = {}
+        for name in set([name for row in rows for name in row]):
+            prev = scope.get(name)
+            changes[name] = Column(self._backend.column(
+                [row[name] if name in row else self._backend.row(prev, i)
+                    for i,row in enumerate(rows)]))
+        return changes
+
+"""A scope which records its own assignments"""
+class _Overlay(object):
+    def __init__(self, parent, changes):
+        self.parent = parent
+        self.changes = changes
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            return self.changes[key]
+        return self.parent[key]
+
+    def __setitem__(self, key, val):
+        self.changes[key] = val
+
+    def __contains__(self, key):
+        return key in self.changes or key in self.parent
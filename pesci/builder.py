@@ -0,0 +1,53 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import sys
+
+"""
+Lazy string values, for the variables built by repeated concatenation.
+
+"s += x" would copy the whole string at every step, so a loop building a
+report is quadratic in its size. Instead, the environment keeps the pieces
+into a StringBuilder, and joins them only when the variable is read.
+"""
+
+# the size of the empty string object, i.e. the overhead of each piece
+EMPTY_SIZE = sys.getsizeof("")
+
+class StringBuilder(object):
+    def __init__(self, value):
+        self.parts = [value]
+        self.length = len(value)
+
+    def append(self, value):
+        self.parts.append(value)
+        self.length += len(value)
+
+    """join the pieces, once"""
+    def build(self):
+        parts = self.parts
+        if len(parts) > 1:
+            parts[:] = ["".join(parts)]
+        return parts[0]
+
+    """the pieces, each with its string overhead, and their list"""
+    def estimate_size(self):
+        return sys.getsizeof(self.parts) + len(self.parts) * EMPTY_SIZE + self.length
@@ -21,7 +21,9 @@
 
 import ast
 import re
-from pesci.errors import *
+import threading
+import weakref
+from pesci.errors import PesciSyntaxError
 from pesci import Validator
 
 # Used to denote our builtin functions, expecting interpreter + environment args
@@ -33,16 +35,88 @@ def pesci_function(func):
     setattr(func, PESCI_BUILTIN_FUNCTION, True)
     return func
 
-class PesciFunction:
-    def __init__(self, name, params, body):
-        self.name = name
-        self.args = params
-        self.body = body
+# execution tiers of a PesciFunction, see pesci.tier
+TIER_INTERPRETED = "interpreted"
+TIER_COMPILED = "compiled"
+TIER_UNCOMPILABLE = "uncompilable"
+
+"""The immutable part of a function definition: its body and the plan to
+   bind its arguments. There is one per FunctionDef node, i.e. per program and
+   definition site, shared by all the environments running the program.
+"""
+class FunctionTemplate(object):
+    def __init__(self, node):
+        self.node = node
+        self.name = node.name
+        self.body = node.body
+        self.params = tuple([arg.id for arg in node.args.args if isinstance(arg, ast.Name)])
+        self.vararg = node.args.vararg
+        self.kwarg = node.args.kwarg
+        # the default expressions, for the last len(defaults) params
+        self.defaults = tuple(node.args.defaults)
+        self.first_default = len(self.params) - len(self.defaults)
+        # param name -> position
+        self.positions = dict([(name, i) for i,name in enumerate(self.params)])
+
+        # the code object of the compiled tier, see pesci.tier
+        self.code = None
+        self.compile_failed = False
+
+# FunctionDef node -> FunctionTemplate
+_templates = weakref.WeakKeyDictionary()
+_templates_lock = threading.Lock()
+
+"""the FunctionTemplate of a FunctionDef node"""
+def get_template(node):
+    template = _templates.get(node)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(node)
+            if template is None:
+                template = _templates[node] = FunctionTemplate(node)
+    return template
+
+"""A function defined by an environment: its template and default values"""
+class PesciFunction(object):
+    __slots__ = ('template', 'defaults', 'tier', 'calls', 'loop_iterations',
+        '__weakref__')
+
+    def __init__(self, template, defaults=()):
+        self.template = template
+        self.defaults = defaults
+
+        # tier state: the counters tell how hot the function is
+        self.tier = TIER_INTERPRETED
+        self.calls = 0
+        self.loop_iterations = 0
+
+    @property
+    def name(self):
+        return self.template.name
+
+    @property
+    def body(self):
+        return self.template.body
+
+    def __repr__(self):
+        return "<PesciFunction %s>" % self.template.name
+
+# source tokens: runs of code, comments and strings without newlines, or a
+# single quoted string spanning multiple lines
+_SOURCE_TOKEN = re.compile(r"""
+  (?:[^'"\#]+
+    | \#[^\n]*
+    | '''(?:[^\\']|\\.|'(?!''))*(?:'''|\Z)
+    | \"\"\"(?:[^\\"]|\\.|"(?!""))*(?:\"\"\"|\Z)
+    | '(?:[^\\'\n]|\\.)*'
+    | "(?:[^\\"\n]|\\.)*"
+  )+
+| (?P<multiline>'(?:[^\\']|\\.)*(?:'|\Z)|"(?:[^\\"]|\\.)*(?:"|\Z))
+""", re.S | re.X)
 
 class PesciCode:
-    def __init__(self, lines, validator):
-        self._lines = lines
-        self._code = "\n".join(self._lines)
+    def __init__(self, code, validator):
+        self._code = code
         self._validator = validator
         self._ast_tree = None
 
@@ -51,33 +125,36 @@ class PesciCode:
     """
     @staticmethod
     def from_file(f):
-        if not isinstance(f, file):
-            f = file(f)
-        # Remove \n
-        lines = [line[:-1] for line in f]
-        return PesciCode(lines, Validator())
+        if isinstance(f, file):
+            s = f.read()
+        else:
+            with open(f, "rb") as f:
+                s = f.read()
+        return PesciCode.from_string(s.replace("\r\n", "\n") if "\r" in s else s)
 
     @staticmethod
     def from_string(s):
-        lines = PesciCode._escape_newlines(s).split("\n")
-        return PesciCode(lines, Validator())
+        return PesciCode(PesciCode._escape_newlines(s), Validator())
 
-    """replace \n within quotes with escaped version"""
+    """replace \n within quotes with escaped version.
+       Single pass over the code, which is returned as it is when there is
+       nothing to replace.
+    """
     @staticmethod
     def _escape_newlines(code):
-        replaces = [(m.start(0), m.end(0)) for m in re.finditer(r"['\"](.*?\n*?)['\"]", code) if "\n" in m.group(0)]
-        i = 0
         parts = []
-        for start,end in replaces:
-            k = 0
-            while k != -1:
-                k = code.find("\n", start, end)
-                if k != -1:
-                    parts.append(code[i:k])
-                    i = k+1
-                    start = i
+        i = 0
+        for m in _SOURCE_TOKEN.finditer(code):
+            if m.lastgroup:
+                start, end = m.span()
+                parts.append(code[i:start])
+                parts.append(m.group().replace("\n", "\\n"))
+                i = end
+
+        if not parts:
+            return code
         parts.append(code[i:])
-        return "\\n".join(parts)
+        return "".join(parts)
 
     """Generate ast.tree from own code"""
     def _compile(self):
@@ -98,7 +175,7 @@ class PesciCode:
             "\n".join(
                 map(lambda (n,s): "%03d| %s" % (n, s),
                     # add line numbers and print code
-                    enumerate(self._lines) ),
+                    enumerate(self._code.split("\n")) ),
                 ), "*" * 10)
 
     def get_ast(self):
@@ -107,6 +184,14 @@ class PesciCode:
             self._ast_tree = self._compile()
         return self._ast_tree
 
+    """Replace the ast tree with its compact representation, which takes
+       less memory, e.g. for long lived cached programs.
+    """
+    def compact(self):
+        from pesci.ir import compact
+        self._ast_tree = compact(self.get_ast())
+        return self
+
     def _visit_ast_tree(self, rootnode, line=0, offset=0, indent=0):
         for node in ast.iter_child_nodes(rootnode):
             # Update line information
@@ -0,0 +1,382 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import ast
+import operator
+from pesci.errors import ScriptRejected
+from pesci.interpreter import BUILTINS
+
+"""
+Static cost estimation of a validated script, and admission control.
+
+The CostAnalyzer walks the tree once, without running anything, and tells:
+  - the loops, their nesting depth, also through the called functions, and
+    whether their bounds are constant, depend on the input (names or calls)
+    or are unbounded (while)
+  - the script functions calling themselves, directly or through others
+  - the call sites of host functions and methods
+  - the size of the largest literal, e.g. a string or [0] * 1000
+Numeric expressions of constants, e.g. range(10**9), are folded, their
+values clamped to MAX_CONSTANT.
+  - a rough number of steps, where each unknown loop bound or recursive
+    function counts as UNKNOWN_ITERATIONS iterations or calls
+
+An AdmissionController checks the profiles against its limits, rejecting
+the scripts over them before they reach the interpreter or a worker, and
+gives the expensive ones a lower priority.
+"""
+
+LOOP_CONSTANT = "constant"
+LOOP_INPUT = "input"
+LOOP_UNBOUNDED = "unbounded"
+
+RECURSION_DIRECT = "direct"
+RECURSION_MUTUAL = "mutual"
+
+# the assumed iterations of the loops whose bound is not known
+UNKNOWN_ITERATIONS = 1000
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# the folded constants are clamped to +-MAX_CONSTANT, so that folding 10**10**10
+# stays cheap: it is over any limit anyway
+MAX_CONSTANT = 1 << 64
+
+_FOLDED_BINARY = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+ ast.Div: operator.div, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+ ast.Pow: operator.pow, ast.LShift: operator.lshift, ast.RShift: operator.rshift}
+_FOLDED_UNARY = {ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Invert: operator.invert}
+
+def _clamp(value):
+    if value != value:
+        # nan
+        return None
+    return max(-MAX_CONSTANT, min(value, MAX_CONSTANT))
+
+"""the sign of left ** right or left << right when it is too big to compute,
+   0 when it is not
+"""
+def _overflow_sign(op, left, right):
+    bits = MAX_CONSTANT.bit_length()
+    if isinstance(op, ast.Pow) and abs(left) > 1 and right > 0 and \
+            int(abs(left)).bit_length() * right > bits:
+        odd = isinstance(right, (int, long)) and right % 2
+        return -1 if left < 0 and odd else 1
+    elif isinstance(op, ast.LShift) and left and right > bits:
+        return -1 if left < 0 else 1
+    return 0
+
+"""the value of a numeric constant expression, or None"""
+def _constant(node):
+    if isinstance(node, ast.Num):
+        if isinstance(node.n, (int, long, float)):
+            return _clamp(node.n)
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _FOLDED_UNARY:
+        operand = _constant(node.operand)
+        try:
+            return _clamp(_FOLDED_UNARY[type(node.op)](operand))
+        except TypeError:
+            # None, or ~ of a float
+            return None
+    elif isinstance(node, ast.BinOp) and type(node.op) in _FOLDED_BINARY:
+        left, right = _constant(node.left), _constant(node.right)
+        if left is None or right is None:
+            return None
+        sign = _overflow_sign(node.op, left, right)
+        if sign:
+            return sign * MAX_CONSTANT
+        try:
+            return _clamp(_FOLDED_BINARY[type(node.op)](left, right))
+        except (ArithmeticError, ValueError, TypeError):
+            return None
+    return None
+
+"""returns the (kind, iterations) of a loop over node"""
+def _iterations(node):
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+            node.func.id in ("range", "xrange") and node.args and \
+            not node.keywords and not node.starargs and not node.kwargs and \
+            all([isinstance(_constant(arg), (int, long)) for arg in node.args]):
+        args = [_constant(arg) for arg in node.args]
+        start, stop, step = 0, args[0], 1
+        if len(args) > 1:
+            start, stop = args[:2]
+        if len(args) > 2:
+            step = args[2]
+        if not step:
+            return LOOP_CONSTANT, 0
+        return LOOP_CONSTANT, max(0, (stop - start + step - (1 if step > 0 else -1)) // step)
+    elif isinstance(node, ast.Str):
+        return LOOP_CONSTANT, len(node.s)
+    elif isinstance(node, (ast.List, ast.Tuple)):
+        return LOOP_CONSTANT, len(node.elts)
+    elif isinstance(node, ast.Dict):
+        return LOOP_CONSTANT, len(node.keys)
+    return LOOP_INPUT, None
+
+def _literal_size(node):
+    if isinstance(node, ast.Str):
+        return len(node.s)
+    elif isinstance(node, (ast.List, ast.Tuple)):
+        return len(node.elts)
+    elif isinstance(node, ast.Dict):
+        return len(node.keys)
+    elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mult):
+        # a repeated literal, e.g. "-" * 80
+        for seq,count in ((node.left, node.right), (node.right, node.left)):
+            size = _literal_size(seq)
+            count = _constant(count)
+            if size and isinstance(count, (int, long)):
+                return size * max(count, 0)
+    return 0
+
+class CostProfile(object):
+    def __init__(self):
+        self.statements = 0
+        self.max_loop_depth = 0
+        # (line, kind, iterations or None, names the bound depends on)
+        self.loops = []
+        # function name -> RECURSION_DIRECT or RECURSION_MUTUAL
+        self.recursion = {}
+        # (line, called name)
+        self.host_calls = []
+        self.max_literal = 0
+        self.estimated_steps = 0
+        # set by AdmissionController.admit
+        self.priority = None
+
+    def count_loops(self, kind):
+        return len([loop for loop in self.loops if loop[1] == kind])
+
+    def snapshot(self):
+        return {'statements':self.statements, 'max_loop_depth':self.max_loop_depth,
+            'constant_loops':self.count_loops(LOOP_CONSTANT),
+            'input_loops':self.count_loops(LOOP_INPUT),
+            'unbounded_loops':self.count_loops(LOOP_UNBOUNDED),
+            'recursion':dict(self.recursion), 'host_calls':len(self.host_calls),
+            'max_literal':self.max_literal, 'estimated_steps':self.estimated_steps,
+            'priority':self.priority}
+
+"""collects the script functions and the functions each one calls"""
+class _FunctionScanner(ast.NodeVisitor):
+    def __init__(self):
+        self.functions = {}
+        self.calls = {}
+        self._current = None
+
+    def visit_FunctionDef(self, node):
+        self.functions[node.name] = node
+        self.calls.setdefault(node.name, set())
+        outer = self._current
+        self._current = node.name
+        for stmt in node.body:
+            self.visit(stmt)
+        self._current = outer
+
+    def visit_Call(self, node):
+        if self._current is not None and isinstance(node.func, ast.Name):
+            self.calls[self._current].add(node.func.id)
+        self.generic_visit(node)
+
+class CostAnalyzer(object):
+    """unknown_iterations: the assumed iterations of an unknown loop bound, and
+       the assumed calls of a recursive function
+    """
+    def __init__(self, unknown_iterations=UNKNOWN_ITERATIONS):
+        self.unknown_iterations = unknown_iterations
+
+    """code: a PesciCode or an ast tree. Returns a CostProfile."""
+    def analyze(self, code):
+        tree = code.get_ast() if hasattr(code, "get_ast") else code
+        profile = CostProfile()
+
+        scanner = _FunctionScanner()
+        scanner.visit(tree)
+        self._functions = scanner.functions
+        self._find_recursion(profile, scanner.calls)
+
+        self._function_costs = {}
+        # the loop depth of each function body, with its callees
+        self._function_depths = {}
+        self._profile = profile
+        for node in ast.walk(tree):
+            if isinstance(node, ast.stmt):
+                profile.statements += 1
+            elif isinstance(node, ast.Call):
+                self._host_call(profile, node)
+            profile.max_literal = max(profile.max_literal, _literal_size(node))
+
+        profile.estimated_steps = self._body_cost(tree.body, 0)
+        for name,node in self._functions.items():
+            # also counts the loops of the functions never called
+            self._function_cost(name)
+        del self._profile
+        return profile
+
+    def _find_recursion(self, profile, calls):
+        for name in calls:
+            if name in calls[name]:
+                profile.recursion[name] = RECURSION_DIRECT
+                continue
+            # can name be reached again from its callees?
+            seen = set()
+            todo = [callee for callee in calls[name] if callee in calls]
+            while todo:
+                callee = todo.pop()
+                if callee == name:
+                    profile.recursion[name] = RECURSION_MUTUAL
+                    break
+                if not callee in seen:
+                    seen.add(callee)
+                    todo.extend([c for c in calls[callee] if c in calls])
+
+    def _host_call(self, profile, node):
+        func = node.func
+        if isinstance(func, ast.Name):
+            if func.id in self._functions:
+                return
+            name = func.id
+        elif isinstance(func, ast.Attribute):
+            name = "." + func.attr
+        else:
+            name = "<%s>" % func.__class__.__name__
+        profile.host_calls.append((getattr(node, "lineno", 0), name))
+
+    def _loop(self, node, iter_node, depth):
+        if iter_node is None:
+            kind, iterations = LOOP_UNBOUNDED, None
+            iter_node = node.test
+        else:
+            kind, iterations = _iterations(iter_node)
+        names = set([n.id for n in ast.walk(iter_node)
+            if isinstance(n, ast.Name) and not n.id in BUILTINS])
+        self._profile.loops.append((getattr(node, "lineno", 0), kind, iterations,
+            tuple(sorted(names))))
+        self._profile.max_loop_depth = max(self._profile.max_loop_depth, depth)
+        if iterations is None:
+            return self.unknown_iterations
+        return iterations
+
+    def _function_cost(self, name):
+        if name in self._function_costs:
+            return self._function_costs[name]
+        # a recursive call does not add to the cost of the callee body
+        self._function_costs[name] = 0
+        self._function_depths[name] = 0
+        # NB: max_loop_depth collects the depth of the body alone
+        outer_depth = self._profile.max_loop_depth
+        self._profile.max_loop_depth = 0
+        cost = self._body_cost(self._functions[name].body, 0) + 1
+        if name in self._profile.recursion:
+            cost *= self.unknown_iterations
+        self._function_costs[name] = cost
+        self._function_depths[name] = self._profile.max_loop_depth
+        self._profile.max_loop_depth = max(outer_depth, self._profile.max_loop_depth)
+        return cost
+
+    def _body_cost(self, body, depth):
+        return sum([self._stmt_cost(stmt, depth) for stmt in body])
+
+    def _stmt_cost(self, node, depth):
+        if isinstance(node, ast.For):
+            iterations = self._loop(node, node.iter, depth+1)
+            return (self._expr_cost(node.iter, depth) + 1 + iterations *
+                (self._body_cost(node.body, depth+1) + 1) + self._body_cost(node.orelse, depth))
+        elif isinstance(node, ast.While):
+            iterations = self._loop(node, None, depth+1)
+            test = self._expr_cost(node.test, depth)
+            return (test + 1 + iterations * (self._body_cost(node.body, depth+1) + test) +
+                self._body_cost(node.orelse, depth))
+        elif isinstance(node, ast.If):
+            return (self._expr_cost(node.test, depth) + 1 +
+                max(self._body_cost(node.body, depth), self._body_cost(node.orelse, depth)))
+        elif isinstance(node, ast.FunctionDef):
+            # the body costs on each call
+            return 1 + sum([self._expr_cost(d, depth) for d in node.args.defaults])
+        return 1 + sum([self._expr_cost(child, depth) for child in ast.iter_child_nodes(node)])
+
+    def _expr_cost(self, node, depth):
+        cost = 1 + sum([self._expr_cost(child, depth) for child in ast.iter_child_nodes(node)])
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+                node.func.id in self._functions:
+            cost += self._function_cost(node.func.id)
+            # the callee loops nest into the ones around the call
+            self._profile.max_loop_depth = max(self._profile.max_loop_depth,
+                depth + self._function_depths[node.func.id])
+        return cost
+
+class AdmissionController(object):
+    """Each limit, when not None, rejects the scripts over it:
+       max_steps: estimated steps
+       max_loop_depth: loop nesting depth
+       max_literal: size of the largest literal
+       max_host_calls: host call sites
+       allow_recursion, allow_unbounded_loops: to reject any of them
+       Admitted scripts estimated over low_priority_steps get PRIORITY_LOW,
+       the ones without loops nor recursion PRIORITY_HIGH.
+    """
+    def __init__(self, max_steps=None, max_loop_depth=None, max_literal=None,
+            max_host_calls=None, allow_recursion=True, allow_unbounded_loops=True,
+            low_priority_steps=None, analyzer=None):
+        self.max_steps = max_steps
+        self.max_loop_depth = max_loop_depth
+        self.max_literal = max_literal
+        self.max_host_calls = max_host_calls
+        self.allow_recursion = allow_recursion
+        self.allow_unbounded_loops = allow_unbounded_loops
+        self.low_priority_steps = low_priority_steps
+        self.analyzer = analyzer or CostAnalyzer()
+
+    """the reasons to reject a profile; empty if it is admitted"""
+    def check(self, profile):
+        reasons = []
+        for limit,value,what in ((self.max_steps, profile.estimated_steps, "estimated steps"),
+                (self.max_loop_depth, profile.max_loop_depth, "loop depth"),
+                (self.max_literal, profile.max_literal, "literal size"),
+                (self.max_host_calls, len(profile.host_calls), "host call sites")):
+            if limit is not None and value > limit:
+                reasons.append("%s %d over %d" % (what, value, limit))
+        if not self.allow_recursion and profile.recursion:
+            reasons.append("recursive functions %s" % ", ".join(sorted(profile.recursion)))
+        if not self.allow_unbounded_loops and profile.count_loops(LOOP_UNBOUNDED):
+            reasons.append("unbounded loops at lines %s" % ", ".join([str(loop[0])
+                for loop in profile.loops if loop[1] == LOOP_UNBOUNDED]))
+        return reasons
+
+    def get_priority(self, profile):
+        if self.low_priority_steps is not None and profile.estimated_steps > self.low_priority_steps:
+            return PRIORITY_LOW
+        if not profile.loops and not profile.recursion:
+            return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
+    """Analyzes code and returns its CostProfile, with the priority set.
+       Raises ScriptRejected if it is over the limits.
+    """
+    def admit(self, code):
+        profile = self.analyzer.analyze(code)
+        reasons = self.check(profile)
+        if reasons:
+            raise ScriptRejected(profile, reasons)
+        profile.priority = self.get_priority(profile)
+        return profile
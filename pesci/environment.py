@@ -20,10 +20,46 @@
 #
 
 import ast
+import weakref
 import pesci.code
-from pesci.errors import *
+from pesci.errors import EnvBadSymbolName, EnvCallDepthExceeded, EnvContextsEmpty, \
+ EnvMemoryExceeded, EnvSymbolNotFound
+from pesci.metrics import Metrics, Hooks
+from pesci.builder import StringBuilder
+
+# Maximum number of nested PesciFunction calls
+DEFAULT_MAX_CALL_DEPTH = 10000
+
+"""A PesciFunction activation record"""
+class CallFrame:
+    def __init__(self, func, node, base, stack_height):
+        self.func = func
+        self.node = node
+        # code stack height of the function body
+        self.base = base
+        # data stack height at call time
+        self.stack_height = stack_height
+        self.retval = None
 
 class ExecutionEnvironment:
+    max_call_depth = DEFAULT_MAX_CALL_DEPTH
+    # an OutputSink, or None for Interpreter.print_line
+    output = None
+    # runtime counters and event hooks, see enable_metrics and add_hook
+    metrics = None
+    hooks = None
+    instrumented = False
+    # a SamplingProfiler, see pesci.profiler
+    profiler = None
+    # a MemoryAccount, see enable_memory_accounting
+    memory = None
+    # overrides the interpreter granularity, see pesci.interpreter.GRANULARITIES
+    granularity = None
+    # run the hot PesciFunctions into the compiled tier, see pesci.tier
+    tiering = True
+    # echo the expression values, see Interpreter.run_interactive
+    interactive = False
+
     def __init__(self):
         self.reset()
 
@@ -32,7 +68,23 @@ class ExecutionEnvironment:
         self.ip = -1
         self._contexts = []
         self._stack = []
-        self.iterator = None
+        self._calls = []
+        self.frames = None
+        # the last step of line granularity
+        self.last_stop = None
+        # (id(object), name) -> bound method, see pesci.proxy
+        self.bound_methods = {}
+        # PesciFunction -> its compiled python function, see pesci.tier
+        self.tier_functions = weakref.WeakKeyDictionary()
+        # StringBuilder values may be into the contexts
+        self._builders = False
+
+        # snapshot state: global names and names changed since then
+        self._baseline = None
+        self._dirty = None
+
+        if self.memory is not None:
+            self.memory.reset()
 
         # create global context
         self.push_context()
@@ -40,7 +92,8 @@ class ExecutionEnvironment:
     def setup(self, code):
         self.code = code
         self.ip = 0
-        self.iterator = None
+        self.frames = None
+        self.last_stop = None
 
     def setvar(self, vid, val):
         if vid and vid[0] == "_":
@@ -62,17 +115,123 @@ class ExecutionEnvironment:
 
     def _set_in_context(self, context, key, val):
         context[key] = val
+        if self._dirty is not None:
+            self._dirty.add(key)
+        if self.memory is not None:
+            self.memory.set(len(self._contexts)-1 if context is self._contexts[-1] else 0, key, val)
+            self._check_memory()
+
+    """remember the current global names, to restore them later"""
+    def snapshot(self):
+        self._build_strings()
+        self._baseline = dict(self.get_global_context())
+        self._dirty = set()
+
+    """the global context may have been changed behind setvar"""
+    def untrack_changes(self):
+        self._dirty = None
+
+    """get back to the snapshot state, only undoing the changed names.
+       NB: changes to the objects themselves are not undone.
+    """
+    def restore(self):
+        baseline = self._baseline
+        context = self.get_global_context()
+
+        full = self._dirty is None
+        if full:
+            for key in context.keys():
+                if not key in baseline:
+                    del context[key]
+            for key,val in baseline.iteritems():
+                if context.get(key) is not val:
+                    context[key] = val
+            self._dirty = set()
+        else:
+            for key in self._dirty:
+                if key in baseline:
+                    context[key] = baseline[key]
+                    if self.memory is not None:
+                        self.memory.set(0, key, baseline[key])
+                else:
+                    context.pop(key, None)
+                    if self.memory is not None:
+                        self.memory.discard(0, key)
+            self._dirty.clear()
+        del context['__globals__'][:]
+
+        del self._contexts[1:]
+        del self._calls[:]
+        del self._stack[:]
+        self.bound_methods.clear()
+        self.tier_functions.clear()
+        self.code = None
+        self.ip = -1
+        self.frames = None
+        self.last_stop = None
+        if self.metrics is not None:
+            self.metrics.reset()
+        if self.memory is not None:
+            if full:
+                self.recount_memory()
+            else:
+                del self.memory.contexts[1:]
+                del self.memory.context_totals[1:]
+                self.memory.total = self.memory.context_totals[0]
+                self.memory.clear_sizes()
 
     def _get_from_contexts(self, key):
         # search a key in the context stack
         for context in reversed(self._contexts):
             if context.has_key(key):
-                return context[key]
+                val = context[key]
+                if type(val) is StringBuilder:
+                    val = context[key] = val.build()
+                return val
         raise KeyError(key)
 
+    """is vid a string variable of the context it would be set into?"""
+    def is_string(self, vid):
+        val = self._get_context(vid).get(vid)
+        return type(val) is str or type(val) is StringBuilder
+
+    """vid += piece, for a string variable, without copying it.
+       Returns False when the value is not a string.
+    """
+    def append_string(self, vid, piece):
+        context = self._get_context(vid)
+        val = context.get(vid)
+        if type(val) is StringBuilder:
+            val.append(piece)
+        elif type(val) is str:
+            val = StringBuilder(val)
+            val.append(piece)
+            context[vid] = val
+            self._builders = True
+        else:
+            return False
+
+        if self._dirty is not None:
+            self._dirty.add(vid)
+        if self.memory is not None:
+            self.memory.set(len(self._contexts)-1 if context is self._contexts[-1] else 0, vid, val)
+            self._check_memory()
+        return True
+
+    """join the StringBuilder values, before the contexts are given out"""
+    def _build_strings(self):
+        if self._builders:
+            for context in self._contexts:
+                for key,val in context.iteritems():
+                    if type(val) is StringBuilder:
+                        context[key] = val.build()
+            self._builders = False
+
     """push a value into the call stack"""
     def push(self, val):
         self._stack.append(val)
+        if self.metrics is not None and len(self._stack) > self.metrics.max_stack_depth:
+            self.metrics.max_stack_depth = len(self._stack)
 
     def pop(self):
         return self._stack.pop()
@@ -87,27 +246,154 @@ class ExecutionEnvironment:
         # a trick to remember global variables
         context = {'__globals__':[]}
         self._contexts.append(context)
+        if self.memory is not None:
+            self.memory.push_context()
+        if self.metrics is not None:
+            self.metrics.context_pushes += 1
 
     def pop_context(self):
         if len(self._contexts) <= 1:
             # NB: cannot pop the global context
             raise EnvContextsEmpty(self)
+        if self.memory is not None:
+            self.memory.pop_context()
         return self._contexts.pop()
 
     def _get_context(self, var):
-        cur = self.get_current_context()
+        cur = self._contexts[-1]
         if var in cur['__globals__']:
-            return self.get_global_context()
+            return self._contexts[0]
         return cur
 
+    """enter a PesciFunction call from the code stack top"""
+    def enter_call(self, func, node):
+        if len(self._calls) >= self.max_call_depth:
+            raise EnvCallDepthExceeded(self, self.max_call_depth)
+        self._calls.append(CallFrame(func, node, len(self.frames), len(self._stack)))
+        self.push_context()
+
+        if self.metrics is not None:
+            self.metrics.pesci_calls += 1
+            if len(self._calls) > self.metrics.max_call_depth:
+                self.metrics.max_call_depth = len(self._calls)
+
+    """replace the current call with a new one, reusing its frame"""
+    def tail_call(self, func, node):
+        call = self._calls[-1]
+        del self.frames[call.base:]
+        self._truncate_stack(call.stack_height)
+        call.func = func
+        call.node = node
+        self.pop_context()
+        self.push_context()
+
+        if self.metrics is not None:
+            self.metrics.pesci_calls += 1
+
+    """set the current call result and discard the function body frames"""
+    def return_call(self, val):
+        call = self._calls[-1]
+        call.retval = val
+        del self.frames[call.base:]
+
+    """leave the current call, returning its result"""
+    def leave_call(self):
+        call = self._calls.pop()
+        self._truncate_stack(call.stack_height)
+        self.pop_context()
+        return call.retval
+
+    def get_call_depth(self):
+        return len(self._calls)
+
+    def get_calls(self):
+        return list(self._calls)
+
+    def get_current_call(self):
+        return self._calls[-1]
+
+    """drop any running code, e.g. after an error"""
+    def abort(self):
+        while self._calls:
+            self._calls.pop()
+            self.pop_context()
+        self._truncate_stack(0)
+        self.frames = []
+
+    def _truncate_stack(self, height):
+        del self._stack[height:]
+
+    """start counting runtime metrics"""
+    def enable_metrics(self):
+        if self.metrics is None:
+            self.metrics = Metrics()
+        self.instrumented = True
+
+    """register a hook for an event of pesci.metrics"""
+    def add_hook(self, event, hook):
+        if self.hooks is None:
+            self.hooks = Hooks()
+        self.hooks.add(event, hook)
+        self.instrumented = True
+
+    def remove_hook(self, event, hook):
+        if self.hooks is not None:
+            self.hooks.remove(event, hook)
+            self.instrumented = self.metrics is not None or bool(self.hooks)
+
+    """start the memory accounting of the values stored into the environment.
+       soft_limit: bytes over which on_soft_limit(env, used) is called
+       hard_limit: bytes over which the execution is aborted with EnvMemoryExceeded
+    """
+    def enable_memory_accounting(self, soft_limit=None, hard_limit=None, on_soft_limit=None):
+        from pesci.memory import MemoryAccount
+        self.memory = MemoryAccount(soft_limit, hard_limit, on_soft_limit)
+        self.recount_memory()
+
+    """size again all the values, e.g. after the contexts were changed behind setvar"""
+    def recount_memory(self):
+        self.memory.recount(self._contexts)
+        self._check_memory()
+
+    """account the change of the value of vid made by calling its method,
+       e.g. l.append(v)
+    """
+    def account_change(self, vid, method, args, kwargs):
+        container = getattr(method, "__self__", None)
+        for level in xrange(len(self._contexts)-1, -1, -1):
+            if self._contexts[level].get(vid) is container:
+                self.memory.change(level, vid, container, method.__name__, args, kwargs)
+                self._check_memory()
+                return
+
+    def _check_memory(self):
+        limit = self.memory.check(self)
+        if limit is not None:
+            raise EnvMemoryExceeded(self, self.memory.total, limit)
+
+    """the estimated bytes used by variables, or None"""
+    def get_memory_usage(self):
+        if self.memory is None:
+            return None
+        return self.memory.snapshot()
+
+    """the n biggest variables, as (size, name, context level) tuples"""
+    def get_top_variables(self, n=10):
+        if self.memory is None:
+            return []
+        return self.memory.get_top(n)
+
     def get_global_context(self):
+        self._build_strings()
         return self._contexts[0]
 
     def get_current_context(self):
+        self._build_strings()
         return self._contexts[-1]
 
     def get_visible_context(self):
         # determine the currently visible context variables
+        self._build_strings()
         ctx = {}
         for env in self._contexts:
             for key,val in env.items():
@@ -116,7 +402,7 @@ class ExecutionEnvironment:
         return ctx
 
     def add_global(self, name):
-        gls = self.get_current_context()['__globals__']
+        gls = self._contexts[-1]['__globals__']
         if not name in gls:
             gls.append(name)
 
@@ -59,6 +59,35 @@ class EnvContextsEmpty(Exception):
     def __str__(self):
         return "No context in environment '%s'" % (self.vid, self.env)
 
+class EnvCallDepthExceeded(Exception):
+    def __init__(self, env, depth):
+        self.env = env
+        self.depth = depth
+    def __str__(self):
+        return "Maximum call depth %d exceeded in environment '%s'" % (self.depth, self.env)
+
+class EnvBudgetExceeded(Exception):
+    def __init__(self, env, budget):
+        self.env = env
+        self.budget = budget
+    def __str__(self):
+        return "Execution budget %d exceeded in environment '%s'" % (self.budget, self.env)
+
+class EnvMemoryExceeded(Exception):
+    def __init__(self, env, used, limit):
+        self.env = env
+        self.used = used
+        self.limit = limit
+    def __str__(self):
+        return "Memory limit %d exceeded (%d) in environment '%s'" % (self.limit, self.used, self.env)
+
+class EnvTimeLimitExceeded(Exception):
+    def __init__(self, env, seconds):
+        self.env = env
+        self.seconds = seconds
+    def __str__(self):
+        return "Time limit of %s seconds exceeded in environment '%s'" % (self.seconds, self.env)
+
 class EnvBadSymbolName(Exception):
     def __init__(self, env, sid):
         self.env = env
@@ -66,8 +95,41 @@ class EnvBadSymbolName(Exception):
     def __str__(self):
         return "Bad symbol name: '%s' in environment '%s'" % (self.sid, self.env)
 
+class EnvPoolExhausted(Exception):
+    def __init__(self, pool):
+        self.pool = pool
+    def __str__(self):
+        return "No free environment in pool %s" % self.pool
+
 class BadFunctionCall(Exception):
     def __init__(self, func):
         self.func = func
     def __str__(self):
         return "Bad function call: '%s'" % self.func
+
+## Worker
+class JobError(Exception):
+    def __init__(self, response):
+        self.response = response
+        self.kind = response.get('type')
+    def __str__(self):
+        return "Job %s failed: %s: %s" % (self.response.get('id'), self.kind, self.response.get('error'))
+
+## Admission
+class ScriptRejected(Exception):
+    def __init__(self, profile, reasons):
+        self.profile = profile
+        self.reasons = reasons
+    def __str__(self):
+        return "Script rejected: %s" % "; ".join(self.reasons)
+
+## Replay
+class ReplayMismatch(Exception):
+    def __init__(self, position, expected, got):
+        self.position = position
+        self.expected = expected
+        self.got = got
+    def __str__(self):
+        if self.expected is None:
+            return "Host event %d %s not recorded: the log has ended" % (self.position, self.got)
+        return "Host event %d %s does not match the recorded %s" % (self.position, self.got, self.expected)
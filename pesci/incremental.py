@@ -0,0 +1,333 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import ast
+from pesci.interpreter import BUILTINS
+
+"""
+Incremental re-execution of a script whose input symbols change over time.
+
+Top-level statements are analyzed once for the names they read and write.
+After an update of some symbols, only the statements depending on them, even
+indirectly, are executed again; the others keep their values into the
+environment. To stay safe:
+  - statements calling host functions (symbols not declared pure) and methods
+    of symbols run every time
+  - calls to script functions read and write what the function does
+  - a method call or an item/attribute assignment writes its object, which
+    is a global name when it is not local to the function, or the argument
+    of the call when it is a parameter
+  - when a name is written by more than one statement (or both injected and
+    assigned), all of them run again together, in order
+"""
+
+# a pseudo statement index, for injected symbols
+INPUT = -1
+
+class _Effects(object):
+    def __init__(self):
+        self.reads = set()
+        self.writes = set()
+        # the names whose objects are changed in place
+        self.mutations = set()
+        self.calls = set()
+        # (function, positional names, keyword names, star name) per call,
+        # a None name for the arguments which are not names
+        self.arguments = []
+        self.impure = False
+
+        # of a function: its parameters, and the ones it changes in place
+        self.params = ()
+        self.vararg = None
+        self.kwarg = None
+        self.local = set()
+        self.param_names = set()
+        self.mutated_params = set()
+
+    def merge(self, other):
+        self.reads |= other.reads
+        self.writes |= other.writes
+        self.mutations |= other.mutations
+        self.calls |= other.calls
+        self.arguments += other.arguments
+        self.impure = self.impure or other.impure
+
+def _name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    return None
+
+class _Analyzer(ast.NodeVisitor):
+    def __init__(self, symbols, pure):
+        self.symbols = symbols
+        self.pure = pure
+        self.effects = _Effects()
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, (ast.Store, ast.Param)):
+            self.effects.writes.add(node.id)
+        else:
+            self.effects.reads.add(node.id)
+
+    def visit_Subscript(self, node):
+        if isinstance(node.ctx, (ast.Store, ast.Del)):
+            self._mutate(node.value)
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if isinstance(node.ctx, (ast.Store, ast.Del)):
+            self._mutate(node.value)
+        self.generic_visit(node)
+
+    def _mutate(self, node):
+        # the base name of a.b[c]
+        while isinstance(node, (ast.Subscript, ast.Attribute)):
+            node = node.value
+        if isinstance(node, ast.Name):
+            self.effects.mutations.add(node.id)
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):
+            self.effects.reads.add(node.target.id)
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Name):
+            if func.id in self.symbols and not func.id in self.pure:
+                # an host function
+                self.effects.impure = True
+            elif not func.id in BUILTINS:
+                self.effects.calls.add(func.id)
+                self.effects.arguments.append((func.id, [_name(arg) for arg in node.args],
+                    dict([(k.arg, _name(k.value)) for k in node.keywords]),
+                    _name(node.starargs) or _name(node.kwargs)))
+        elif isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+            base = func.value.id
+            if base in self.symbols:
+                # an host object method
+                self.effects.impure = True
+            else:
+                # the method may change the object
+                self.effects.mutations.add(base)
+        else:
+            self.effects.impure = True
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        # the body runs on call, only the defaults are evaluated here
+        self.effects.writes.add(node.name)
+        for default in node.args.defaults:
+            self.visit(default)
+
+def _analyze_function(node, symbols, pure):
+    analyzer = _Analyzer(symbols, pure)
+    for stmt in node.body:
+        analyzer.visit(stmt)
+    body = analyzer.effects
+
+    local = set(body.writes)
+    local.update([arg.id for arg in node.args.args if isinstance(arg, ast.Name)])
+    local.update([name for name in (node.args.vararg, node.args.kwarg) if name])
+    globs = set()
+    for n in ast.walk(node):
+        if isinstance(n, ast.Global):
+            globs.update(n.names)
+    local -= globs
+
+    effects = _Effects()
+    effects.reads = body.reads - local
+    effects.writes = (body.writes & globs) | (body.mutations - local)
+    effects.calls = body.calls
+    effects.arguments = body.arguments
+    effects.impure = body.impure
+
+    effects.params = tuple([arg.id for arg in node.args.args if isinstance(arg, ast.Name)])
+    effects.vararg = node.args.vararg
+    effects.kwarg = node.args.kwarg
+    effects.local = local
+    effects.param_names = (set(effects.params) |
+        set([name for name in (effects.vararg, effects.kwarg) if name])) - globs
+    effects.mutated_params = body.mutations & effects.param_names
+    return effects
+
+"""the names passed by a call to the parameters which f changes in place"""
+def _mutated_arguments(f, arguments):
+    if not f.mutated_params:
+        return set()
+    name, args, keywords, star = arguments
+    mutated = f.mutated_params
+    names = set()
+    for i,arg in enumerate(args):
+        param = f.params[i] if i < len(f.params) else f.vararg
+        if param in mutated:
+            names.add(arg)
+    for k,arg in keywords.items():
+        param = k if k in f.params else f.kwarg
+        if param in mutated:
+            names.add(arg)
+    # the star arguments may fill any parameter
+    names.add(star)
+    names.discard(None)
+    return names
+
+class _Statement(object):
+    def __init__(self, node, effects):
+        self.node = node
+        self.reads = effects.reads
+        self.writes = effects.writes
+        self.calls = effects.calls
+        self.impure = effects.impure
+
+class IncrementalRunner(object):
+    """pure: names of the host functions which can be called again only when
+       their arguments change.
+    """
+    def __init__(self, interpreter, code, symbols={}, pure=()):
+        self.interpreter = interpreter
+        self._symbols = dict(symbols)
+        self.env = interpreter.create_env(symbols=symbols)
+
+        body = code.get_ast().body
+        functions = {}
+        for node in body:
+            if isinstance(node, ast.FunctionDef):
+                functions[node.name] = _analyze_function(node, self._symbols, pure)
+        self._resolve_calls(functions)
+
+        self._statements = []
+        for node in body:
+            analyzer = _Analyzer(self._symbols, pure)
+            analyzer.visit(node)
+            effects = analyzer.effects
+            effects.writes |= effects.mutations
+            self._apply_calls(effects, functions)
+            self._statements.append(_Statement(node, effects))
+
+        # statements writing each name
+        self._writers = {}
+        for name in self._symbols:
+            self._writers[name] = [INPUT]
+        for i,stmt in enumerate(self._statements):
+            for name in stmt.writes:
+                self._writers.setdefault(name, []).append(i)
+
+        self._changed = set()
+        self._first = True
+
+    def _apply_calls(self, effects, functions):
+        for name in effects.calls:
+            if name in functions:
+                f = functions[name]
+                effects.reads |= f.reads | set([name])
+                effects.writes |= f.writes
+                effects.impure = effects.impure or f.impure
+            else:
+                # unknown function, maybe a local value
+                effects.impure = True
+        for arguments in effects.arguments:
+            if arguments[0] in functions:
+                effects.writes |= _mutated_arguments(functions[arguments[0]], arguments)
+
+    def _resolve_calls(self, functions):
+        # propagate the called functions effects up to a fixpoint
+        changed = True
+        while changed:
+            changed = False
+            for effects in functions.values():
+                before = (len(effects.reads), len(effects.writes), effects.impure,
+                    len(effects.mutated_params))
+                for name in list(effects.calls):
+                    if name in functions:
+                        f = functions[name]
+                        effects.reads |= f.reads
+                        effects.writes |= f.writes
+                        effects.impure = effects.impure or f.impure
+                    else:
+                        effects.impure = True
+                for arguments in effects.arguments:
+                    if arguments[0] in functions:
+                        # the changed arguments: params, locals or globals
+                        mutated = _mutated_arguments(functions[arguments[0]], arguments)
+                        effects.mutated_params |= mutated & effects.param_names
+                        effects.writes |= mutated - effects.local
+                if before != (len(effects.reads), len(effects.writes), effects.impure,
+                        len(effects.mutated_params)):
+                    changed = True
+
+    """Change some input symbols"""
+    def update(self, symbols):
+        for name,val in symbols.items():
+            self._symbols[name] = val
+            self.env.setvar(name, val)
+            self._changed.add(name)
+            self._writers.setdefault(name, [INPUT])
+
+    def _dirty_statements(self):
+        statements = self._statements
+        if self._first:
+            return range(len(statements))
+
+        dirty = set([i for i,stmt in enumerate(statements)
+            if stmt.impure or stmt.reads & self._changed])
+        while True:
+            count = len(dirty)
+
+            # data flow, in program order
+            written = set(self._changed)
+            for i,stmt in enumerate(statements):
+                if not i in dirty and stmt.reads & written:
+                    dirty.add(i)
+                if i in dirty:
+                    written |= stmt.writes
+
+            # names with many writers must be rebuilt from the first one
+            for i in list(dirty):
+                stmt = statements[i]
+                for name in stmt.reads | stmt.writes:
+                    writers = self._writers.get(name, ())
+                    if len(writers) > 1:
+                        dirty.update([w for w in writers if w != INPUT])
+
+            if len(dirty) == count:
+                return sorted(dirty)
+
+    """Executes the statements affected by the changes since the last run.
+       Returns the indexes of the executed top-level statements.
+    """
+    def run(self):
+        dirty = self._dirty_statements()
+        if dirty:
+            # injected values overwritten by the script must be restored
+            for i in dirty:
+                for name in self._statements[i].writes:
+                    if INPUT in self._writers.get(name, ()):
+                        self.env.setvar(name, self._symbols[name])
+
+            self.env.setup(ast.Module(body=[self._statements[i].node for i in dirty]))
+            self.interpreter.run(self.env)
+
+        self._changed = set()
+        self._first = False
+        return dirty
+
+    def getvar(self, name):
+        return self.env.getvar(name)
@@ -0,0 +1,74 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import readline                 # enables line editing features
+import sys
+import traceback
+from pesci.code import PesciCode
+
+"""
+The interactive mode, which is only imported when used.
+"""
+
+"""Reads and runs commands from the terminal, until 'exit' or EOF"""
+def run_interactive(interpreter, env):
+    print "Pesci 0.1 over Python %s" % sys.version.split(" ")[0]
+    print "Emanuele Faranda <black.silver@hotmail.it>"
+    print "Type 'exit' to end interactive mode\n"
+
+    env.interactive = True
+    partial = ""
+
+    while env.interactive:
+        try:
+            if partial:
+                prompt = "... "
+            else:
+                prompt = ">>> "
+            cmd = raw_input(prompt)
+        except EOFError:
+            env.interactive = False
+        except KeyboardInterrupt as kint:
+            print kint
+            partial = ""
+        else:
+            # handle continuation lines
+            s = cmd.strip()
+            if s and s[-1] == ":":
+                partial += cmd + "\n"
+            elif partial:
+                if not cmd:
+                    # end of command
+                    cmd = partial
+                    partial = ""
+                else:
+                    partial += cmd + "\n"
+
+            if cmd == "exit":
+                env.interactive = False
+            elif not partial:
+                # evaluate command
+                try:
+                    code = PesciCode.from_string(cmd)
+                    env.setup(code.get_ast())
+                    interpreter.run(env)
+                except Exception as e:
+                    traceback.print_exc(file=sys.stdout)
@@ -19,39 +19,64 @@
 #  MA 02110-1301, USA.
 #
 
+import collections
 import sys
-import traceback
+import threading
+import time
 import types
+import weakref
 import ast
 import operator
-import pesci.code
-import readline                 # enables line editing features
-from pesci.errors import *
-from pesci.code import *
+from pesci.errors import BadFunctionCall, EnvExecEnd, InterpretError
+from pesci.code import PesciCode, PesciFunction, PESCI_BUILTIN_FUNCTION, \
+ PESCI_KEY_ENV, PESCI_KEY_INTERPRETER, TIER_INTERPRETED, get_template
 from pesci import ExecutionEnvironment
+from pesci.environment import DEFAULT_MAX_CALL_DEPTH
+from pesci.metrics import Hooks, Metrics, EVENT_CALL, EVENT_HOST_CALL, EVENT_RETURN, EVENT_STEP
+from pesci.proxy import HostTypes
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 """
 Implements a python Abstract Syntax interpreter, which runs into a confined
 environnment and understands only a subset of original python syntax.
 
 The interpreter has the ability to step into single instructions into code,
-easily achieved using the "yield" python command. Yield command mantains
-the current call stack wherease a data stack is retained by
-the ExecutionEnvironment push/pop functions.
+easily achieved using the "yield" python command. The code stack is an
+explicit list of generators kept into the ExecutionEnvironment, whereas a data
+stack is retained by the ExecutionEnvironment push/pop functions.
 
 The recurrent code snippet:
 
 itr = self._fold_expr(env, node)
-while itr:
-    try: yield next(itr)
-    except StopIteration: break
+if itr: yield itr
 var = env.pop()
 
-is used to "wait" until sub-folded functions end their execution.
+is used to "wait" until sub-folded functions end their execution: the yielded
+generator is pushed on top of the code stack and run by step(), then the
+caller is resumed. Generators are never nested into each other, so a step has
+the same cost at any depth and recursion is not bound by the python stack.
 """
 
 operator_logical_or = lambda a,b: a or b
 operator_logical_and = lambda a,b: a and b
+operator_in = lambda x,l: x in l
+operator_not_in = lambda x,l: not (x in l)
+
+# ast operators semantics
+BINARY_OPERATORS = ((ast.Add, operator.add), (ast.Sub, operator.sub),
+ (ast.Mult, operator.mul), (ast.Div, operator.div), (ast.Mod, operator.mod),
+ (ast.Pow, operator.pow), (ast.LShift, operator.lshift), (ast.RShift, operator.rshift),
+ (ast.BitOr, operator.or_), (ast.BitXor, operator.xor), (ast.BitAnd, operator.and_),
+ (ast.FloorDiv, operator.floordiv))
+
+COMPARISON_OPERATORS = ((ast.Eq, operator.eq), (ast.NotEq, operator.ne),
+ (ast.Lt, operator.lt), (ast.LtE, operator.le), (ast.Gt, operator.gt),
+ (ast.GtE, operator.ge), (ast.Is, operator.is_), (ast.IsNot, operator.is_not),
+ (ast.In, operator_in), (ast.NotIn, operator_not_in))
 
 # builtin functions and types
 BUILTINS = {'len':len, 'abs':abs, 'all':all, 'any':any, 'bin':bin, 'bool':bool,
@@ -62,14 +87,103 @@ BUILTINS = {'len':len, 'abs':abs, 'all':all, 'any':any, 'bin':bin, 'bool':bool,
  'round':round, 'slice':slice, 'sorted':sorted, 'str':str, 'sum':sum, 'type':type,
  'tuple':tuple, 'zip':zip, 'None':None}
 
+# compiled expressions kept per interpreter, the least recently used go first
+MAX_EXPRESSIONS = 256
+
+# where step() stops: at every node, at every statement or at every line
+GRANULARITY_NODE = "node"
+GRANULARITY_STATEMENT = "statement"
+GRANULARITY_LINE = "line"
+GRANULARITIES = (GRANULARITY_NODE, GRANULARITY_STATEMENT, GRANULARITY_LINE)
+
+# expression nodes which can be evaluated without generators
+DIRECT_NODES = (ast.Num, ast.Str, ast.Name, ast.BinOp, ast.BoolOp, ast.UnaryOp,
+ ast.Compare, ast.IfExp, ast.Tuple, ast.List, ast.Dict, ast.Attribute, ast.Subscript,
+ ast.Index, ast.Slice, ast.operator, ast.boolop, ast.unaryop, ast.cmpop,
+ ast.expr_context)
+
 class Interpreter(object):
-    def __init__(self):
-        self._interactive = False
+    # node type -> handler method. Subclasses of these types, like the compact
+    # nodes of pesci.ir, get the handler of their nearest base.
+    HANDLERS = {
+        ast.BinOp: '_statement_binop',
+        ast.BoolOp: '_statement_boolop',
+        ast.UnaryOp: '_statement_unaryop',
+        ast.Compare: '_statement_compare',
+        ast.IfExp: '_statement_ifexp',
+        ast.Assign: '_statement_assign',
+        ast.AugAssign: '_statement_augassign',
+        ast.Print: '_statement_print',
+        ast.If: '_statement_if',
+        ast.Expr: '_statement_expr',
+        ast.FunctionDef: '_statement_funcdef',
+        ast.Call: '_statement_funcall',
+        ast.Return: '_statement_return',
+        ast.Dict: '_statement_dict',
+        ast.Tuple: '_statement_tuple',
+        ast.List: '_statement_list',
+        ast.Attribute: '_statement_attribute',
+        ast.Global: '_statement_global',
+        ast.While: '_statement_while',
+        ast.For: '_statement_for',
+        ast.Subscript: '_statement_subscript',
+        ast.Pass: '_statement_pass',
+    }
+
+    """granularity: the default one of the environments, see GRANULARITIES.
+       Coarser granularities evaluate the expressions without calls in one go.
+       tier_threshold: calls plus loop iterations after which a PesciFunction
+       is compiled, see pesci.tier; None, the default, to always interpret.
+       max_workers: threads running the environments given to submit.
+
+       The interpreter keeps the state of a run into its environment, so that
+       different environments can run concurrently from many threads. Host
+       calls run without any interpreter lock, so blocking I/O into them
+       does not hold the other runs.
+    """
+    def __init__(self, max_call_depth=DEFAULT_MAX_CALL_DEPTH, granularity=GRANULARITY_NODE,
+            tier_threshold=None, max_workers=4):
+        if not granularity in GRANULARITIES:
+            raise ValueError("unknown granularity '%s'" % granularity)
+        self.max_call_depth = max_call_depth
+        self.granularity = granularity
+        # key -> PesciExpression, see compile_expression
+        self._expressions = collections.OrderedDict()
+        self._expressions_lock = threading.Lock()
+        # the allowed attributes of the host objects, see register_host_type
+        self.host_types = HostTypes()
+
+        self.tier_threshold = tier_threshold
+        # the TierCompiler, see _get_tiers
+        self._tiers = None
+
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # node handlers, see register_handler
+        self._registered = {}
+        self._build_dispatch()
+
+        # aggregated metrics of the executions, see enable_metrics
+        self.metrics = None
+        self.hooks = Hooks()
+        self.instrumented = False
+        self._metrics_lock = threading.Lock()
+        # a SamplingProfiler, see pesci.profiler
+        self.profiler = None
+        # the environments into run_interactive, see stop
+        self._interactive_envs = set()
 
     """Creates a new virtual execution environment """
-    def create_env(self, code=None, symbols={}):
+    def create_env(self, code=None, symbols={}, output=None):
         env = ExecutionEnvironment()
+        env.max_call_depth = self.max_call_depth
+        env.output = output
+        if self.metrics is not None:
+            env.enable_metrics()
         if code:
+            self.host_types.check(code.get_ast(), symbols)
             env.setup(code.get_ast())
 
         # Preload builtins
@@ -81,14 +195,12 @@ class Interpreter(object):
     def _step_iterator(self, env):
         for node in ast.iter_child_nodes(env.code):
             itr = self._fold_expr(env, node)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             try:
                 # a zombie value
                 val = env.pop()
-                if self._interactive and not val is None:
-                    self.print_line(val)
+                if env.interactive and not val is None:
+                    self.write_line(env, str(val))
                 env.popall()
             except IndexError:
                 pass
@@ -98,14 +210,135 @@ class Interpreter(object):
        is finished.
     """
     def step(self, env):
-        if not env.iterator:
-            env.iterator = self._step_iterator(env)
+        if env.frames is None:
+            env.frames = [self._step_iterator(env)]
+        frames = env.frames
+        granularity = env.granularity or self.granularity
+
         try:
-            node = next(env.iterator)
-            env.ip += 1
-            return node
-        except StopIteration:
-            raise EnvExecEnd(env)
+            while frames:
+                try:
+                    node = next(frames[-1])
+                except StopIteration:
+                    frames.pop()
+                    continue
+
+                if type(node) is types.GeneratorType:
+                    # a sub expression to fold before resuming the caller
+                    frames.append(node)
+                elif granularity == GRANULARITY_NODE or self._is_stop(env, node, granularity):
+                    env.ip += 1
+                    if self.instrumented or env.instrumented:
+                        self._on_step(env, node)
+                    profiler = self.profiler or env.profiler
+                    if profiler is not None:
+                        profiler.countdown -= 1
+                        if profiler.countdown <= 0:
+                            profiler.expire(env, node)
+                    return node
+        except Exception:
+            # a broken code stack cannot be resumed
+            env.abort()
+            if env.metrics is not None:
+                env.metrics.exceptions += 1
+            self._on_execution_end(env)
+            raise
+        self._on_execution_end(env)
+        raise EnvExecEnd(env)
+
+    def _is_stop(self, env, node, granularity):
+        if not isinstance(node, ast.stmt):
+            return False
+        if granularity == GRANULARITY_LINE:
+            # statements sharing a line stop once, unless the line runs again
+            last = env.last_stop
+            if (last is not None and last is not node and
+                    getattr(last, 'lineno', None) == getattr(node, 'lineno', None)):
+                return False
+            env.last_stop = node
+        return True
+
+    def _on_step(self, env, node):
+        metrics = env.metrics
+        if metrics is not None:
+            metrics.steps += 1
+            if isinstance(node, ast.stmt):
+                metrics.statements += 1
+        self._fire(env, EVENT_STEP, node)
+
+    def _on_execution_end(self, env):
+        self.flush_output(env)
+        if env.metrics is not None and self.metrics is not None:
+            delta = env.metrics.take_delta()
+            with self._metrics_lock:
+                self.metrics.merge(delta)
+
+    def _fire(self, env, event, *args):
+        for hook in self.hooks.get(event):
+            hook(env, *args)
+        if env.hooks is not None:
+            for hook in env.hooks.get(event):
+                hook(env, *args)
+
+    def _build_dispatch(self):
+        handlers = dict([(k, getattr(self, name)) for k,name in self.HANDLERS.items()])
+        handlers.update(self._registered)
+        self._handlers = handlers
+        # registered handlers replace the direct evaluation of their nodes
+        self._overridden = tuple(self._registered)
+        self._direct = weakref.WeakKeyDictionary()
+        self._appends = weakref.WeakKeyDictionary()
+
+    def _resolve_handler(self, cls):
+        f = None
+        for base in getattr(cls, "__mro__", ()):
+            if base in self._handlers:
+                f = self._handlers[base]
+                break
+        self._handlers[cls] = f
+        return f
+
+    """Adds or overrides the handler of a node type (and of its subclasses).
+       handler(env, node) either pushes the node value into the environment,
+       or returns a generator, which is run as the node steps: it yields the
+       generators of its sub expressions and, finally, the node itself.
+    """
+    def register_handler(self, node_type, handler):
+        self._registered[node_type] = handler
+        self._build_dispatch()
+
+    """Restores the default handler of a node type"""
+    def unregister_handler(self, node_type):
+        self._registered.pop(node_type, None)
+        self._build_dispatch()
+
+    """Declares the attributes and methods of a host type which scripts can use.
+       Also applies to its subclasses.
+    """
+    def register_host_type(self, cls, attributes=(), methods=()):
+        self.host_types.register(cls, attributes, methods)
+
+    """Start counting runtime metrics, aggregated over all the executions.
+       Environments created from now on count their own metrics too.
+    """
+    def enable_metrics(self):
+        if self.metrics is None:
+            self.metrics = Metrics()
+        self.instrumented = True
+
+    """A dict snapshot of the aggregated metrics"""
+    def get_metrics(self):
+        with self._metrics_lock:
+            return self.metrics.snapshot()
+
+    """Register a hook for an event of pesci.metrics, for all environments"""
+    def add_hook(self, event, hook):
+        self.hooks.add(event, hook)
+        self.instrumented = True
+
+    def remove_hook(self, event, hook):
+        self.hooks.remove(event, hook)
+        self.instrumented = self.metrics is not None or bool(self.hooks)
 
     """Executes code until end"""
     def run(self, env, debug=False):
@@ -117,90 +350,148 @@ class Interpreter(object):
             except EnvExecEnd:
                 break
 
+    def _run_to_end(self, env):
+        self.run(env)
+        return env
+
+    """Runs the environment into a worker thread, returns a Future of it.
+       NB: an environment must not run into two threads at once.
+    """
+    def submit(self, env):
+        with self._executor_lock:
+            if self._executor is None:
+                if ThreadPoolExecutor is None:
+                    raise RuntimeError("submit needs the concurrent.futures module")
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            executor = self._executor
+        return executor.submit(self._run_to_end, env)
+
+    """Stops the worker threads of submit"""
+    def shutdown(self, wait=True):
+        with self._executor_lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait)
+
+    """Calls a PesciFunction from python code, running it until its end"""
+    def call_function(self, env, f, args=(), kwargs={}):
+        frames = env.frames
+        env.frames = []
+        try:
+            env.enter_call(f, None)
+            self._bind_arguments(env, f, list(args), dict(kwargs))
+            if self.instrumented or env.instrumented:
+                self._fire(env, EVENT_CALL, f, None)
+            env.frames.append(self._function_body(env, f))
+            while True:
+                try:
+                    self.step(env)
+                except EnvExecEnd:
+                    break
+
+            call = env.get_current_call()
+            retval = env.leave_call()
+            if self.instrumented or env.instrumented:
+                self._fire(env, EVENT_RETURN, call.func, retval)
+            return retval
+        finally:
+            env.frames = frames
+
+    """Executes the environment code as a native python code object.
+       budget is the maximum number of loop iterations, whitelist an optional
+       collection of the host callables the code is allowed to call.
+    """
+    def run_native(self, env, budget=None, whitelist=None):
+        from pesci.native import NativeCode
+        native = NativeCode.from_tree(env.code, budget is not None)
+        try:
+            native.run(self, env, budget, whitelist)
+        finally:
+            self.flush_output(env)
+
+    """Runs code once over columnar inputs: columns maps input names to
+       sequences of per-row values. Returns the assigned names columns.
+    """
+    def run_batch(self, code, columns, symbols={}):
+        # NB: pesci.batch depends on this module
+        from pesci.batch import BatchEvaluator
+        return BatchEvaluator(self, code, symbols).run(columns)
+
+    """Compiles a single expression into a reusable callable object, which
+       evaluates it against a dict of variables:
+
+       pred = interpreter.compile_expression("price > 10")
+       pred({'price':12})
+
+       whitelist: the host callables the expression can call, as for
+       run_native; None, the default, allows any builtin or variable.
+
+       The last MAX_EXPRESSIONS compiled expressions are cached.
+    """
+    def compile_expression(self, source, whitelist=None):
+        key = source if whitelist is None else (source, frozenset(whitelist))
+        with self._expressions_lock:
+            expr = self._expressions.pop(key, None)
+            if expr is not None:
+                self._expressions[key] = expr
+                return expr
+
+        from pesci.native import PesciExpression
+        expr = PesciExpression(self, source, BUILTINS, whitelist)
+        with self._expressions_lock:
+            self._expressions.pop(key, None)
+            if len(self._expressions) >= MAX_EXPRESSIONS:
+                self._expressions.popitem(last=False)
+            self._expressions[key] = expr
+        return expr
+
     """Launch interactive mode"""
     def run_interactive(self, env):
-        print "Pesci 0.1 over Python %s" % sys.version.split(" ")[0]
-        print "Emanuele Faranda <black.silver@hotmail.it>"
-        print "Type 'exit' to end interactive mode\n"
-
-        self._interactive = True
-        partial = ""
+        from pesci.interactive import run_interactive
+        self._interactive_envs.add(env)
+        try:
+            run_interactive(self, env)
+        finally:
+            self._interactive_envs.discard(env)
 
-        while self._interactive:
-            try:
-                if partial:
-                    prompt = "... "
-                else:
-                    prompt = ">>> "
-                cmd = raw_input(prompt)
-            except EOFError:
-                self._interactive = False
-            except KeyboardInterrupt as kint:
-                print kint
-                partial = ""
-            else:
-                # handle continuation lines
-                s = cmd.strip()
-                if s and s[-1] == ":":
-                    partial += cmd + "\n"
-                elif partial:
-                    if not cmd:
-                        # end of command
-                        cmd = partial
-                        partial = ""
-                    else:
-                        partial += cmd + "\n"
-
-                if cmd == "exit":
-                    self._interactive = False
-                elif not partial:
-                    # evaluate command
-                    try:
-                        code = PesciCode.from_string(cmd)
-                        env.setup(code.get_ast())
-                        self.run(env)
-                    except Exception as e:
-                        traceback.print_exc(file=sys.stdout)
-
-    """exits interactive mode"""
-    def stop(self):
-        self._interactive = False
+    """exits interactive mode, of env or, without it, of every environment"""
+    def stop(self, env=None):
+        envs = [env] if env is not None else list(self._interactive_envs)
+        for env in envs:
+            env.interactive = False
 
     """Respond to a print instruction"""
     def print_line(self, s):
-        print s
+        # a single write, not to mix up the lines of concurrent runs
+        sys.stdout.write(s + "\n")
+
+    """Print a line to the environment output"""
+    def write_line(self, env, s):
+        if env.output is None:
+            self.print_line(s)
+        else:
+            env.output.write_line(s)
+
+    def flush_output(self, env):
+        if env.output is not None:
+            env.output.flush()
 
     def _fold_expr(self, env, node):
-        # Symbol mapping to function
-        op2fnmap = {
-            ast.BinOp: self._statement_binop,
-            ast.BoolOp: self._statement_boolop,
-            ast.UnaryOp: self._statement_unaryop,
-            ast.Compare: self._statement_compare,
-            ast.Assign: self._statement_assign,
-            ast.AugAssign: self._statement_augassign,
-            ast.Print: self._statement_print,
-            ast.If: self._statement_if,
-            ast.Expr: self._statement_expr,
-            ast.FunctionDef: self._statement_funcdef,
-            ast.Call: self._statement_funcall,
-            ast.Return: self._statement_return,
-            ast.Dict: self._statement_dict,
-            ast.Tuple: self._statement_tuple,
-            ast.List: self._statement_list,
-            ast.Attribute: self._statement_attribute,
-            ast.Global: self._statement_global,
-            ast.While: self._statement_while,
-            ast.For: self._statement_for,
-            ast.Subscript: self._statement_subscript,
-        }
-
-        # search between complex ops
-        f = None
-        for k,v in op2fnmap.items():
-            if isinstance(node, k):
-                f = v
-                break
+        if (isinstance(node, ast.expr) and
+                (env.granularity or self.granularity) != GRANULARITY_NODE):
+            direct = self._direct.get(node)
+            if direct is None:
+                direct = self._direct[node] = all([isinstance(n, DIRECT_NODES) and
+                    not isinstance(n, self._overridden) for n in ast.walk(node)])
+            if direct:
+                env.push(self._eval_direct(env, node))
+                return None
+
+        try:
+            f = self._handlers[type(node)]
+        except KeyError:
+            f = self._resolve_handler(type(node))
 
         if f:
             # return a Generator or None
@@ -210,6 +501,56 @@ class Interpreter(object):
             v = self._base_value(env, node)
             env.push(v)
 
+    """Evaluates an expression made of DIRECT_NODES, like its handlers do"""
+    def _eval_direct(self, env, node):
+        if isinstance(node, (ast.Num, ast.Str, ast.Name)):
+            return self._base_value(env, node)
+        elif isinstance(node, ast.BinOp):
+            return self._perform_bin_op(self._eval_direct(env, node.left), node.op,
+                self._eval_direct(env, node.right))
+        elif isinstance(node, ast.BoolOp):
+            for value in node.values:
+                left = self._eval_direct(env, value)
+                if isinstance(node.op, ast.Or) and left:
+                    break
+                elif isinstance(node.op, ast.And) and not left:
+                    break
+            return left
+        elif isinstance(node, ast.UnaryOp):
+            return self._perform_unary(node.op, self._eval_direct(env, node.operand))
+        elif isinstance(node, ast.Compare):
+            left = self._eval_direct(env, node.left)
+            for op,comp in zip(node.ops, node.comparators):
+                right = self._eval_direct(env, comp)
+                if not self._perform_comparison(left, op, right):
+                    return False
+                left = right
+            return True
+        elif isinstance(node, ast.IfExp):
+            if self._eval_direct(env, node.test):
+                return self._eval_direct(env, node.body)
+            return self._eval_direct(env, node.orelse)
+        elif isinstance(node, ast.Tuple):
+            return tuple([self._eval_direct(env, val) for val in node.elts])
+        elif isinstance(node, ast.List):
+            return [self._eval_direct(env, val) for val in node.elts]
+        elif isinstance(node, ast.Dict):
+            values = [self._eval_direct(env, val) for val in node.values]
+            keys = [self._eval_direct(env, val) for val in node.keys]
+            return dict(zip(keys, values))
+        elif isinstance(node, ast.Attribute):
+            item = self._eval_direct(env, node.value)
+            return self.host_types.getattr(item, node.attr, env.bound_methods)
+        elif isinstance(node, ast.Subscript):
+            var = self._eval_direct(env, node.value)
+            sl = node.slice
+            if hasattr(sl, "value"):
+                return var[self._eval_direct(env, sl.value)]
+            lower, upper, step = [None if n is None else self._eval_direct(env, n)
+                for n in (sl.lower, sl.upper, sl.step)]
+            return var[lower:upper:step]
+        assert 0, "UNKNOWN! %s" % (node)
+
     def _base_value(self, env, node):
         if isinstance(node, (int, long, float, str, bool, list, tuple)) or node is None:
             return node
@@ -228,12 +569,9 @@ class Interpreter(object):
             assert 0, "UNKNOWN! %s" % (node)
 
     def _perform_bin_op(self, left, op, right):
-        ops = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow, ast.LShift, ast.RShift, ast.BitOr, ast.BitXor, ast.BitAnd, ast.FloorDiv)
-        mops = (operator.add, operator.sub, operator.mul, operator.div, operator.mod, operator.pow, operator.lshift, operator.rshift, operator.or_, operator.xor, operator.and_, operator.floordiv)
-
-        for i in range(len(ops)):
-            if isinstance(op, ops[i]):
-                return mops[i](left, right)
+        for k,f in BINARY_OPERATORS:
+            if isinstance(op, k):
+                return f(left, right)
         # TODO blablabla
         assert 0, "UNKNOWN BIN OP! %s" % (op)
 
@@ -249,29 +587,46 @@ class Interpreter(object):
             assert 0, "UNKNOWN UNARY OP! %s" % (op)
 
     def _perform_comparison(self, a, comp, b):
-        operator_in = lambda x,l: x in l
-        operator_not_in = lambda x,l: not (x in l)
-
-        ops = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Is, ast.IsNot, ast.In, ast.NotIn)
-        mops = (operator.eq, operator.ne, operator.lt, operator.le, operator.gt, operator.ge, operator.is_, operator.is_not, operator_in, operator_not_in)
-
-        for i in range(len(ops)):
-            if isinstance(comp, ops[i]):
-                return mops[i](a, b)
+        for k,f in COMPARISON_OPERATORS:
+            if isinstance(comp, k):
+                return f(a, b)
         assert 0, "BAD COMPARISON %s" % comp
 
     def _statement_expr(self, env, node):
         itr = self._fold_expr(env, node.value)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
         # expr is now on the stack, if any
+        yield node
+
+    """is node a "s = s + x" assignment, with a call-free x?"""
+    def _is_append(self, node):
+        append = self._appends.get(node)
+        if append is None:
+            target = node.targets[0]
+            value = node.value
+            append = self._appends[node] = (len(node.targets) == 1 and
+                isinstance(target, ast.Name) and isinstance(value, ast.BinOp) and
+                isinstance(value.op, ast.Add) and isinstance(value.left, ast.Name) and
+                value.left.id == target.id and
+                all([isinstance(n, DIRECT_NODES) and not isinstance(n, self._overridden)
+                    for n in ast.walk(value)]))
+        return append
 
     def _statement_assign(self, env, node):
+        if self._is_append(node) and env.is_string(node.targets[0].id):
+            # the right side cannot change the variable, so it can be appended
+            itr = self._fold_expr(env, node.value.right)
+            if itr: yield itr
+
+            val = env.pop()
+            vid = node.targets[0].id
+            if not (type(val) is str and env.append_string(vid, val)):
+                env.setvar(vid, self._perform_bin_op(env.getvar(vid), node.value.op, val))
+            yield node
+            return
+
         itr = self._fold_expr(env, node.value)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
 
         val = env.pop()
         # TODO what else is supposed to hold??
@@ -283,9 +638,7 @@ class Interpreter(object):
             l = []
             for v in val:
                 itr = self._fold_expr(env, v)
-                while itr:
-                    try: yield next(itr)
-                    except StopIteration: break
+                if itr: yield itr
                 l.append(env.pop())
             val = l
 
@@ -302,32 +655,27 @@ class Interpreter(object):
 
     def _statement_augassign(self, env, node):
         itr = self._fold_expr(env, node.value)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
 
         val = env.pop()
-        newval = self._perform_bin_op(env.getvar(node.target.id), node.op, val)
-        env.setvar(node.target.id, newval)
+        vid = node.target.id
+        if not (type(val) is str and isinstance(node.op, ast.Add) and
+                env.append_string(vid, val)):
+            newval = self._perform_bin_op(env.getvar(vid), node.op, val)
+            env.setvar(vid, newval)
         yield node
 
     def _statement_binop(self, env, node):
         itr = self._fold_expr(env, node.left)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
 
         l = env.pop()
         itr = self._fold_expr(env, node.op)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
 
         op = env.pop()
         itr = self._fold_expr(env, node.right)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
 
         r = env.pop()
         env.push(self._perform_bin_op(l, op, r))
@@ -340,9 +688,7 @@ class Interpreter(object):
         for i in range(len(node.values)):
             # get (i)th value
             itr = self._fold_expr(env, node.values[i])
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             left = env.pop()
 
             # exit as soon as you can
@@ -357,51 +703,51 @@ class Interpreter(object):
     def _statement_unaryop(self, env, node):
         op = node.op
         itr = self._fold_expr(env, node.operand)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
 
         operand = env.pop()
         env.push(self._perform_unary(op, operand))
         yield node
 
     def _statement_compare(self, env, node):
-        # need sequences for compare to distinguish between
-        # x < 4 < 3 and (x < 4) < 3
-        comparators = []
-        for comp in node.comparators:
-            itr = self._fold_expr(env, comp)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
-            comparators.append(env.pop())
-
-        # get the left side
+        # left to right evaluation: a < b < c is a < b and b < c, with b
+        # evaluated once and c only if a < b
         itr = self._fold_expr(env, node.left)
-        while itr:
-                try: yield next(itr)
-                except StopIteration: break
+        if itr: yield itr
         left = env.pop()
-        comparators.insert(0, left)
 
-        env.push(operator.truth(reduce(operator.and_,
-            [self._perform_comparison(comparators[i],
-                node.ops[i],
-                comparators[i+1]) for i in range(len(node.ops))],
-            1)))
+        result = True
+        for op,comp in zip(node.ops, node.comparators):
+            itr = self._fold_expr(env, comp)
+            if itr: yield itr
+            right = env.pop()
+
+            # exit as soon as you can
+            if not self._perform_comparison(left, op, right):
+                result = False
+                break
+            left = right
+
+        env.push(result)
         yield node
 
-    def _statement_print(self, env, node):
-        # NB: IGNORE node.dest, node.nl
+    def _statement_ifexp(self, env, node):
+        itr = self._fold_expr(env, node.test)
+        if itr: yield itr
+
+        # only the taken branch is evaluated
+        if env.pop():
+            itr = self._fold_expr(env, node.body)
+        else:
+            itr = self._fold_expr(env, node.orelse)
+        if itr: yield itr
+        yield node
+
+    """Joins print statement values into a line"""
+    def _format_print(self, values):
         v = []
         needsspace = False
-        for val in node.values:
-            itr = self._fold_expr(env, val)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
-
-            s = env.pop()
+        for s in values:
             if needsspace:
                 v.append(" ")
             else:
@@ -411,14 +757,21 @@ class Interpreter(object):
             else:
                 s = str(s)
             v.append(s)
-        self.print_line("".join(v))
+        return "".join(v)
+
+    def _statement_print(self, env, node):
+        # NB: IGNORE node.dest, node.nl
+        values = []
+        for val in node.values:
+            itr = self._fold_expr(env, val)
+            if itr: yield itr
+            values.append(env.pop())
+        self.write_line(env, self._format_print(values))
         yield node
 
     def _statement_if(self, env, node):
         itr = self._fold_expr(env, node.test)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
 
         cond = env.pop()
         if cond:
@@ -427,30 +780,30 @@ class Interpreter(object):
             to = node.orelse
         for i in to:
             itr = self._fold_expr(env, i)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
         yield node
 
     def _statement_funcdef(self, env, node):
-        # parse the arguments structure
-        args = [arg.id for arg in node.args.args if isinstance (arg, ast.Name)]
-
-        # NB: default n values are mapped to the last n arguments
-        default = [self._base_value(env, defaul) for defaul in node.args.defaults]
-        all_args = {'args':tuple(args), 'vararg':node.args.vararg, 'kwarg':node.args.kwarg, 'defaults':default}
-        f = PesciFunction(node.name, all_args, node.body)
-        env.setvar(f.name, f)
+        template = get_template(node)
+
+        # the defaults are evaluated once, at definition time
+        defaults = []
+        for default in template.defaults:
+            itr = self._fold_expr(env, default)
+            if itr: yield itr
+            defaults.append(env.pop())
+        env.setvar(template.name, PesciFunction(template, tuple(defaults)))
         yield node
 
-    def _statement_funcall(self, env, node):
+    """Evaluates the function and the arguments of a call.
+       Pushes a (function, args, kwargs) tuple.
+    """
+    def _fold_call(self, env, node):
         # get the args
         args = []
         for arg in node.args:
             itr = self._fold_expr(env, arg)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             args.append(env.pop())
         args = {"args":args, "kwargs":node.keywords, "star":node.starargs, "kstar":node.kwargs}
 
@@ -482,102 +835,153 @@ class Interpreter(object):
             f = env.getvar(node.func.id)
         else:
             itr = self._fold_expr(env, node.func)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             f = env.pop()
 
-        # handle builtins
-        if not isinstance(f, PesciFunction):
-            try:
-                getattr(f, PESCI_BUILTIN_FUNCTION)
-            except AttributeError:
-                pass
-            else:
-                # it's a decorated function, we pass interpreter and env
-                kwargs[PESCI_KEY_INTERPRETER] = self
-                kwargs[PESCI_KEY_ENV] = env
-            env.push(f(*allargs, **kwargs))
-            yield
-            return
+        env.push((f, allargs, kwargs))
 
-        # enter the function context
-        env.push_context()
-        toassign = list(f.args['args'])
-        #~ print "call %s = %s(%s <= %s)" % (f, node.func.id, f.args, args)
-
-        # bind default values
-        defaults = f.args['defaults']
-        argnames = f.args['args']
-        wasdef = []
-        k = len(argnames) - len(defaults)
-        for d in defaults:
-            env.setvar(argnames[k], d)
-            wasdef.append(argnames[k])
-            toassign.remove(argnames[k])
-            k += 1
-
-        # bind positional values
-        k = 0
-        for arg in allargs:
-            try:
-                argname = argnames[k]
-            except IndexError:
-                break
+    """Calls a python function from the environment"""
+    def _call_host(self, env, f, args, kwargs):
+        try:
+            getattr(f, PESCI_BUILTIN_FUNCTION)
+        except AttributeError:
+            pass
+        else:
+            # it's a decorated function, we pass interpreter and env
+            kwargs[PESCI_KEY_INTERPRETER] = self
+            kwargs[PESCI_KEY_ENV] = env
+
+        if env is None or not (self.instrumented or env.instrumented):
+            return f(*args, **kwargs)
+
+        start = time.time()
+        result = f(*args, **kwargs)
+        elapsed = time.time() - start
+        if env.metrics is not None:
+            env.metrics.host_calls += 1
+            env.metrics.host_time += elapsed
+        self._fire(env, EVENT_HOST_CALL, f, args, kwargs, elapsed)
+        return result
+
+    """Accounts the memory of a variable changed by its method, e.g. l.append(v)"""
+    def _account_change(self, env, node, f, args, kwargs):
+        func = node.func
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+            env.account_change(func.value.id, f, args, kwargs)
+
+    """Binds call arguments into the current context"""
+    def _bind_arguments(self, env, f, allargs, kwargs):
+        template = f.template
+        params = template.params
+        first_default = template.first_default
+
+        if len(allargs) > len(params) and not template.vararg:
+            raise BadFunctionCall(f)
 
-            env.setvar(argname, arg)
-            try:
-                toassign.remove(argname)
-            except ValueError:
-                pass
-            k += 1
-        remargs = allargs[k:]
+        # bind positional values, then the defaults of the other params
+        npos = min(len(allargs), len(params))
+        for i in xrange(npos):
+            env.setvar(params[i], allargs[i])
+        for i in xrange(max(npos, first_default), len(params)):
+            env.setvar(params[i], f.defaults[i - first_default])
 
         # bind keyword values
         skwargs = {}
         for k,v in kwargs.items():
-            if k in argnames:
-                if not k in toassign and not k in wasdef:
+            i = template.positions.get(k)
+            if i is not None:
+                if i < npos:
                     # double assignment
                     raise BadFunctionCall(f)
-            elif f.args['kwarg']:
+            elif template.kwarg:
                 skwargs[k] = v
             else:
                 raise BadFunctionCall(f)
-
             env.setvar(k, v)
-            try:
-                toassign.remove(k)
-            except ValueError:
-                pass
 
-        # expose remaining kwarg and vararg
-        if f.args['vararg']:
-            env.setvar(f.args['vararg'], remargs)
-        if f.args['kwarg']:
-            env.setvar(f.args['kwarg'], skwargs)
+        # the params without a value
+        for i in xrange(npos, first_default):
+            if not params[i] in kwargs:
+                raise BadFunctionCall(f)
 
-        if toassign:
-            raise BadFunctionCall(f)
+        # expose remaining kwarg and vararg
+        if template.vararg:
+            env.setvar(template.vararg, allargs[npos:])
+        if template.kwarg:
+            env.setvar(template.kwarg, skwargs)
 
-        # we are ready to jump!
+    def _function_body(self, env, f):
         for istr in f.body:
             itr = self._fold_expr(env, istr)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
+
+    def _statement_funcall(self, env, node):
+        itr = self._fold_call(env, node)
+        yield itr
+        f, allargs, kwargs = env.pop()
+
+        # handle builtins
+        if not isinstance(f, PesciFunction):
+            env.push(self._call_host(env, f, allargs, kwargs))
+            if env.memory is not None:
+                self._account_change(env, node, f, allargs, kwargs)
+            yield node
+            return
+
+        if self.tier_threshold is not None and self._get_tiers().count_call(env, f):
+            env.push(self._tiers.call(env, f, node, allargs, kwargs))
+            yield node
+            return
 
-        env.pop_context()
+        # enter the function context
+        env.enter_call(f, node)
+        self._bind_arguments(env, f, allargs, kwargs)
+        if self.instrumented or env.instrumented:
+            self._fire(env, EVENT_CALL, f, node)
+
+        # we are ready to jump!
+        yield self._function_body(env, f)
+
+        # the return value, if any
+        call = env.get_current_call()
+        retval = env.leave_call()
+        if self.instrumented or env.instrumented:
+            self._fire(env, EVENT_RETURN, call.func, retval)
+        env.push(retval)
         yield node
 
     def _statement_return(self, env, node):
-        itr = self._fold_expr(env, node.value)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if not env.get_call_depth():
+            raise InterpretError("'return' outside function")
+
+        if isinstance(node.value, ast.Call):
+            itr = self._fold_call(env, node.value)
+            yield itr
+            f, allargs, kwargs = env.pop()
+
+            if isinstance(f, PesciFunction):
+                # tail call: the new function replaces the current one into
+                # its call frame, so that the code stack does not grow
+                if self.instrumented or env.instrumented:
+                    # its result is the one of the new call, still unknown
+                    self._fire(env, EVENT_RETURN, env.get_current_call().func, None)
+                env.tail_call(f, node.value)
+                self._bind_arguments(env, f, allargs, kwargs)
+                if self.instrumented or env.instrumented:
+                    self._fire(env, EVENT_CALL, f, node.value)
+                env.frames.append(self._function_body(env, f))
+                yield node
+                return
+            val = self._call_host(env, f, allargs, kwargs)
+            if env.memory is not None:
+                self._account_change(env, node.value, f, allargs, kwargs)
+        else:
+            itr = self._fold_expr(env, node.value)
+            if itr: yield itr
+            val = env.pop()
 
-        # just to be explicit
-        env.push(env.pop())
+        # jump back to the caller
+        env.return_call(val)
         yield node
 
     def _statement_dict(self, env, node):
@@ -585,18 +989,14 @@ class Interpreter(object):
         values = []
         for val in node.values:
             itr = self._fold_expr(env, val)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             values.append(env.pop())
 
         # get the keys
         keys = []
         for val in node.keys:
             itr = self._fold_expr(env, val)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             keys.append(env.pop())
 
         # build the dict
@@ -608,9 +1008,7 @@ class Interpreter(object):
         l = []
         for val in node.elts:
             itr = self._fold_expr(env, val)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             l.append(env.pop())
         env.push(tuple(l))
         yield node
@@ -619,23 +1017,20 @@ class Interpreter(object):
         l = []
         for val in node.elts:
             itr = self._fold_expr(env, val)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             l.append(env.pop())
         env.push(l)
         yield node
 
     def _statement_attribute(self, env, node):
         itr = self._fold_expr(env, node.value)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
         item = env.pop()
+        env.push(self.host_types.getattr(item, node.attr, env.bound_methods))
+        yield node
 
-        if node.attr[0] == "_":
-            raise InterpretError("invalid attribute '%s'" % node.attr)
-        env.push(getattr(item, node.attr))
+    def _statement_pass(self, env, node):
+        # NB: a step, so that empty loops can be preempted
         yield node
 
     def _statement_global(self, env, node):
@@ -643,15 +1038,33 @@ class Interpreter(object):
             env.add_global(name)
         yield node
 
+    """the TierCompiler, imported on the first call of a tiering interpreter"""
+    def _get_tiers(self):
+        if self._tiers is None:
+            # NB: pesci.tier depends on this module
+            from pesci.tier import TierCompiler
+            self._tiers = TierCompiler(self)
+        return self._tiers
+
+    """the function whose loops are counted, if any"""
+    def _loop_owner(self, env):
+        if self.tier_threshold is None or not env.tiering or not env.get_call_depth():
+            return None
+        f = env.get_current_call().func
+        if f.tier != TIER_INTERPRETED:
+            return None
+        return f
+
     def _statement_while(self, env, node):
         running = True
+        owner = self._loop_owner(env)
 
         while running:
+            if owner is not None:
+                owner.loop_iterations += 1
             # get the condition
             itr = self._fold_expr(env, node.test)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             cond = env.pop()
 
             if cond == True:
@@ -663,17 +1076,13 @@ class Interpreter(object):
             # run the selected body
             for istr in torun:
                 itr = self._fold_expr(env, istr)
-                while itr:
-                    try: yield next(itr)
-                    except StopIteration: break
+                if itr: yield itr
         yield node
 
     def _statement_for(self, env, node):
         # get the iterator
         itr = self._fold_expr(env, node.iter)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
         sequence = env.pop()
 
         # get the left side variables
@@ -686,7 +1095,10 @@ class Interpreter(object):
         lt = len(targets)
 
         # run the loop
+        owner = self._loop_owner(env)
         for it in sequence:
+            if owner is not None:
+                owner.loop_iterations += 1
             # assign the variables
             if lt == 1:
                 env.setvar(targets[0], it)
@@ -697,24 +1109,18 @@ class Interpreter(object):
             # run the body
             for istr in node.body:
                 itr = self._fold_expr(env, istr)
-                while itr:
-                    try: yield next(itr)
-                    except StopIteration: break
+                if itr: yield itr
         else:
             # run orelse
             for istr in node.orelse:
                 itr = self._fold_expr(env, istr)
-                while itr:
-                    try: yield next(itr)
-                    except StopIteration: break
+                if itr: yield itr
         yield node
 
     def _statement_subscript(self, env, node):
         # get the variable
         itr = self._fold_expr(env, node.value)
-        while itr:
-            try: yield next(itr)
-            except StopIteration: break
+        if itr: yield itr
         var = env.pop()
         sl = node.slice
 
@@ -722,28 +1128,20 @@ class Interpreter(object):
         if hasattr(sl, "value"):
             # single index
             itr = self._fold_expr(env, sl.value)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             val = env.pop()
             env.push(var[val])
         else:
             # multiple indexes
             itr = self._fold_expr(env, sl.lower)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             lower = env.pop()
 
             itr = self._fold_expr(env, sl.upper)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             upper = env.pop()
 
             itr = self._fold_expr(env, sl.step)
-            while itr:
-                try: yield next(itr)
-                except StopIteration: break
+            if itr: yield itr
             step = env.pop()
             env.push(var[lower:upper:step])
@@ -0,0 +1,108 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import ast
+
+"""
+Compact representation of validated programs.
+
+Each ast node is replaced by an instance of a __slots__ subclass of its own
+type, so that nodes keep no __dict__ while they are still ast nodes to the
+interpreter, the validator and the python compiler. Moreover:
+  - nodes without fields (operators, contexts) are shared singletons
+  - names and strings are interned
+  - equal constants are shared into a per program table
+"""
+
+# compact classes, per ast class
+_compact_classes = {}
+_compact_types = set()
+
+def _rebuild(cls, state):
+    node = cls()
+    for k,v in state:
+        setattr(node, k, v)
+    return node
+
+def _reduce(self):
+    state = [(k, getattr(self, k)) for k in self.__slots__ if hasattr(self, k)]
+    return (_rebuild, (self.__class__, state))
+
+def compact_class(cls):
+    compact = _compact_classes.get(cls)
+    if not compact:
+        compact = type(cls.__name__, (cls,), {
+            '__slots__': cls._fields + cls._attributes,
+            '__module__': __name__,
+            '__reduce__': _reduce,
+        })
+        _compact_classes[cls] = compact
+        _compact_types.add(compact)
+    return compact
+
+"""Builds a compact copy of a tree"""
+class Compactor(object):
+    def __init__(self):
+        self._singletons = {}
+        self._constants = {}
+
+    def _constant(self, val):
+        if isinstance(val, str):
+            return intern(val)
+        key = (type(val), val)
+        if isinstance(val, (float, complex)):
+            # 0.0 == -0.0, keep the sign apart
+            key += (repr(val),)
+        try:
+            return self._constants.setdefault(key, val)
+        except TypeError:
+            # unhashable
+            return val
+
+    def _value(self, val):
+        if isinstance(val, ast.AST):
+            return self.compact(val)
+        elif isinstance(val, list):
+            return [self._value(v) for v in val]
+        elif val is None:
+            return None
+        return self._constant(val)
+
+    def compact(self, node):
+        cls = node.__class__
+        if cls in _compact_types:
+            # already compact
+            return node
+
+        if not cls._fields and not cls._attributes:
+            single = self._singletons.get(cls)
+            if not single:
+                single = self._singletons[cls] = cls()
+            return single
+
+        new = compact_class(cls)()
+        for k in cls._fields + cls._attributes:
+            if hasattr(node, k):
+                setattr(new, k, self._value(getattr(node, k)))
+        return new
+
+def compact(tree):
+    return Compactor().compact(tree)
@@ -0,0 +1,194 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import sys
+from pesci.builder import StringBuilder
+
+"""
+Memory accounting of an environment.
+
+Values are sized once, when they are written into a context, so that the
+totals are always known without walking the environment. The data stack only
+holds the operands of the running expressions, and is not accounted.
+
+The sizes are estimates: objects shared among variables are counted for each
+of them, and the sizes of the containers are cached by object. The growth of
+a variable through its methods (e.g. l.append(v), d.update(e)) is added to
+its size; the other changes made to an object after it has been stored, e.g.
+by a host function, are not seen.
+"""
+
+# containers are walked up to this depth
+MAX_SIZE_DEPTH = 4
+# larger containers are sized from a sample of their items
+MAX_SIZE_ITEMS = 100
+# container sizes cached per account, before clearing them
+MAX_CACHED_SIZES = 1024
+
+CONTAINER_TYPES = (dict, list, tuple, set, frozenset)
+# the methods which only add their arguments to a container
+GROWING_METHODS = frozenset(("append", "extend", "insert", "add", "update", "setdefault"))
+# the other methods which change a container
+CHANGING_METHODS = frozenset(("pop", "popitem", "remove", "discard", "clear",
+    "difference_update", "intersection_update", "symmetric_difference_update"))
+
+"""sizes is an optional cache of the container sizes, id -> (container, size)"""
+def estimate_size(value, depth=MAX_SIZE_DEPTH, sizes=None):
+    if isinstance(value, StringBuilder):
+        return value.estimate_size()
+    if depth <= 0 or not isinstance(value, CONTAINER_TYPES):
+        return sys.getsizeof(value)
+
+    if sizes is not None:
+        cached = sizes.get(id(value))
+        if cached is not None and cached[0] is value:
+            return cached[1]
+
+    size = sys.getsizeof(value)
+    is_dict = isinstance(value, dict)
+    items = value.iteritems() if is_dict else iter(value)
+
+    sampled = 0
+    total = 0
+    nested = False
+    for item in items:
+        if sampled == MAX_SIZE_ITEMS:
+            break
+        if is_dict:
+            key, item = item
+            total += estimate_size(key, depth-1, sizes)
+        nested = nested or isinstance(item, CONTAINER_TYPES)
+        total += estimate_size(item, depth-1, sizes)
+        sampled += 1
+    if sampled:
+        total = total * len(value) / sampled
+    size += total
+
+    # only the containers of containers are worth caching
+    if nested and sizes is not None:
+        _cache_size(sizes, value, size)
+    return size
+
+def _cache_size(sizes, value, size):
+    if len(sizes) >= MAX_CACHED_SIZES:
+        sizes.clear()
+    # NB: the cache keeps the value alive, so its id is not reused
+    sizes[id(value)] = (value, size)
+
+class MemoryAccount(object):
+    """soft_limit: on_soft_limit(env, used) is called when it is crossed
+       hard_limit: the execution is aborted with EnvMemoryExceeded
+    """
+    def __init__(self, soft_limit=None, hard_limit=None, on_soft_limit=None):
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.on_soft_limit = on_soft_limit
+        self._over_soft = False
+        self.reset()
+
+    def reset(self):
+        # name -> size, per context
+        self.contexts = []
+        self.context_totals = []
+        self.total = 0
+        # id -> (container, size), see estimate_size
+        self._sizes = {}
+
+    """forget the cached sizes, and the values they keep alive"""
+    def clear_sizes(self):
+        self._sizes.clear()
+
+    def set(self, level, key, val):
+        self._store(level, key, estimate_size(val, sizes=self._sizes))
+
+    def _store(self, level, key, size):
+        sizes = self.contexts[level]
+        delta = size - sizes.get(key, 0)
+        sizes[key] = size
+        self.context_totals[level] += delta
+        self.total += delta
+
+    """the container of a variable was changed by one of its methods"""
+    def change(self, level, key, container, method, args, kwargs):
+        if not isinstance(container, CONTAINER_TYPES):
+            return
+        sizes = self._sizes
+        if method in GROWING_METHODS and key in self.contexts[level]:
+            size = self.contexts[level][key]
+            for val in args:
+                size += estimate_size(val, sizes=sizes)
+            for k,val in kwargs.iteritems():
+                size += estimate_size(k) + estimate_size(val, sizes=sizes)
+        elif method in GROWING_METHODS or method in CHANGING_METHODS:
+            sizes.pop(id(container), None)
+            size = estimate_size(container, sizes=sizes)
+        else:
+            return
+        _cache_size(sizes, container, size)
+        self._store(level, key, size)
+
+    def discard(self, level, key):
+        size = self.contexts[level].pop(key, 0)
+        self.context_totals[level] -= size
+        self.total -= size
+
+    def push_context(self):
+        self.contexts.append({})
+        self.context_totals.append(0)
+
+    def pop_context(self):
+        self.contexts.pop()
+        self.total -= self.context_totals.pop()
+
+    """size again all the values of the contexts"""
+    def recount(self, contexts):
+        self.reset()
+        for level,context in enumerate(contexts):
+            self.push_context()
+            for key,val in context.iteritems():
+                if key[0] != "_":
+                    self.set(level, key, val)
+
+    """returns the exceeded hard limit, if any"""
+    def check(self, env):
+        if self.hard_limit is not None and self.total > self.hard_limit:
+            return self.hard_limit
+        if self.soft_limit is not None:
+            if self.total > self.soft_limit:
+                if not self._over_soft:
+                    self._over_soft = True
+                    if self.on_soft_limit is not None:
+                        self.on_soft_limit(env, self.total)
+            else:
+                self._over_soft = False
+        return None
+
+    """the n biggest variables, as (size, name, context level) tuples"""
+    def get_top(self, n=10):
+        variables = []
+        for level,sizes in enumerate(self.contexts):
+            for key,size in sizes.iteritems():
+                variables.append((size, key, level))
+        variables.sort(reverse=True)
+        return variables[:n]
+
+    def snapshot(self):
+        return {'total':self.total, 'contexts':list(self.context_totals)}
@@ -0,0 +1,94 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+"""
+Runtime counters and event hooks.
+
+Both are disabled by default: an interpreter or environment without metrics
+and hooks only pays an attribute check per step.
+"""
+
+# events, with the hook arguments
+EVENT_STEP = "step"             # hook(env, node)
+EVENT_CALL = "call"             # hook(env, func, node)
+EVENT_RETURN = "return"         # hook(env, func, retval), None on tail calls
+EVENT_HOST_CALL = "host_call"   # hook(env, func, args, kwargs, elapsed)
+EVENTS = (EVENT_STEP, EVENT_CALL, EVENT_RETURN, EVENT_HOST_CALL)
+
+# summed counters and maximum values
+COUNTERS = ('steps', 'statements', 'pesci_calls', 'host_calls',
+ 'context_pushes', 'exceptions', 'host_time')
+MAXIMA = ('max_stack_depth', 'max_call_depth')
+
+class Metrics(object):
+    __slots__ = COUNTERS + MAXIMA + ('_mark',)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        for k in COUNTERS + MAXIMA:
+            setattr(self, k, 0)
+        self._mark = None
+
+    """add other counters to these ones"""
+    def merge(self, other):
+        for k in COUNTERS:
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+        for k in MAXIMA:
+            setattr(self, k, max(getattr(self, k), getattr(other, k)))
+
+    """the metrics since the last call"""
+    def take_delta(self):
+        delta = Metrics()
+        mark = self._mark or {}
+        for k in COUNTERS:
+            setattr(delta, k, getattr(self, k) - mark.get(k, 0))
+        for k in MAXIMA:
+            setattr(delta, k, getattr(self, k))
+        self._mark = self.snapshot()
+        return delta
+
+    def snapshot(self):
+        return dict([(k, getattr(self, k)) for k in COUNTERS + MAXIMA])
+
+"""Hook callbacks, per event"""
+class Hooks(object):
+    def __init__(self):
+        self._hooks = {}
+
+    def add(self, event, hook):
+        if not event in EVENTS:
+            raise ValueError("unknown event '%s'" % event)
+        self._hooks.setdefault(event, []).append(hook)
+
+    def remove(self, event, hook):
+        hooks = self._hooks.get(event, [])
+        if hook in hooks:
+            hooks.remove(hook)
+            if not hooks:
+                del self._hooks[event]
+
+    def get(self, event):
+        return self._hooks.get(event, ())
+
+    def __nonzero__(self):
+        return bool(self._hooks)
@@ -0,0 +1,343 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import ast
+import copy
+import types
+import weakref
+from pesci.errors import EnvBudgetExceeded, InterpretError, PesciSyntaxError
+from pesci.code import PesciFunction
+from pesci.proxy import is_denied_attribute
+from pesci.validator import Validator
+
+"""
+Native execution mode: the validated PesciCode tree is rewritten and compiled
+into a real python code object, which then runs into the environment global
+context at nearly native speed.
+
+The rewrite keeps the interpreter sandbox:
+  - underscore names and attributes are rejected at compile time
+  - attributes are read and assigned through the interpreter host types,
+    which deny the ones of functions, methods and code objects leading to
+    the host internals (func_globals, im_self, ...)
+  - every call goes through the runtime, which passes the interpreter and
+    environment to @pesci_function functions and checks the host whitelist:
+    by default, the callables of the environment when the run starts. The
+    callables given as arguments, e.g. map(f, l) or sorted(l, key=f), are
+    called back through the runtime too
+  - print statements go to the environment output
+  - loops optionally count their iterations against a budget
+  - while loops run while their condition == True, *args parameters are
+    lists, assigned lists are copies and a += b is a = a + b, as into the
+    interpreter
+
+Runtime helpers are exposed as underscore builtins, so that the script itself
+cannot reach them. They are plain closures, which do not lead back to the
+runtime object.
+
+NB: native functions use python lexical scoping, so they cannot see the local
+variables of their caller, as interpreted PesciFunctions do. Their recursion
+is also bound by the python stack.
+"""
+
+NATIVE_CALL = "__pesci_call"
+NATIVE_PRINT = "__pesci_print"
+NATIVE_TICK = "__pesci_tick"
+NATIVE_GETATTR = "__pesci_getattr"
+NATIVE_SETATTR = "__pesci_setattr"
+NATIVE_LIST = "__pesci_list"
+NATIVE_COPY = "__pesci_copy"
+
+# compiled code objects, per ast tree
+_native_cache = weakref.WeakKeyDictionary()
+
+class NativeTransformer(ast.NodeTransformer):
+    def __init__(self, budget_checks=False):
+        self.budget_checks = budget_checks
+
+    def _check_name(self, node, name):
+        if name and name[0] == "_":
+            self._reject(node)
+
+    def _reject(self, node):
+        raise PesciSyntaxError(node, getattr(node, "lineno", 0), getattr(node, "col_offset", 0))
+
+    def _runtime_call(self, helper, args):
+        return ast.Call(func=ast.Name(id=helper, ctx=ast.Load()), args=args,
+            keywords=[], starargs=None, kwargs=None)
+
+    def visit_Name(self, node):
+        self._check_name(node, node.id)
+        return node
+
+    def visit_Attribute(self, node):
+        if is_denied_attribute(node.attr):
+            self._reject(node)
+        if not isinstance(node.ctx, ast.Load):
+            # only the plain assignments, see visit_Assign
+            self._reject(node)
+        self.generic_visit(node)
+        get = self._runtime_call(NATIVE_GETATTR, [node.value, ast.Str(s=node.attr)])
+        return ast.copy_location(get, node)
+
+    def visit_Assign(self, node):
+        target = node.targets[0]
+        if len(node.targets) == 1 and isinstance(target, ast.Attribute):
+            if is_denied_attribute(target.attr):
+                self._reject(target)
+            put = self._runtime_call(NATIVE_SETATTR, [self.visit(target.value),
+                ast.Str(s=target.attr), self._copy_list(self.visit(node.value))])
+            return ast.copy_location(ast.Expr(value=put), node)
+        self.generic_visit(node)
+        # the interpreter assigns a copy of the lists
+        node.value = self._copy_list(node.value)
+        return node
+
+    def _copy_list(self, value):
+        return ast.copy_location(self._runtime_call(NATIVE_COPY, [value]), value)
+
+    def visit_AugAssign(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.target, ast.Name):
+            return node
+        # the interpreter never changes the value in place
+        value = ast.BinOp(left=ast.Name(id=node.target.id, ctx=ast.Load()), op=node.op,
+            right=node.value)
+        assign = ast.Assign(targets=[node.target], value=ast.copy_location(value, node))
+        return ast.copy_location(assign, node)
+
+    def visit_Global(self, node):
+        for name in node.names:
+            self._check_name(node, name)
+        return node
+
+    def visit_FunctionDef(self, node):
+        self._check_name(node, node.name)
+        self._check_name(node, node.args.vararg)
+        self._check_name(node, node.args.kwarg)
+        self.generic_visit(node)
+        if node.args.vararg:
+            node.body.insert(0, ast.copy_location(self._list_vararg(node.args.vararg), node))
+        return node
+
+    def _list_vararg(self, name):
+        return ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())],
+            value=self._runtime_call(NATIVE_LIST, [ast.Name(id=name, ctx=ast.Load())]))
+
+    def visit_keyword(self, node):
+        self._check_name(node.value, node.arg)
+        self.generic_visit(node)
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        call = ast.Call(func=ast.Name(id=NATIVE_CALL, ctx=ast.Load()),
+            args=[node.func] + node.args, keywords=node.keywords,
+            starargs=node.starargs, kwargs=node.kwargs)
+        return ast.copy_location(call, node)
+
+    def visit_Print(self, node):
+        # NB: IGNORE node.dest, node.nl
+        self.generic_visit(node)
+        stmt = ast.Expr(value=self._runtime_call(NATIVE_PRINT, node.values))
+        return ast.copy_location(stmt, node)
+
+    def _visit_loop(self, node):
+        self.generic_visit(node)
+        if self.budget_checks:
+            # the loop back-edge
+            tick = ast.Expr(value=self._runtime_call(NATIVE_TICK, []))
+            node.body.insert(0, ast.copy_location(tick, node))
+        return node
+
+    def visit_While(self, node):
+        node = self._visit_loop(node)
+        # the interpreter loops while the condition == True, not while it
+        # is true
+        node.test = ast.copy_location(ast.Compare(left=node.test, ops=[ast.Eq()],
+            comparators=[ast.Num(n=True)]), node.test)
+        return node
+
+    visit_For = _visit_loop
+
+"""the value to assign: lists are copied"""
+def _copy_list(val):
+    if isinstance(val, list):
+        return list(val)
+    return val
+
+"""wraps a runtime method, without exposing the runtime as im_self"""
+def _closure(method):
+    def helper(*args, **kwargs):
+        return method(*args, **kwargs)
+    return helper
+
+"""the callables of a context, allowed by default"""
+def _default_whitelist(context):
+    whitelist = set()
+    for val in context.values():
+        if callable(val):
+            try:
+                whitelist.add(val)
+            except TypeError:
+                # unhashable
+                pass
+    return whitelist
+
+"""Runtime support of a native code run"""
+class NativeRuntime(object):
+    def __init__(self, interpreter, env, budget=None, whitelist=None):
+        self.interpreter = interpreter
+        self.env = env
+        self.budget = budget
+        self.ticks = 0
+        if whitelist is not None:
+            whitelist = set(whitelist)
+        self.whitelist = whitelist
+
+    def builtins(self):
+        return {NATIVE_CALL:_closure(self.call), NATIVE_PRINT:_closure(self.print_values),
+            NATIVE_TICK:_closure(self.tick), NATIVE_GETATTR:_closure(self.getattr),
+            NATIVE_SETATTR:_closure(self.setattr), NATIVE_LIST:list, NATIVE_COPY:_copy_list}
+
+    def _is_script_function(self, f):
+        return (isinstance(f, types.FunctionType) and self.env is not None and
+            f.func_globals is self.env.get_global_context())
+
+    def _is_allowed(self, f):
+        # functions defined by the script itself
+        if self._is_script_function(f):
+            return True
+
+        # methods of the script values, but not of classes, modules and the
+        # interpreter internals
+        owner = getattr(f, "__self__", None)
+        if owner is not None and not isinstance(owner, (type, types.ClassType, types.ModuleType)) \
+                and not owner.__class__.__module__.startswith("pesci."):
+            return True
+
+        try:
+            return f in self.whitelist
+        except TypeError:
+            return False
+
+    def call(self, *args, **kwargs):
+        f = args[0]
+        args = args[1:]
+
+        if isinstance(f, PesciFunction):
+            return self.interpreter.call_function(self.env, f, args, kwargs)
+        if self.whitelist is not None:
+            if not self._is_allowed(f):
+                raise InterpretError("call to '%s' not allowed" % f)
+            # the host may call them back, e.g. map(f, l)
+            args = [self._guard(arg) for arg in args]
+            kwargs = dict([(k, self._guard(v)) for k,v in kwargs.items()])
+        return self.interpreter._call_host(self.env, f, args, kwargs)
+
+    """the callable value given to a host function, checked when called"""
+    def _guard(self, value):
+        if not callable(value) or self._is_script_function(value):
+            return value
+        def trampoline(*args, **kwargs):
+            return self.call(value, *args, **kwargs)
+        return trampoline
+
+    def getattr(self, obj, name):
+        bound_methods = self.env.bound_methods if self.env is not None else None
+        return self.interpreter.host_types.getattr(obj, name, bound_methods)
+
+    def setattr(self, obj, name, value):
+        self.interpreter.host_types.setattr(obj, name, value)
+
+    def print_values(self, *values):
+        self.interpreter.write_line(self.env, self.interpreter._format_print(values))
+
+    def tick(self):
+        self.ticks += 1
+        if self.budget is not None and self.ticks > self.budget:
+            raise EnvBudgetExceeded(self.env, self.budget)
+
+class NativeCode(object):
+    def __init__(self, tree, budget_checks=False):
+        self.budget_checks = budget_checks
+
+        # NB: the interpreter keeps using the original tree
+        tree = NativeTransformer(budget_checks).visit(copy.deepcopy(tree))
+        ast.fix_missing_locations(tree)
+        try:
+            self.code = compile(tree, "<pesci>", mode="exec")
+        except SyntaxError as e:
+            raise InterpretError(e)
+
+    """Get the native code of a validated tree, compiling it only once"""
+    @staticmethod
+    def from_tree(tree, budget_checks=False):
+        compiled = _native_cache.setdefault(tree, {})
+        native = compiled.get(budget_checks)
+        if not native:
+            native = NativeCode(tree, budget_checks)
+            compiled[budget_checks] = native
+        return native
+
+    def run(self, interpreter, env, budget=None, whitelist=None):
+        if budget is not None and not self.budget_checks:
+            raise InterpretError("code compiled without budget checks")
+
+        context = env.get_global_context()
+        if whitelist is None:
+            whitelist = _default_whitelist(context)
+        runtime = NativeRuntime(interpreter, env, budget, whitelist)
+        env.untrack_changes()
+        context['__builtins__'] = runtime.builtins()
+        try:
+            exec self.code in context
+        finally:
+            if env.memory is not None:
+                env.recount_memory()
+
+"""A compiled expression, evaluated against a dict of variables.
+   The dict is used as it is as the local namespace, builtins are globals.
+   whitelist: the host callables the expression can call; None, the default,
+   for any callable of the builtins and of the variables.
+"""
+class PesciExpression(object):
+    def __init__(self, interpreter, source, builtins, whitelist=None):
+        self.source = source
+
+        tree = ast.parse(source, mode="eval")
+        Validator().validate(tree)
+        tree = NativeTransformer().visit(tree)
+        ast.fix_missing_locations(tree)
+        self.code = compile(tree, "<pesci>", mode="eval")
+
+        self._globals = dict(builtins)
+        self._globals['__builtins__'] = NativeRuntime(interpreter, None,
+            whitelist=whitelist).builtins()
+
+    def __call__(self, variables={}):
+        try:
+            return eval(self.code, self._globals, variables)
+        except NameError as e:
+            raise InterpretError(e)
+
+    def __str__(self):
+        return "PesciExpression: %s" % self.source
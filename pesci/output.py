@@ -0,0 +1,140 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import sys
+from collections import deque
+
+"""
+Output sinks receive the lines printed by the code running into an
+environment. Give one to Interpreter.create_env to capture or redirect the
+environment output; without a sink, lines go to Interpreter.print_line.
+"""
+
+# CallbackSink flush policies
+FLUSH_LINE = "line"
+FLUSH_SIZE = "size"
+FLUSH_MANUAL = "manual"
+
+class OutputSink(object):
+    """Receives a printed line, without the trailing newline"""
+    def write_line(self, s):
+        raise NotImplementedError()
+
+    """Called at the end of each execution"""
+    def flush(self):
+        pass
+
+class NullSink(OutputSink):
+    """Discards any output"""
+    def write_line(self, s):
+        pass
+
+class StreamSink(OutputSink):
+    """Buffered writer to a file-like object, stdout by default"""
+    def __init__(self, stream=None, buffer_size=8192):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
+
+    def write_line(self, s):
+        self._buffer.append(s)
+        self._buffer.append("\n")
+        self._size += len(s) + 1
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            stream = self.stream or sys.stdout
+            stream.write("".join(self._buffer))
+            self._buffer = []
+            self._size = 0
+
+class CaptureSink(OutputSink):
+    """Keeps all the output in memory"""
+    def __init__(self):
+        self._lines = []
+
+    def write_line(self, s):
+        self._lines.append(s)
+
+    def get_lines(self):
+        return list(self._lines)
+
+    def getvalue(self):
+        if not self._lines:
+            return ""
+        return "\n".join(self._lines) + "\n"
+
+    def clear(self):
+        self._lines = []
+
+class RingBufferSink(CaptureSink):
+    """Keeps only the most recent output, up to max_bytes characters"""
+    def __init__(self, max_bytes=65536):
+        self.max_bytes = max_bytes
+        self._lines = deque()
+        self._size = 0
+        # number of discarded lines
+        self.dropped = 0
+
+    def write_line(self, s):
+        self._lines.append(s)
+        self._size += len(s) + 1
+        while self._size > self.max_bytes and self._lines:
+            self._size -= len(self._lines.popleft()) + 1
+            self.dropped += 1
+
+    def clear(self):
+        self._lines = deque()
+        self._size = 0
+
+class CallbackSink(OutputSink):
+    """Streams the output to callback(text).
+       policy tells when the output is passed:
+         FLUSH_LINE     on every line
+         FLUSH_SIZE     when at least buffer_size characters are buffered
+         FLUSH_MANUAL   only on flush, i.e. at the end of each execution
+    """
+    def __init__(self, callback, policy=FLUSH_LINE, buffer_size=8192):
+        self.callback = callback
+        self.policy = policy
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
+
+    def write_line(self, s):
+        if self.policy == FLUSH_LINE:
+            self.callback(s + "\n")
+            return
+
+        self._buffer.append(s + "\n")
+        self._size += len(s) + 1
+        if self.policy == FLUSH_SIZE and self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            text = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self.callback(text)
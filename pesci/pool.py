@@ -0,0 +1,111 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import threading
+import time
+from pesci.errors import EnvPoolExhausted
+
+"""
+A pool of ready to use environments, preloaded with the same symbols.
+
+Released environments are restored to their preloaded state by undoing only
+the names the script changed, so that a steady state acquire/release cycle
+reuses the very same environments. The settings changed on an acquired
+environment (metrics, hooks, profiler, memory accounting, limits...) are set
+back to their values at creation, see ENV_SETTINGS.
+
+pool = EnvironmentPool(interpreter, symbols, size=16)
+with pool.environment(code) as env:
+    interpreter.run(env)
+"""
+
+# the per environment settings which do not outlive a release
+ENV_SETTINGS = ("max_call_depth", "metrics", "hooks", "instrumented", "profiler",
+ "memory", "granularity", "tiering", "interactive")
+
+class EnvironmentPool(object):
+    def __init__(self, interpreter, symbols={}, size=8):
+        self.interpreter = interpreter
+        self.symbols = symbols
+        self.size = size
+
+        # env -> its settings at creation
+        self._settings = {}
+        self._cond = threading.Condition(threading.Lock())
+        self._free = [self._create_env() for i in range(size)]
+
+    def _create_env(self):
+        env = self.interpreter.create_env(symbols=self.symbols)
+        env.snapshot()
+        self._settings[env] = dict([(name, getattr(env, name)) for name in ENV_SETTINGS])
+        return env
+
+    """Get an environment, set up to run code. If none is free, waits for
+       one up to timeout seconds (forever when None).
+    """
+    def acquire(self, code=None, output=None, timeout=None):
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self._cond:
+            while not self._free:
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise EnvPoolExhausted(self)
+                    self._cond.wait(remaining)
+            env = self._free.pop()
+
+        if code:
+            env.setup(code.get_ast())
+        env.output = output
+        return env
+
+    """Give back an environment got from acquire"""
+    def release(self, env):
+        env.restore()
+        env.output = None
+        for name,value in self._settings.get(env, {}).iteritems():
+            if getattr(env, name) is not value:
+                setattr(env, name, value)
+
+        with self._cond:
+            self._free.append(env)
+            self._cond.notify()
+
+    def environment(self, code=None, output=None, timeout=None):
+        return _PooledEnvironment(self, self.acquire(code, output, timeout))
+
+    def get_free_count(self):
+        return len(self._free)
+
+class _PooledEnvironment(object):
+    def __init__(self, pool, env):
+        self.pool = pool
+        self.env = env
+
+    def __enter__(self):
+        return self.env
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self.env)
@@ -0,0 +1,105 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import signal
+import sys
+
+"""
+A sampling profiler: every interval steps, or every timer seconds of CPU
+time, it records the current PesciFunction call stack with the line numbers
+of the active nodes. Samples are aggregated as collapsed stacks, e.g.
+
+<module>:12;score:4;tax:2 31
+
+which is the input format of flame graph tools.
+
+The interpreter decrements the countdown of the attached profiler at each
+step, calling expire once it runs out: there is no per step callback, nor
+hooks which would keep the functions out of the compiled tier. The timer
+only zeroes the countdown, so that the next step takes the sample.
+"""
+
+MODULE_FRAME = "<module>"
+
+class SamplingProfiler(object):
+    def __init__(self, interval=1000, timer=None):
+        self.interval = interval
+        self.timer = timer
+        # steps before the next sample
+        self.countdown = self._get_interval()
+        self._samples = {}
+        self._targets = []
+
+    """Start profiling an Interpreter or an ExecutionEnvironment"""
+    def attach(self, target):
+        target.profiler = self
+        self._targets.append(target)
+
+        if self.timer and len(self._targets) == 1:
+            # NB: signals are only delivered to the main thread
+            signal.signal(signal.SIGPROF, self._on_timer)
+            signal.setitimer(signal.ITIMER_PROF, self.timer, self.timer)
+
+    def detach(self):
+        if self.timer and self._targets:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        for target in self._targets:
+            if target.profiler is self:
+                target.profiler = None
+        self._targets = []
+
+    def _get_interval(self):
+        # the timer decides when to sample
+        return sys.maxint if self.timer else self.interval
+
+    def _on_timer(self, signum, frame):
+        self.countdown = 0
+
+    """Called by the interpreter when the countdown runs out at node"""
+    def expire(self, env, node):
+        self.countdown = self._get_interval()
+        self.sample(env, node)
+
+    """Record the current stack of env, running node"""
+    def sample(self, env, node):
+        names = [MODULE_FRAME]
+        lines = []
+        for call in env.get_calls():
+            names.append(call.func.name)
+            lines.append(getattr(call.node, "lineno", 0))
+        lines.append(getattr(node, "lineno", 0))
+
+        stack = ";".join(["%s:%d" % frame for frame in zip(names, lines)])
+        self._samples[stack] = self._samples.get(stack, 0) + 1
+
+    def get_samples(self):
+        return dict(self._samples)
+
+    def get_collapsed(self):
+        return ["%s %d" % (stack, count) for stack,count in sorted(self._samples.items())]
+
+    def write_collapsed(self, f):
+        for line in self.get_collapsed():
+            f.write(line + "\n")
+
+    def clear(self):
+        self._samples = {}
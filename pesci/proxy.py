@@ -0,0 +1,174 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import ast
+import types
+from pesci.errors import InterpretError, PesciSyntaxError
+from pesci.code import FunctionTemplate, PesciFunction
+from pesci.environment import CallFrame, ExecutionEnvironment
+
+"""
+Whitelisted access to host objects.
+
+The attributes and methods which scripts can reach are declared once per host
+type. Objects of unregistered types keep the default access to any public
+attribute, unless the registry is strict. Methods are bound once per object
+and environment, then reused.
+
+When the type of an injected symbol is known before the execution, the
+disallowed accesses to its attributes are rejected before running the script.
+"""
+
+# bound methods cached per environment, before clearing them
+MAX_BOUND_METHODS = 1024
+
+# the attributes of functions, methods, generators, frames and code objects,
+# which lead to the host globals and builtins
+INTROSPECTED_TYPES = (types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    types.GeneratorType, types.FrameType, types.CodeType)
+DENIED_PREFIXES = ("func_", "im_", "gi_", "f_", "co_")
+
+# the interpreter objects which scripts can hold, but not look into
+INTERNAL_TYPES = (PesciFunction, FunctionTemplate, ExecutionEnvironment, CallFrame)
+
+"""is name an attribute which scripts can never reach?"""
+def is_denied_attribute(name):
+    return not name or name[0] == "_"
+
+"""is name an attribute of obj leading to the host internals, e.g. func_globals?"""
+def is_internal_attribute(obj, name):
+    return isinstance(obj, INTROSPECTED_TYPES) and name.startswith(DENIED_PREFIXES)
+
+def _getmro(cls):
+    mro = getattr(cls, "__mro__", None)
+    if mro is not None:
+        return mro
+    # an old style class, depth first
+    mro = [cls]
+    for base in cls.__bases__:
+        mro.extend(_getmro(base))
+    return mro
+
+class HostType(object):
+    def __init__(self, cls, attributes=(), methods=()):
+        self.cls = cls
+        self.attributes = frozenset(attributes)
+        self.methods = frozenset(methods)
+        for name in self.attributes | self.methods:
+            if is_denied_attribute(name):
+                raise ValueError("invalid attribute '%s'" % name)
+        # name -> is a method
+        self.table = dict([(name, False) for name in self.attributes] +
+            [(name, True) for name in self.methods])
+
+class HostTypes(object):
+    def __init__(self, strict=False):
+        # reject the attributes of the unregistered types too
+        self.strict = strict
+        self._types = {}
+        # class -> HostType or None, through the class hierarchy
+        self._resolved = {}
+
+    def register(self, cls, attributes=(), methods=()):
+        self._types[cls] = HostType(cls, attributes, methods)
+        self._resolved.clear()
+
+    def unregister(self, cls):
+        self._types.pop(cls, None)
+        self._resolved.clear()
+
+    def lookup(self, cls):
+        try:
+            return self._resolved[cls]
+        except KeyError:
+            host = None
+            for base in _getmro(cls):
+                if base in self._types:
+                    host = self._types[base]
+                    break
+            self._resolved[cls] = host
+            return host
+
+    def _denied(self, obj, name):
+        return InterpretError("attribute '%s' of '%s' not allowed" % (name, obj.__class__.__name__))
+
+    """Get an allowed attribute. bound_methods is an optional per environment cache."""
+    def getattr(self, obj, name, bound_methods=None):
+        if is_denied_attribute(name) or is_internal_attribute(obj, name):
+            raise InterpretError("invalid attribute '%s'" % name)
+        if isinstance(obj, INTERNAL_TYPES):
+            raise self._denied(obj, name)
+
+        host = self.lookup(obj.__class__)
+        if host is None:
+            if self.strict:
+                raise self._denied(obj, name)
+            return getattr(obj, name)
+
+        method = host.table.get(name)
+        if method is None:
+            raise self._denied(obj, name)
+        elif not method or bound_methods is None:
+            return getattr(obj, name)
+        # NB: the bound method keeps obj alive, so its id is not reused
+        key = (id(obj), name)
+        method = bound_methods.get(key)
+        if method is None:
+            if len(bound_methods) >= MAX_BOUND_METHODS:
+                bound_methods.clear()
+            method = bound_methods[key] = getattr(obj, name)
+        return method
+
+    """Set an allowed attribute: a declared attribute, not a method"""
+    def setattr(self, obj, name, value):
+        if is_denied_attribute(name) or is_internal_attribute(obj, name):
+            raise InterpretError("invalid attribute '%s'" % name)
+        if isinstance(obj, INTERNAL_TYPES):
+            raise self._denied(obj, name)
+
+        host = self.lookup(obj.__class__)
+        if host is None:
+            if self.strict:
+                raise self._denied(obj, name)
+        elif host.table.get(name) is not False:
+            raise self._denied(obj, name)
+        setattr(obj, name, value)
+
+    """Rejects the disallowed attributes of the symbols never assigned by the code"""
+    def check(self, tree, symbols):
+        if not self._types and not self.strict:
+            return
+
+        assigned = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                assigned.add(node.id)
+            elif isinstance(node, ast.FunctionDef):
+                assigned.add(node.name)
+                assigned.update([name for name in (node.args.vararg, node.args.kwarg) if name])
+
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and
+                    node.value.id in symbols and not node.value.id in assigned):
+                obj = symbols[node.value.id]
+                host = self.lookup(obj.__class__)
+                if (self.strict and host is None) or (host is not None and not node.attr in host.table):
+                    raise PesciSyntaxError(node, getattr(node, "lineno", 0), getattr(node, "col_offset", 0))
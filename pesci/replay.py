@@ -0,0 +1,421 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import base64
+import gzip
+import json
+import operator
+import time
+from pesci.code import PESCI_KEY_ENV, PESCI_KEY_INTERPRETER
+from pesci.errors import InterpretError, ReplayMismatch
+
+"""
+Recording and replay of the host calls of a run.
+
+A HostRecorder wraps the injected functions and objects into proxies, which
+log every call, method call and attribute read made through them, with the
+arguments, the result and the time it took. The values returned by the host
+are logged when they are plain data; other objects are wrapped in turn, and
+their comparisons and arithmetic operators are logged as method calls.
+
+A HostReplayer loads the log and gives back the same symbols, whose proxies
+return the logged results, in order, without any real host. Each call must
+have the logged arguments, the host objects being compared by their handle.
+Running the same script over them is deterministic, so that slow production
+runs can be benchmarked and profiled offline:
+
+    recorder = HostRecorder()
+    env = interpreter.create_env(code, recorder.wrap(symbols))
+    interpreter.run(env)
+    recorder.save("run.log.gz")
+    ...
+    replayer = HostReplayer("run.log.gz")
+    env = interpreter.create_env(code, replayer.symbols())
+
+The log is a gzipped file of JSON lines: a header with the symbols, then an
+event per line:
+
+    [kind, handle, name, args, kwargs, {"value": v} or {"error": [type, message]}, seconds]
+
+Methods are read once per object, so later reads are not logged.
+
+NB: the effects of pesci_functions on the environment itself, e.g. their
+output, are not replayed.
+"""
+
+LOG_VERSION = 1
+
+EVENT_CALL = "call"
+EVENT_GET = "get"
+
+# markers of the values which JSON cannot hold as they are
+HOST = "__host__"
+TUPLE = "__tuple__"
+UNICODE = "__unicode__"
+BYTES = "__bytes__"
+DICT = "__dict__"
+REPR = "__repr__"
+MARKERS = (HOST, TUPLE, UNICODE, BYTES, DICT, REPR)
+
+# the special methods which scripts reach through builtins and operators
+SPECIAL_METHODS = ("__len__", "__getitem__", "__contains__", "__nonzero__", "__str__")
+
+_reflected = lambda op: lambda a, b: op(b, a)
+
+# the operators forwarded to the host values, special method -> semantics
+OPERATOR_METHODS = {
+    '__eq__':operator.eq, '__ne__':operator.ne, '__lt__':operator.lt,
+    '__le__':operator.le, '__gt__':operator.gt, '__ge__':operator.ge,
+    '__hash__':hash, '__neg__':operator.neg, '__pos__':operator.pos,
+    '__abs__':abs, '__invert__':operator.invert, '__int__':int, '__long__':long,
+    '__float__':float,
+}
+for _name, _op in (("add", operator.add), ("sub", operator.sub), ("mul", operator.mul),
+        ("div", operator.div), ("truediv", operator.truediv),
+        ("floordiv", operator.floordiv), ("mod", operator.mod), ("pow", operator.pow),
+        ("lshift", operator.lshift), ("rshift", operator.rshift), ("and", operator.and_),
+        ("or", operator.or_), ("xor", operator.xor)):
+    OPERATOR_METHODS["__%s__" % _name] = _op
+    OPERATOR_METHODS["__r%s__" % _name] = _reflected(_op)
+
+def _is_plain_dict(value):
+    for key in value:
+        if type(key) is not str or key in MARKERS:
+            return False
+    return True
+
+"""Returns the JSON form of value and the value given to the script: the
+   objects which are not plain data are wrapped by proxy(value), when given.
+"""
+def _encode(value, proxy=None):
+    kind = type(value)
+    if value is None or kind in (bool, int, long, float):
+        return value, value
+    elif kind is str:
+        try:
+            value.decode("utf-8")
+            return value, value
+        except UnicodeDecodeError:
+            return {BYTES:base64.b64encode(value)}, value
+    elif kind is unicode:
+        return {UNICODE:value}, value
+    elif kind in (list, tuple):
+        pairs = [_encode(item, proxy) for item in value]
+        encoded = [pair[0] for pair in pairs]
+        if [1 for item,pair in zip(value, pairs) if item is not pair[1]]:
+            value = kind([pair[1] for pair in pairs])
+        return (encoded if kind is list else {TUPLE:encoded}), value
+    elif kind is dict:
+        items = [(key, _encode(val, proxy)) for key,val in value.iteritems()]
+        if [1 for key,pair in items if value[key] is not pair[1]]:
+            value = dict([(key, pair[1]) for key,pair in items])
+        if _is_plain_dict(value):
+            return dict([(key, pair[0]) for key,pair in items]), value
+        return {DICT:[[_encode(key)[0], pair[0]] for key,pair in items]}, value
+    elif kind in (_RecordingProxy, _ReplayStub):
+        return {HOST:value._handle}, value
+    elif proxy is not None:
+        value = proxy(value)
+        return {HOST:value._handle}, value
+    return {REPR:repr(value)}, value
+
+"""the logged form of the arguments of a call, as read back from the log"""
+def _encode_arguments(args, kwargs):
+    kwargs = dict([(k,v) for k,v in kwargs.items()
+        if not k in (PESCI_KEY_ENV, PESCI_KEY_INTERPRETER)])
+    return json.loads(json.dumps([_encode(list(args))[0], _encode(kwargs)[0]]))
+
+class _RecordingProxy(object):
+    __slots__ = ("_recorder", "_target", "_handle", "_methods")
+
+    def __init__(self, recorder, target, handle):
+        object.__setattr__(self, "_recorder", recorder)
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_handle", handle)
+        # name -> proxy of a method, read once like the interpreter does
+        object.__setattr__(self, "_methods", {})
+
+    # so that isinstance and the host types registry see the real object
+    @property
+    def __class__(self):
+        return self._target.__class__
+
+    def __getattr__(self, name):
+        if name[0] == "_":
+            # never reached by scripts, e.g. the pesci_function marker
+            return getattr(self._target, name)
+        return self._recorder._get(self, name)
+
+    def __call__(self, *args, **kwargs):
+        return self._recorder._call(self, "", args, kwargs)
+
+    def __len__(self):
+        return self._recorder._call(self, "__len__", (), {})
+
+    def __getitem__(self, key):
+        return self._recorder._call(self, "__getitem__", (key,), {})
+
+    def __contains__(self, item):
+        return self._recorder._call(self, "__contains__", (item,), {})
+
+    def __nonzero__(self):
+        return self._recorder._call(self, "__nonzero__", (), {})
+
+    def __str__(self):
+        return self._recorder._call(self, "__str__", (), {})
+
+    def __iter__(self):
+        return iter(self._recorder._call(self, "__iter__", (), {}))
+
+    def __repr__(self):
+        return "<recorded %r>" % (self._target,)
+
+def _recorded_operator(name):
+    def method(self, *args):
+        return self._recorder._call(self, name, args, {})
+    method.__name__ = name
+    return method
+
+# NB: a recorded value must compare and compute like the host one
+for _name in OPERATOR_METHODS:
+    setattr(_RecordingProxy, _name, _recorded_operator(_name))
+
+class HostRecorder(object):
+    def __init__(self):
+        self.symbols = {}
+        self.events = []
+        self._handles = 0
+
+    """Returns the symbols, with the host functions and objects wrapped"""
+    def wrap(self, symbols):
+        wrapped = {}
+        for name,value in symbols.items():
+            self.symbols[name], wrapped[name] = _encode(value, self._proxy)
+        return wrapped
+
+    def _proxy(self, value):
+        self._handles += 1
+        return _RecordingProxy(self, value, self._handles)
+
+    def _unwrap(self, value):
+        kind = type(value)
+        if kind is _RecordingProxy:
+            return value._target
+        elif kind in (list, tuple):
+            items = [self._unwrap(item) for item in value]
+            if [1 for item,orig in zip(items, value) if item is not orig]:
+                return kind(items)
+        elif kind is dict:
+            items = [(key, self._unwrap(val)) for key,val in value.iteritems()]
+            if [1 for key,val in items if val is not value[key]]:
+                return dict(items)
+        return value
+
+    """logs the call of f, whose arguments are args and kwargs"""
+    def _run(self, proxy, kind, name, args, kwargs, f):
+        event = [kind, proxy._handle, name] + _encode_arguments(args, kwargs) + [None, 0]
+        self.events.append(event)
+
+        start = time.time()
+        try:
+            result = f()
+        except Exception as e:
+            event[5] = {'error':[e.__class__.__name__, str(e)]}
+            event[6] = round(time.time() - start, 6)
+            raise
+        event[6] = round(time.time() - start, 6)
+        event[5] = {}
+        event[5]['value'], result = _encode(result, self._proxy)
+        return result
+
+    def _get(self, proxy, name):
+        method = proxy._methods.get(name)
+        if method is None:
+            value = self._run(proxy, EVENT_GET, name, (), {},
+                lambda: getattr(proxy._target, name))
+            if type(value) is not _RecordingProxy or not callable(value._target):
+                return value
+            method = proxy._methods[name] = value
+            self.events[-1][5]['method'] = True
+        return method
+
+    def _call(self, proxy, name, args, kwargs):
+        target = proxy._target
+        # NB: the log keeps the proxies, which the replay gets as stubs
+        host_args = self._unwrap(args)
+        host_kwargs = self._unwrap(kwargs)
+        if not name:
+            f = lambda: target(*host_args, **host_kwargs)
+        elif name == "__iter__":
+            f = lambda: list(target)
+        elif name == "__nonzero__":
+            f = lambda: bool(target)
+        elif name == "__str__":
+            f = lambda: str(target)
+        elif name == "__len__":
+            f = lambda: len(target)
+        elif name in OPERATOR_METHODS:
+            f = lambda: OPERATOR_METHODS[name](target, *host_args)
+        else:
+            f = lambda: getattr(target, name)(*host_args)
+        return self._run(proxy, EVENT_CALL, name, args, kwargs, f)
+
+    def write(self, f):
+        f.write(json.dumps({'version':LOG_VERSION, 'symbols':self.symbols},
+            separators=(",", ":")) + "\n")
+        for event in self.events:
+            f.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+    def save(self, path):
+        f = gzip.open(path, "wb")
+        try:
+            self.write(f)
+        finally:
+            f.close()
+
+class _ReplayStub(object):
+    __slots__ = ("_replayer", "_handle", "_methods")
+
+    def __init__(self, replayer, handle):
+        object.__setattr__(self, "_replayer", replayer)
+        object.__setattr__(self, "_handle", handle)
+        object.__setattr__(self, "_methods", {})
+
+    def __getattr__(self, name):
+        if name[0] == "_":
+            raise AttributeError(name)
+        method = self._methods.get(name)
+        if method is None:
+            return self._replayer._replay(EVENT_GET, self._handle, name, self._methods)
+        return method
+
+    def __call__(self, *args, **kwargs):
+        return self._replayer._replay(EVENT_CALL, self._handle, "", args=args, kwargs=kwargs)
+
+    def __len__(self):
+        return self._replayer._replay(EVENT_CALL, self._handle, "__len__")
+
+    def __getitem__(self, key):
+        return self._replayer._replay(EVENT_CALL, self._handle, "__getitem__", args=(key,))
+
+    def __contains__(self, item):
+        return self._replayer._replay(EVENT_CALL, self._handle, "__contains__", args=(item,))
+
+    def __nonzero__(self):
+        return self._replayer._replay(EVENT_CALL, self._handle, "__nonzero__")
+
+    def __str__(self):
+        return self._replayer._replay(EVENT_CALL, self._handle, "__str__")
+
+    def __iter__(self):
+        return iter(self._replayer._replay(EVENT_CALL, self._handle, "__iter__"))
+
+    def __repr__(self):
+        return "<replayed host %d>" % self._handle
+
+def _replayed_operator(name):
+    def method(self, *args):
+        return self._replayer._replay(EVENT_CALL, self._handle, name, args=args)
+    method.__name__ = name
+    return method
+
+for _name in OPERATOR_METHODS:
+    setattr(_ReplayStub, _name, _replayed_operator(_name))
+
+class HostReplayer(object):
+    """source: a path or a file of a HostRecorder log
+       delay: sleep as long as each host call took
+    """
+    def __init__(self, source, delay=False):
+        self.delay = delay
+        if isinstance(source, basestring):
+            f = gzip.open(source, "rb")
+        else:
+            f = source
+        try:
+            header = json.loads(f.readline())
+            self.events = [json.loads(line) for line in f if line.strip()]
+        finally:
+            if f is not source:
+                f.close()
+        if header.get('version') != LOG_VERSION:
+            raise ValueError("unsupported log version %s" % header.get('version'))
+        self._symbols = header['symbols']
+        self.position = 0
+        self._stubs = {}
+
+    """The recorded symbols, with stubs instead of the host functions and objects"""
+    def symbols(self):
+        return dict([(str(name), self._decode(value))
+            for name,value in self._symbols.items()])
+
+    """the events not replayed yet"""
+    def remaining(self):
+        return len(self.events) - self.position
+
+    def _stub(self, handle):
+        stub = self._stubs.get(handle)
+        if stub is None:
+            stub = self._stubs[handle] = _ReplayStub(self, handle)
+        return stub
+
+    def _decode(self, value):
+        if type(value) is unicode:
+            return value.encode("utf-8")
+        elif type(value) is list:
+            return [self._decode(item) for item in value]
+        elif type(value) is dict:
+            if len(value) == 1:
+                key, item = value.items()[0]
+                if key == HOST:
+                    return self._stub(item)
+                elif key == TUPLE:
+                    return tuple([self._decode(i) for i in item])
+                elif key == UNICODE:
+                    return item
+                elif key == BYTES:
+                    return base64.b64decode(item)
+                elif key == DICT:
+                    return dict([(self._decode(k), self._decode(v)) for k,v in item])
+                elif key == REPR:
+                    return item.encode("utf-8")
+            return dict([(k.encode("utf-8"), self._decode(v)) for k,v in value.items()])
+        return value
+
+    """methods: where a method read is cached, as when it was recorded"""
+    def _replay(self, kind, handle, name, methods=None, args=(), kwargs={}):
+        got = tuple([kind, handle, name] + _encode_arguments(args, kwargs))
+        if self.position >= len(self.events):
+            raise ReplayMismatch(self.position, None, got)
+        event = self.events[self.position]
+        if tuple(event[:5]) != got:
+            raise ReplayMismatch(self.position, tuple(event[:5]), got)
+        self.position += 1
+
+        if self.delay:
+            time.sleep(event[6])
+        result = event[5]
+        if 'error' in result:
+            raise InterpretError("%s: %s" % tuple(result['error']))
+        value = self._decode(result['value'])
+        if result.get('method') and methods is not None:
+            methods[name] = value
+        return value
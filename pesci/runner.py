@@ -0,0 +1,137 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import glob
+import json
+import time
+import types
+from pesci.code import PesciCode, PesciFunction
+from pesci.interpreter import Interpreter, BUILTINS, GRANULARITY_NODE
+from pesci.output import NullSink
+
+"""
+Batch runs of many PesciCode files, for benchmarks and capacity planning.
+
+Each file runs repeat times with its output discarded, then once more with
+metrics enabled to count its steps and peak depths (metrics slow the run
+down, so they are not timed). Files can run in parallel processes.
+
+python -m pesci --jobs 4 --repeat 5 'scripts/*.py'
+"""
+
+COLUMNS = (('file', "%-30s"), ('runs', "%5s"), ('mean_ms', "%10s"), ('min_ms', "%10s"),
+ ('steps', "%10s"), ('max_stack', "%9s"), ('max_calls', "%9s"), ('native_ms', "%10s"),
+ ('native_match', "%12s"), ('error', "%s"), ('native_error', "%s"))
+
+"""Expands the glob patterns, keeping the plain names as they are.
+   Raises ValueError for a pattern matching no file.
+"""
+def expand_sources(sources):
+    files = []
+    for source in sources:
+        if glob.has_magic(source):
+            matches = sorted(glob.glob(source))
+            if not matches:
+                raise ValueError("no file matches '%s'" % source)
+            files.extend(matches)
+        else:
+            files.append(source)
+    return files
+
+def _values(env):
+    # the data left into the global context
+    return dict([(k,v) for k,v in env.get_visible_context().items()
+        if not (k in BUILTINS and BUILTINS[k] is v) and
+            not isinstance(v, (PesciFunction, types.FunctionType))])
+
+def _describe(e):
+    return "%s: %s" % (e.__class__.__name__, e)
+
+def _best(times):
+    return round(min(times) * 1000, 3), round(sum(times) / len(times) * 1000, 3)
+
+def run_file(path, repeat=1, granularity=GRANULARITY_NODE, native=False):
+    result = {'file':path, 'runs':repeat}
+    try:
+        code = PesciCode.from_file(path)
+        interpreter = Interpreter(granularity=granularity)
+
+        times = []
+        for i in range(repeat):
+            env = interpreter.create_env(code, output=NullSink())
+            start = time.time()
+            interpreter.run(env)
+            times.append(time.time() - start)
+        result['min_ms'], result['mean_ms'] = _best(times)
+
+        env = interpreter.create_env(code, output=NullSink())
+        env.enable_metrics()
+        interpreter.run(env)
+        result['steps'] = env.metrics.steps
+        result['max_stack'] = env.metrics.max_stack_depth
+        result['max_calls'] = env.metrics.max_call_depth
+
+    except Exception as e:
+        result['error'] = _describe(e)
+        return result
+
+    if native:
+        # a failure here is reported, but the file still counts as run
+        try:
+            times = []
+            for i in range(repeat):
+                native_env = interpreter.create_env(code, output=NullSink())
+                start = time.time()
+                interpreter.run_native(native_env)
+                times.append(time.time() - start)
+            result['native_ms'] = _best(times)[0]
+            result['native_match'] = _values(env) == _values(native_env)
+        except Exception as e:
+            result['native_match'] = False
+            result['native_error'] = _describe(e)
+    return result
+
+def _run_task(task):
+    return run_file(*task)
+
+"""Runs the files, in jobs parallel processes. Returns a result dict per file."""
+def run_files(files, jobs=1, repeat=1, granularity=GRANULARITY_NODE, native=False):
+    tasks = [(path, repeat, granularity, native) for path in files]
+    if jobs <= 1 or len(tasks) <= 1:
+        return [_run_task(task) for task in tasks]
+
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(_run_task, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def format_table(results):
+    columns = [(k,fmt) for k,fmt in COLUMNS if [r for r in results if k in r]]
+    lines = [" ".join([fmt % k for k,fmt in columns]).rstrip()]
+    for result in results:
+        lines.append(" ".join([fmt % result.get(k, "-") for k,fmt in columns]).rstrip())
+    return "\n".join(lines)
+
+def format_json(results):
+    return json.dumps(results, indent=2, sort_keys=True)
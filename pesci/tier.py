@@ -0,0 +1,258 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import ast
+import copy
+import sys
+import types
+from pesci.errors import BadFunctionCall, EnvSymbolNotFound, InterpretError, PesciSyntaxError
+from pesci.code import PesciFunction, TIER_INTERPRETED, TIER_COMPILED, TIER_UNCOMPILABLE
+from pesci.native import NativeTransformer, NativeRuntime, NATIVE_CALL, _closure
+
+"""
+Tiered execution of PesciFunctions.
+
+Functions start into the stepping interpreter, which counts their calls and
+loop iterations. Once hot, a function is compiled into a python function
+which runs a call without stepping inside it. The interpreter keeps using
+the slow tier while metrics, hooks (e.g. a debugger) or memory accounting
+are enabled, or when the environment disables tiering.
+
+Tiering is off unless the interpreter has a tier_threshold: as a compiled
+call is a single step, it cannot be preempted, and the step or time limits
+of its caller only apply once it returns.
+
+The compiled function keeps the PesciFunction semantics:
+  - its arguments and assigned names are python locals; the names which may
+    be read before being assigned start from the visible variables
+  - the other names are looked up into the environment at every read, so
+    they see the caller variables
+  - its locals are copied into its context before calling a PesciFunction,
+    which can then see them, unless the call is a tail call
+  - calls, prints and attributes go through the interpreter runtime
+  - assigned lists are copied, as the interpreter does
+
+Functions defining functions, declaring globals or calling themselves
+(even indirectly) stay interpreted: the python stack is not fit for deep
+recursion. So do the functions using break or continue, which the
+interpreter does not run.
+"""
+
+TIER_GET = "__pesci_get"
+TIER_HAS = "__pesci_has"
+TIER_TAIL_CALL = "__pesci_tail_call"
+
+def _names(nodes, ctx):
+    names = set()
+    for root in nodes:
+        for node in ast.walk(root):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ctx):
+                names.add(node.id)
+    return names
+
+"""the names of the augmented assignments, which read them first"""
+def _augmented_names(nodes):
+    return set([node.target.id for root in nodes for node in ast.walk(root)
+        if isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name)])
+
+def _called_names(body):
+    return set([node.func.id for stmt in body for node in ast.walk(stmt)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)])
+
+class TierTransformer(NativeTransformer):
+    def __init__(self, local):
+        NativeTransformer.__init__(self)
+        self.local = local
+
+    def visit_Name(self, node):
+        self._check_name(node, node.id)
+        if isinstance(node.ctx, ast.Load) and not node.id in self.local:
+            get = self._runtime_call(TIER_GET, [ast.Str(s=node.id)])
+            return ast.copy_location(get, node)
+        return node
+
+    def visit_Return(self, node):
+        self.generic_visit(node)
+        if isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name) and \
+                node.value.func.id == NATIVE_CALL:
+            node.value.func.id = TIER_TAIL_CALL
+        return node
+
+class TierRuntime(NativeRuntime):
+    def builtins(self):
+        builtins = NativeRuntime.builtins(self)
+        builtins[TIER_GET] = _closure(self.env.getvar)
+        builtins[TIER_HAS] = _closure(self.has)
+        builtins[TIER_TAIL_CALL] = _closure(self.tail_call)
+        return builtins
+
+    def has(self, name):
+        try:
+            self.env.getvar(name)
+        except EnvSymbolNotFound:
+            return False
+        return True
+
+    def call(self, *args, **kwargs):
+        if isinstance(args[0], PesciFunction):
+            # let the callee see the compiled function locals
+            context = self.env.get_current_context()
+            # NB: the caller of the runtime helper
+            context.update(sys._getframe(2).f_locals)
+        return self._call(args, kwargs)
+
+    """return f(...): as into the interpreter, the callee replaces the
+       function and cannot see its locals
+    """
+    def tail_call(self, *args, **kwargs):
+        if isinstance(args[0], PesciFunction):
+            context = self.env.get_current_context()
+            globs = context['__globals__']
+            context.clear()
+            context['__globals__'] = globs
+        return self._call(args, kwargs)
+
+    def _call(self, args, kwargs):
+        f = args[0]
+        if isinstance(f, PesciFunction):
+            tiers = self.interpreter._get_tiers()
+            if tiers.count_call(self.env, f):
+                return tiers.call(self.env, f, None, args[1:], kwargs)
+        return NativeRuntime.call(self, *args, **kwargs)
+
+class TierCompiler(object):
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def _is_compilable(self, env, f):
+        for stmt in f.body:
+            for node in ast.walk(stmt):
+                if isinstance(node, (ast.FunctionDef, ast.Global, ast.Break, ast.Continue)):
+                    return False
+
+        # the functions reachable from f, as they are bound now
+        seen = set()
+        pending = [f]
+        while pending:
+            for name in _called_names(pending.pop().body):
+                try:
+                    callee = env.getvar(name)
+                except EnvSymbolNotFound:
+                    continue
+                if callee is f:
+                    return False
+                if isinstance(callee, PesciFunction) and not id(callee) in seen:
+                    seen.add(id(callee))
+                    pending.append(callee)
+        return True
+
+    def _prologue_names(self, params, local, body):
+        # the locals which may be read before a top level assignment
+        assigned = set(params)
+        maybe_unbound = set()
+        for stmt in body:
+            read = _names([stmt], ast.Load) | _augmented_names([stmt])
+            maybe_unbound |= (read & local) - assigned
+            if isinstance(stmt, ast.Assign):
+                assigned |= _names(stmt.targets, ast.Store)
+        return sorted(maybe_unbound)
+
+    def _compile(self, template):
+        params = list(template.params)
+        params += [name for name in (template.vararg, template.kwarg) if name]
+        local = set(params) | _names(template.body, (ast.Store, ast.Param))
+
+        transformer = TierTransformer(local)
+        # NB: the transformer changes the nodes in place
+        body = [transformer.visit(stmt) for stmt in copy.deepcopy(template.body)]
+        prologue = [ast.If(test=transformer._runtime_call(TIER_HAS, [ast.Str(s=name)]),
+                body=[ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())],
+                    value=transformer._runtime_call(TIER_GET, [ast.Str(s=name)]))],
+                orelse=[])
+            for name in self._prologue_names(params, local, template.body)]
+        if template.vararg:
+            prologue.append(transformer._list_vararg(template.vararg))
+
+        args = ast.arguments(args=[ast.Name(id=name, ctx=ast.Param()) for name in template.params],
+            vararg=template.vararg, kwarg=template.kwarg, defaults=[])
+        funcdef = ast.FunctionDef(name=template.name, args=args, body=prologue + body + [ast.Pass()],
+            decorator_list=[])
+        module = ast.Module(body=[funcdef])
+        ast.fix_missing_locations(module)
+
+        code = compile(module, "<pesci>", mode="exec")
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                return const
+
+    """Counts a call of f, promoting it when hot.
+       Returns True if the call can run into the compiled tier.
+    """
+    def count_call(self, env, f):
+        interpreter = self.interpreter
+        if interpreter.tier_threshold is None or not env.tiering:
+            return False
+        f.calls += 1
+        if f.tier == TIER_INTERPRETED and f.calls + f.loop_iterations >= interpreter.tier_threshold:
+            self.promote(env, f)
+        # NB: the compiled code does not account the memory of the changed values
+        return (f.tier == TIER_COMPILED and not (interpreter.instrumented or env.instrumented)
+            and env.memory is None)
+
+    """Compiles a hot function, if possible. The code is kept into its
+       template, for the same function of the other environments.
+    """
+    def promote(self, env, f):
+        template = f.template
+        if template.compile_failed or not self._is_compilable(env, f):
+            f.tier = TIER_UNCOMPILABLE
+            return
+        if template.code is None:
+            try:
+                template.code = self._compile(template)
+            except (SyntaxError, PesciSyntaxError):
+                template.compile_failed = True
+                f.tier = TIER_UNCOMPILABLE
+                return
+        f.tier = TIER_COMPILED
+
+    """Runs a call of a compiled function"""
+    def call(self, env, f, node, args, kwargs):
+        # NB: kept into the environment, out of the script reach
+        pyfunc = env.tier_functions.get(f)
+        if pyfunc is None:
+            runtime = TierRuntime(self.interpreter, env)
+            pyfunc = types.FunctionType(f.template.code, {'__builtins__':runtime.builtins()},
+                f.name, f.defaults or None)
+            env.tier_functions[f] = pyfunc
+
+        env.enter_call(f, node)
+        try:
+            return pyfunc(*args, **kwargs)
+        except UnboundLocalError as e:
+            raise InterpretError(e)
+        except TypeError:
+            if sys.exc_info()[2].tb_next is None:
+                # raised by the call itself: the arguments do not bind
+                raise BadFunctionCall(f)
+            raise
+        finally:
+            env.leave_call()
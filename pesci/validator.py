@@ -20,7 +20,7 @@
 #
 
 import ast
-from pesci.errors import *
+from pesci.errors import PesciSyntaxError
 
 # Recognised subset of python
 PESCI_SUBSET = (
@@ -0,0 +1,564 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import argparse
+import collections
+import errno
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from pesci.errors import EnvBudgetExceeded, EnvExecEnd, EnvTimeLimitExceeded, JobError, \
+ ScriptRejected
+from pesci.cost import AdmissionController
+from pesci.code import PesciCode
+from pesci.environment import DEFAULT_MAX_CALL_DEPTH
+from pesci.interpreter import Interpreter, BUILTINS
+from pesci.output import CaptureSink, RingBufferSink
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+"""
+A long running worker daemon, which runs jobs for other processes.
+
+The server listens on a unix socket or a TCP port and forks a number of
+worker processes, which accept the connections on the shared socket. Each
+worker keeps its own interpreter and a cache of the parsed programs, so that
+repeated scripts are warm.
+
+A connection carries a stream of jobs, answered in order, so that clients
+can pipeline them. Jobs and responses are newline delimited JSON objects or,
+when msgpack is available, msgpack maps; the server detects the encoding
+from the first byte of the connection.
+
+Job:        {"id": 1, "script": "...", "symbols": {...},
+             "limits": {"steps": N, "time": S, "memory": B, "output": B, "call_depth": N}}
+Response:   {"id": 1, "ok": true, "result": {...}, "output": "...", "metrics": {...},
+             "cost": {...}}
+            {"id": 1, "ok": false, "type": "EnvBudgetExceeded", "error": "...", ...}
+
+The result holds the global names set by the script; values which cannot be
+encoded are sent as their repr. A line which is not a JSON job object gets
+an error response, with a null id.
+
+The time limit is checked between steps and, into the worker processes, by a
+watchdog which interrupts a single long step (e.g. a host call) with SIGALRM.
+A step which cannot be interrupted, running into C code, is stopped by a CPU
+time timer killing the worker, which is then replaced: the jobs pending on
+its connections fail with a ConnectionError.
+
+With an AdmissionController, the scripts are first checked against its cost
+limits: the rejected ones fail with ScriptRejected without running, the
+others report their cost profile and priority.
+
+python -m pesci.worker --listen unix:/tmp/pesci.sock --workers 4
+"""
+
+CODEC_JSON = "json"
+CODEC_MSGPACK = "msgpack"
+
+RECV_SIZE = 65536
+# cached programs per worker process
+DEFAULT_CACHE_SIZE = 256
+# steps between two time limit checks
+TIME_CHECK_STEPS = 1024
+# CPU seconds after the time limit, before the watchdog kills the worker
+WATCHDOG_GRACE = 1.0
+
+"""Parses 'unix:/path', 'host:port' or ':port' into a socket family and address"""
+def parse_address(address):
+    if isinstance(address, tuple):
+        return socket.AF_INET, address
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+class JsonCodec(object):
+    name = CODEC_JSON
+
+    def encode(self, message):
+        return json.dumps(message, default=repr) + "\n"
+
+    """yields the messages read by recv, after the already received data"""
+    def messages(self, recv, data=""):
+        chunks = [data]
+        while True:
+            data = "".join(chunks)
+            lines = data.split("\n")
+            for line in lines[:-1]:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        # NB: the next lines can still be read
+                        yield e
+            chunks = [lines[-1]]
+
+            data = recv()
+            while data and not "\n" in data:
+                chunks.append(data)
+                data = recv()
+            if not data:
+                return
+            chunks.append(data)
+
+class MsgpackCodec(object):
+    name = CODEC_MSGPACK
+
+    def encode(self, message):
+        return msgpack.packb(message, default=repr)
+
+    def messages(self, recv, data=""):
+        unpacker = msgpack.Unpacker()
+        while data:
+            unpacker.feed(data)
+            for message in unpacker:
+                yield message
+            data = recv()
+
+def get_codec(name):
+    if name == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack is not available")
+        return MsgpackCodec()
+    return JsonCodec()
+
+def _is_msgpack(first):
+    # fixmap, map16, map32
+    return (0x80 <= ord(first) <= 0x8f) or first in "\xde\xdf"
+
+"""Runs the jobs, into a worker process"""
+class JobRunner(object):
+    """limits: the maximum limits, which jobs can only lower
+       admission: an AdmissionController for the scripts, see pesci.cost
+       watchdog: interrupt the jobs over their time limit within a step, by
+       signals; only from the main thread of a process
+    """
+    def __init__(self, symbols={}, limits={}, cache_size=DEFAULT_CACHE_SIZE, admission=None,
+            watchdog=False):
+        self.interpreter = Interpreter()
+        self.symbols = symbols
+        self.limits = limits
+        self.cache_size = cache_size
+        self.admission = admission
+        self.watchdog = watchdog
+        self._programs = collections.OrderedDict()
+
+    """returns the (code, cost profile) of a script"""
+    def _get_program(self, script):
+        if isinstance(script, unicode):
+            script = script.encode("utf-8")
+        program = self._programs.pop(script, None)
+        if program is None:
+            code = PesciCode.from_string(script).compact()
+            profile = None
+            if self.admission is not None:
+                profile = self.admission.analyzer.analyze(code)
+            program = (code, profile)
+            if len(self._programs) >= self.cache_size:
+                self._programs.popitem(last=False)
+        self._programs[script] = program
+        return program
+
+    def _admit(self, profile, response):
+        reasons = self.admission.check(profile)
+        if reasons:
+            raise ScriptRejected(profile, reasons)
+        profile.priority = self.admission.get_priority(profile)
+        response['cost'] = profile.snapshot()
+
+    def _get_limits(self, job):
+        limits = dict(self.limits)
+        for k,v in (job.get('limits') or {}).items():
+            if v is not None:
+                limits[k] = min(v, limits[k]) if limits.get(k) is not None else v
+        # the interpreter stack is bound even when the server sets no limit
+        limits['call_depth'] = min(limits.get('call_depth') or DEFAULT_MAX_CALL_DEPTH,
+            DEFAULT_MAX_CALL_DEPTH)
+        return limits
+
+    def run(self, job):
+        if not isinstance(job, dict):
+            error = str(job) if isinstance(job, ValueError) else "a job must be an object"
+            return {'id':None, 'ok':False, 'type':"BadJob", 'error':error}
+
+        response = {'id':job.get('id')}
+        env = None
+        output = None
+        try:
+            limits = self._get_limits(job)
+            if limits.get('output') is not None:
+                output = RingBufferSink(limits['output'])
+            else:
+                output = CaptureSink()
+
+            symbols = dict(self.symbols)
+            symbols.update(job.get('symbols') or {})
+            code, profile = self._get_program(job['script'])
+            if profile is not None:
+                self._admit(profile, response)
+            env = self.interpreter.create_env(code, symbols, output)
+            env.enable_metrics()
+            env.max_call_depth = limits['call_depth']
+            if limits.get('memory') is not None:
+                env.enable_memory_accounting(hard_limit=limits['memory'])
+
+            self._execute(env, limits.get('steps'), limits.get('time'))
+            response['ok'] = True
+            response['result'] = self._get_result(env, symbols)
+        except Exception as e:
+            response['ok'] = False
+            response['type'] = e.__class__.__name__
+            response['error'] = str(e)
+
+        if output is not None:
+            response['output'] = output.getvalue()
+        if env is not None:
+            response['metrics'] = env.metrics.snapshot()
+        return response
+
+    def _execute(self, env, max_steps, max_time):
+        if max_time is None or not self.watchdog:
+            return self._step(env, max_steps, max_time)
+
+        def expired(signum, frame):
+            raise EnvTimeLimitExceeded(env, max_time)
+        handler = signal.signal(signal.SIGALRM, expired)
+        signal.setitimer(signal.ITIMER_REAL, max_time)
+        # the last resort, for the steps running into C code: SIGVTALRM
+        # kills the process
+        signal.signal(signal.SIGVTALRM, signal.SIG_DFL)
+        signal.setitimer(signal.ITIMER_VIRTUAL, max_time + WATCHDOG_GRACE)
+        try:
+            self._step(env, max_steps, max_time)
+        except EnvTimeLimitExceeded:
+            # maybe raised out of the interpreter
+            env.abort()
+            self.interpreter.flush_output(env)
+            raise
+        finally:
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handler)
+
+    def _step(self, env, max_steps, max_time):
+        interpreter = self.interpreter
+        if max_time is not None:
+            deadline = time.time() + max_time
+        steps = 0
+
+        while True:
+            try:
+                interpreter.step(env)
+            except EnvExecEnd:
+                return
+            steps += 1
+
+            if max_steps is not None and steps > max_steps:
+                env.abort()
+                interpreter.flush_output(env)
+                raise EnvBudgetExceeded(env, max_steps)
+            if max_time is not None and not steps % TIME_CHECK_STEPS and time.time() > deadline:
+                env.abort()
+                interpreter.flush_output(env)
+                raise EnvTimeLimitExceeded(env, max_time)
+
+    def _get_result(self, env, symbols):
+        result = {}
+        for name,val in env.get_global_context().items():
+            if name[0] == "_" or (name in BUILTINS and BUILTINS[name] is val):
+                continue
+            if name in symbols and symbols[name] is val:
+                continue
+            result[name] = val
+        return result
+
+class WorkerServer(object):
+    """workers: number of forked worker processes
+       max_jobs: jobs after which a worker is replaced by a new one
+    """
+    def __init__(self, address, workers=4, symbols={}, limits={},
+            cache_size=DEFAULT_CACHE_SIZE, max_jobs=None, admission=None):
+        self.address = address
+        self.workers = workers
+        self.symbols = symbols
+        self.limits = limits
+        self.cache_size = cache_size
+        self.max_jobs = max_jobs
+        self.admission = admission
+        self.socket = None
+        self._children = set()
+        self._running = False
+
+    def bind(self):
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.unlink(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(128)
+
+    """Forks the workers and replaces them as they exit, until shutdown"""
+    def serve_forever(self):
+        if self.socket is None:
+            self.bind()
+        self._running = True
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+
+        try:
+            for i in range(self.workers):
+                self._spawn()
+            while self._running:
+                try:
+                    pid, status = os.wait()
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                if pid in self._children:
+                    self._children.discard(pid)
+                    if self._running:
+                        self._spawn()
+        finally:
+            self.shutdown()
+
+    def _on_signal(self, signum, frame):
+        self._running = False
+
+    def shutdown(self):
+        self._running = False
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self._children.clear()
+
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+            family, address = parse_address(self.address)
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.unlink(address)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self._children.add(pid)
+            return
+
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            self._worker_loop()
+        except Exception:
+            status = 1
+        os._exit(status)
+
+    def _worker_loop(self):
+        runner = JobRunner(self.symbols, self.limits, self.cache_size, self.admission,
+            watchdog=True)
+        jobs = 0
+        while self.max_jobs is None or jobs < self.max_jobs:
+            conn, peer = self.socket.accept()
+            try:
+                jobs += self._serve_connection(conn, runner)
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+
+    def _serve_connection(self, conn, runner):
+        recv = lambda: conn.recv(RECV_SIZE)
+        first = recv()
+        if not first:
+            return 0
+        codec = get_codec(CODEC_MSGPACK if _is_msgpack(first[0]) else CODEC_JSON)
+
+        jobs = 0
+        for job in codec.messages(recv, first):
+            conn.sendall(codec.encode(runner.run(job)))
+            jobs += 1
+        return jobs
+
+"""The response of a submitted job"""
+class Job(object):
+    def __init__(self, jid):
+        self.id = jid
+        self.response = None
+        self._done = threading.Event()
+
+    def _set_response(self, response):
+        self.response = response
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    """waits for the response, returns the job result or raises JobError"""
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise JobError({'id':self.id, 'type':"Timeout", 'error':"no response"})
+        if not self.response.get('ok'):
+            raise JobError(self.response)
+        return self.response.get('result')
+
+class _Connection(object):
+    def __init__(self, address, codec):
+        family, address = parse_address(address)
+        self.codec = codec
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._closed = False
+
+        self._reader = threading.Thread(target=self._read_loop)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def get_pending_count(self):
+        return len(self._pending)
+
+    def send(self, job, message):
+        data = self.codec.encode(message)
+        with self._lock:
+            if self._closed:
+                raise JobError({'id':job.id, 'type':"ConnectionError", 'error':"connection closed"})
+            self._pending.append(job)
+            self.sock.sendall(data)
+
+    def _read_loop(self):
+        try:
+            # the responses come in the jobs order
+            for response in self.codec.messages(lambda: self.sock.recv(RECV_SIZE), self.sock.recv(RECV_SIZE)):
+                job = self._pending.popleft()
+                if not isinstance(response, dict):
+                    response = {'id':job.id, 'ok':False, 'type':"BadResponse", 'error':str(response)}
+                job._set_response(response)
+        except socket.error:
+            pass
+
+        with self._lock:
+            self._closed = True
+            while self._pending:
+                job = self._pending.popleft()
+                job._set_response({'id':job.id, 'ok':False, 'type':"ConnectionError",
+                    'error':"connection lost"})
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+"""Submits jobs to one or more workers, balancing them over the connections"""
+class WorkerClient(object):
+    """addresses: worker addresses, see parse_address
+       connections: per address; each connection is served by a worker process
+    """
+    def __init__(self, addresses, connections=1, codec=CODEC_JSON):
+        if isinstance(addresses, (str, tuple)):
+            addresses = [addresses]
+        codec = get_codec(codec)
+        self._connections = [_Connection(address, codec)
+            for address in addresses for i in range(connections)]
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._next_conn = 0
+
+    def _pick_connection(self):
+        # the least loaded one, round robin among equals
+        conns = self._connections
+        n = len(conns)
+        best = None
+        for i in range(n):
+            conn = conns[(self._next_conn + i) % n]
+            if not conn._closed and (best is None or conn.get_pending_count() < best.get_pending_count()):
+                best = conn
+        self._next_conn = (self._next_conn + 1) % n
+        return best or conns[0]
+
+    """Sends a job without waiting for it, returns a Job"""
+    def submit(self, script, symbols={}, limits={}):
+        with self._lock:
+            self._next_id += 1
+            job = Job(self._next_id)
+            conn = self._pick_connection()
+        conn.send(job, {'id':job.id, 'script':script, 'symbols':symbols, 'limits':limits})
+        return job
+
+    """Runs a job, returns its result or raises JobError"""
+    def run(self, script, symbols={}, limits={}, timeout=None):
+        return self.submit(script, symbols, limits).result(timeout)
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="pesci.worker",
+        description="Runs a PesciCode worker daemon.")
+    parser.add_argument("--listen", default="unix:/tmp/pesci.sock",
+        help="unix:/path or host:port (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=4,
+        help="number of worker processes (default: %(default)s)")
+    parser.add_argument("--max-jobs", type=int, metavar="N",
+        help="replace a worker process after N jobs")
+    parser.add_argument("--max-steps", type=int, metavar="N",
+        help="maximum steps of a job")
+    parser.add_argument("--max-time", type=float, metavar="S",
+        help="maximum seconds of a job")
+    parser.add_argument("--max-memory", type=int, metavar="B",
+        help="maximum estimated memory of a job")
+    parser.add_argument("--max-cost", type=int, metavar="N",
+        help="reject the scripts estimated over N steps")
+    parser.add_argument("--max-loop-depth", type=int, metavar="N",
+        help="reject the scripts with loops nested deeper than N")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    limits = {'steps':args.max_steps, 'time':args.max_time, 'memory':args.max_memory}
+    admission = None
+    if args.max_cost is not None or args.max_loop_depth is not None:
+        admission = AdmissionController(max_steps=args.max_cost, max_loop_depth=args.max_loop_depth)
+    server = WorkerServer(args.listen, workers=args.workers, max_jobs=args.max_jobs,
+        limits=dict([(k,v) for k,v in limits.items() if v is not None]), admission=admission)
+    server.serve_forever()
@@ -0,0 +1,13 @@
+# overflows int64 for the big rows
+total = price * qty + big * big
+shifted = qty << 40
+power = big ** 3
+ratio = price / qty
+rest = price % qty
+fprice = price * 1.5
+flags = (price > 10) + (qty > 1)
+inverted = ~(qty > 1)
+if total > 100:
+    label = "high"
+else:
+    label = "low"
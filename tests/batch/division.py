@@ -0,0 +1,2 @@
+# the rows with a zero qty fail
+unit = price / qty
@@ -0,0 +1,4 @@
+# built by concatenation, row by row
+label = name
+for i in range(count):
+    label += "!"
@@ -0,0 +1,5 @@
+# a parameter given both by position and by keyword
+def f(a, b=1):
+    return a + b
+
+f(1, a=2)
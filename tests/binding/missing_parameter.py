@@ -0,0 +1,5 @@
+# a parameter without default nor value
+def f(a, b, c=1):
+    return a + b + c
+
+f(1, c=2)
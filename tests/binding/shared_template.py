@@ -0,0 +1,5 @@
+# the defaults come from the environment of each definition
+def scale(x, factor=default_factor):
+    return x * factor
+
+result = scale(10)
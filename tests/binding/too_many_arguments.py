@@ -0,0 +1,5 @@
+# more positional arguments than parameters, without *args
+def f(a, b=1, **options):
+    return a
+
+f(1, 2, 3)
@@ -0,0 +1,5 @@
+# a keyword without a parameter nor **kwargs
+def f(a, *rest):
+    return a
+
+f(1, 2, other=3)
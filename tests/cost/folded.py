@@ -0,0 +1,7 @@
+# bounds and sizes given as constant expressions
+total = 0
+for i in range(10 ** 9):
+    total += i
+line = "-" * (2 ** 20)
+for j in range(-1 * 5):
+    total += j
@@ -0,0 +1,16 @@
+# one loop at the top level, two more into the called functions
+def inner(items):
+    t = 0
+    for item in items:
+        t += item
+    return t
+
+def outer(rows):
+    t = 0
+    for row in rows:
+        t += inner(row)
+    return t
+
+total = 0
+for k in range(3):
+    total += outer(data)
@@ -0,0 +1,7 @@
+# statements sharing a line stop once per run of the line
+a = 1; b = 2
+total = 0
+for i in range(3):
+    total += i; a += 1
+def f(v): return v + 1
+print f(total), a
@@ -0,0 +1,18 @@
+# globals changed in place by functions and statements
+results = []
+totals = {}
+
+def collect(v):
+    results.append(v)
+    totals.update({v % 3: v})
+
+def scale(x):
+    return x * factor
+
+collect(scale(a))
+collect(b)
+count = len(results)
+
+log = []
+log.append(a)
+size = len(log) + b
@@ -0,0 +1,22 @@
+# globals changed in place through the parameters of functions
+results = []
+
+def add(l, v):
+    l.append(v)
+
+def add_twice(target, v):
+    add(target, v)
+    scaled = v * factor
+    add(l=target, v=scaled)
+
+def keep(*values):
+    kept = []
+    for v in values:
+        add(kept, v)
+    return kept
+
+add(results, a)
+pairs = []
+add_twice(pairs, b)
+count = len(results) + len(pairs)
+kept = keep(a, b)
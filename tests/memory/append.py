@@ -0,0 +1,8 @@
+# grows a list without assigning it again
+rows = []
+for i in range(n):
+    row = []
+    for j in range(100):
+        row.append("cell %d" % j)
+    rows.append(row)
+print len(rows)
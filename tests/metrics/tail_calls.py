@@ -0,0 +1,11 @@
+# count down through tail calls
+def down(n, acc):
+    if n == 0:
+        return acc
+    return down(n - 1, acc + n)
+
+def twice(n):
+    return down(n, 0) * 2
+
+print down(10, 0)
+print twice(5)
@@ -0,0 +1,2 @@
+# A host function called back as a filter
+values = filter(danger, [1])
@@ -0,0 +1,2 @@
+# A host function called back by a whitelisted builtin
+values = map(danger, [1])
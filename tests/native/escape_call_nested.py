@@ -0,0 +1,2 @@
+# A host function called back through two whitelisted builtins
+values = map(map, [danger], [[1]])
@@ -0,0 +1,2 @@
+# A host function called back by reduce
+value = reduce(danger, [1, 2])
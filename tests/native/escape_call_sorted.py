@@ -0,0 +1,2 @@
+# A host function called back as a sort key
+values = sorted([2, 1], key=danger)
@@ -0,0 +1,5 @@
+# A script function code object
+def f():
+    pass
+
+c = f.func_code.co_consts
@@ -0,0 +1,5 @@
+# A script function leads to the host builtins through func_globals
+def f():
+    pass
+
+os = f.func_globals["__builtins__"]["__pesci_call"].im_func.func_globals["__builtins__"]["__import__"]("os")
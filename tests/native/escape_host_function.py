@@ -0,0 +1,2 @@
+# An injected host function leads to its module globals
+g = len.im_self
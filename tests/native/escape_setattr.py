@@ -0,0 +1,5 @@
+# Attribute stores go through the same guard as the reads
+def f():
+    pass
+
+f.func_defaults = [1]
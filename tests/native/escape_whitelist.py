@@ -0,0 +1,6 @@
+# The runtime whitelist switched off from inside the script
+def f():
+    pass
+
+rt = f.func_globals["__builtins__"]["__pesci_call"].im_self
+rt.whitelist = None
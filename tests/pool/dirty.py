@@ -0,0 +1,13 @@
+# changes the preloaded names, and adds new ones
+greeting += "!"
+count = count + 1
+
+def bump():
+    global count
+    count += 10
+
+bump()
+label = "n"
+for i in range(3):
+    label += str(i)
+print greeting, count, label
@@ -0,0 +1,3 @@
+# fails after changing a preloaded name
+count = 5
+broken = 1 / 0
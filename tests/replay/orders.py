@@ -0,0 +1,7 @@
+# host lookups, method calls and host objects given back to the host
+total = 0
+for code in codes:
+    item = store.find(code, currency="EUR")
+    if store.available(item):
+        total += item.price * rate(item.category)
+print total, len(codes)
@@ -0,0 +1,7 @@
+# comparisons and arithmetic on the values returned by the host
+p = store.price("a1")
+print p == 10, p > 5, 5 < p, p != 10, p >= p
+print p * 2, 2 * p + 1, abs(p), p / 4
+print float(p) + 0.5, int(p) % 3
+counts = {p: 1}
+print len(counts), p in counts
@@ -0,0 +1,910 @@
+#!/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Emanuele Faranda                         <black.silver@hotmail.it>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+import glob
+import json
+import os
+import signal
+import sys
+import traceback
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from pesci import *
+from pesci.environment import DEFAULT_MAX_CALL_DEPTH
+from pesci.errors import BadFunctionCall, InterpretError, PesciSyntaxError, ReplayMismatch, ScriptRejected
+from pesci.output import CaptureSink
+
+"""
+Runs the PesciCode scripts of this directory, from the repository root:
+
+    python tests/run_tests.py
+
+Each testN.py script with a testN.out file is run by the interpreter, at
+node and statement granularity and as a compact program, and its output is
+compared with the file. The checks below run the scripts of the
+subdirectories through the other subsystems.
+"""
+
+CHECKS = []
+
+def check(f):
+    CHECKS.append(f)
+    return f
+
+def path(*names):
+    return os.path.join(TESTS_DIR, *names)
+
+def run(code, interpreter=None, symbols={}, native=False, whitelist=None, **kwargs):
+    interpreter = interpreter or Interpreter(**kwargs)
+    sink = CaptureSink()
+    env = interpreter.create_env(code, symbols, sink)
+    if native:
+        interpreter.run_native(env, whitelist=whitelist)
+    else:
+        interpreter.run(env)
+    return env, sink.getvalue()
+
+def expect_error(errors, f, *args, **kwargs):
+    try:
+        f(*args, **kwargs)
+    except errors:
+        return
+    raise AssertionError("%s not raised" % (errors,))
+
+def script_checks():
+    for source in sorted(glob.glob(path("test*.py"))):
+        expected = os.path.splitext(source)[0] + ".out"
+        if not os.path.exists(expected):
+            continue
+        def check_script(source=source, expected=expected):
+            with open(expected) as f:
+                output = f.read()
+            code = PesciCode.from_file(source)
+            for kwargs in ({}, {'granularity':"statement"}):
+                got = run(code, **kwargs)[1]
+                assert got == output, "%s %s:\n%s" % (source, kwargs, got)
+            got = run(PesciCode.from_file(source).compact())[1]
+            assert got == output, "%s compact:\n%s" % (source, got)
+        check_script.__name__ = os.path.basename(source)
+        yield check_script
+
+## Node handlers
+
+def negated(env, node):
+    env.push(-env.getvar(node.id))
+
+@check
+def handlers_exact_type():
+    import ast
+    interpreter = Interpreter()
+    source = "x = y + 1\n"
+    interpreter.register_handler(ast.Name, negated)
+    env = run(PesciCode.from_string(source), interpreter, {'y':3})[0]
+    assert env.getvar("x") == -2
+    interpreter.unregister_handler(ast.Name)
+    env = run(PesciCode.from_string(source), interpreter, {'y':3})[0]
+    assert env.getvar("x") == 4
+
+@check
+def handlers_subclass_fallback():
+    import ast
+    from pesci.errors import EnvSymbolNotFound
+    from pesci.ir import compact_class
+    interpreter = Interpreter()
+    source = "x = missing\n"
+    # the compact nodes are subclasses of the ast ones
+    interpreter.register_handler(compact_class(ast.Name), lambda env, node: env.push(node.id))
+    expect_error(EnvSymbolNotFound, run, PesciCode.from_string(source), interpreter)
+    env = run(PesciCode.from_string(source).compact(), interpreter)[0]
+    assert env.getvar("x") == "missing"
+    interpreter.unregister_handler(compact_class(ast.Name))
+    expect_error(EnvSymbolNotFound, run, PesciCode.from_string(source).compact(), interpreter)
+
+    # a base type handler serves its subclasses, through the MRO
+    interpreter.register_handler(ast.Name, negated)
+    env = run(PesciCode.from_string("x = y\n").compact(), interpreter, {'y':3})[0]
+    assert env.getvar("x") == -3
+    interpreter.unregister_handler(ast.Name)
+    env = run(PesciCode.from_string("x = y\n").compact(), interpreter, {'y':3})[0]
+    assert env.getvar("x") == 3
+
+## Function calls
+
+@check
+def binding_errors():
+    for name in ("double_assignment", "double_default", "missing_parameter",
+            "unknown_keyword", "too_many_arguments"):
+        code = PesciCode.from_file(path("binding", name + ".py"))
+        for kwargs in ({}, {'tier_threshold':1}):
+            expect_error(BadFunctionCall, run, code, **kwargs)
+
+@check
+def binding_shared_template():
+    code = PesciCode.from_file(path("binding", "shared_template.py")).compact()
+    interpreter = Interpreter()
+    env1 = run(code, interpreter, {'default_factor':2})[0]
+    env2 = run(code, interpreter, {'default_factor':3})[0]
+    assert (env1.getvar("result"), env2.getvar("result")) == (20, 30)
+
+    f1, f2 = env1.getvar("scale"), env2.getvar("scale")
+    assert f1 is not f2 and f1.template is f2.template
+    assert f1.defaults == (2,) and f2.defaults == (3,), (f1.defaults, f2.defaults)
+    # the first function keeps its own defaults
+    assert interpreter.call_function(env1, f1, (5,)) == 10
+    assert interpreter.call_function(env2, f2, (5,), {'factor':4}) == 20
+
+## Imports
+
+@check
+def optional_subsystems_lazy():
+    import subprocess
+    script = ("import sys; import pesci; "
+        "print ' '.join(sorted([m for m in sys.modules if m.startswith('pesci.') and sys.modules[m]]))")
+    loaded = subprocess.check_output([sys.executable, "-c", script],
+        cwd=os.path.dirname(TESTS_DIR)).split()
+    for module in ("native", "tier", "ir", "memory", "batch", "worker", "replay", "profiler"):
+        assert not "pesci." + module in loaded, loaded
+
+## Command line
+
+@check
+def batch_empty_glob():
+    from pesci.runner import expand_sources
+    assert expand_sources([path("test1.py"), path("test[12].py")]) == \
+        [path("test1.py"), path("test1.py"), path("test2.py")]
+    expect_error(ValueError, expand_sources, [path("nomatch*.py")])
+
+## Threads
+
+@check
+def threads_share_interpreter():
+    import threading, time
+    from pesci.interpreter import ThreadPoolExecutor
+    interpreter = Interpreter(max_workers=2)
+    code = PesciCode.from_string("def twice(v):\n    pause(0.05)\n    return v * 2\n"
+        "result = twice(n)\nprint result\n")
+    def create_envs():
+        sinks = [CaptureSink() for n in range(4)]
+        return [interpreter.create_env(code, {'n':n, 'pause':time.sleep}, sink)
+            for n,sink in enumerate(sinks)], sinks
+    def check_envs(envs, sinks):
+        assert [env.getvar("result") for env in envs] == [0, 2, 4, 6]
+        assert [sink.getvalue() for sink in sinks] == ["0\n", "2\n", "4\n", "6\n"]
+
+    # the environments run at once, their host calls overlap
+    envs, sinks = create_envs()
+    threads = [threading.Thread(target=interpreter.run, args=(env,)) for env in envs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    check_envs(envs, sinks)
+
+    envs, sinks = create_envs()
+    if ThreadPoolExecutor is None:
+        expect_error(RuntimeError, interpreter.submit, envs[0])
+        return
+    try:
+        futures = [interpreter.submit(env) for env in envs]
+        assert [future.result(timeout=10) for future in futures] == envs
+    finally:
+        interpreter.shutdown()
+    check_envs(envs, sinks)
+
+## Host types
+
+class Account(object):
+    def __init__(self, balance):
+        self.balance = balance
+        self.owner = "root"
+
+    def deposit(self, v):
+        self.balance += v
+
+class SavingAccount(Account):
+    pass
+
+@check
+def host_types_check():
+    interpreter = Interpreter()
+    interpreter.register_host_type(Account, attributes=['balance'], methods=['deposit'])
+    account = SavingAccount(10)
+    env, output = run(PesciCode.from_string("account.deposit(5)\nprint account.balance\n"),
+        interpreter, {'account':account})
+    assert output == "15\n", output
+
+    # rejected before running, through the subclasses too
+    code = PesciCode.from_string("account.deposit(5)\nprint account.owner\n")
+    expect_error(PesciSyntaxError, interpreter.create_env, code, {'account':account})
+    assert account.balance == 15
+    # an assigned name is only known at run time
+    code = PesciCode.from_string("a = account\nprint a.owner\n")
+    env = interpreter.create_env(code, {'account':account})
+    expect_error(InterpretError, interpreter.run, env)
+
+    # the unregistered types keep their public attributes, unless strict
+    code = PesciCode.from_string("print item.price\n")
+    output = run(code, interpreter, {'item':Item("a", 1)})[1]
+    assert output == "1\n", output
+    interpreter.host_types.strict = True
+    expect_error(PesciSyntaxError, interpreter.create_env, code, {'item':Item("a", 1)})
+    code = PesciCode.from_string("i = item\nprint i.price\n")
+    expect_error(InterpretError, run, code, interpreter, {'item':Item("a", 1)})
+    output = run(PesciCode.from_string("print account.balance\n"), interpreter, {'account':account})[1]
+    assert output == "15\n", output
+
+## Output sinks
+
+@check
+def output_sinks():
+    from StringIO import StringIO
+    from pesci.output import CallbackSink, RingBufferSink, StreamSink, FLUSH_MANUAL, FLUSH_SIZE
+    interpreter = Interpreter()
+    code = PesciCode.from_string("for i in range(5):\n    print 'line', i\n")
+    lines = ["line %d\n" % i for i in range(5)]
+    def run_sink(sink):
+        interpreter.run(interpreter.create_env(code, {}, sink))
+
+    sink = RingBufferSink(max_bytes=14)
+    run_sink(sink)
+    assert sink.getvalue() == "line 3\nline 4\n" and sink.dropped == 3, (sink.getvalue(), sink.dropped)
+
+    for kwargs, expected in (({}, lines),
+            ({'policy':FLUSH_SIZE, 'buffer_size':14}, [lines[0] + lines[1], lines[2] + lines[3], lines[4]]),
+            ({'policy':FLUSH_MANUAL}, ["".join(lines)])):
+        texts = []
+        run_sink(CallbackSink(texts.append, **kwargs))
+        assert texts == expected, (kwargs, texts)
+
+    # buffered, flushed at the end of the execution
+    stream = StringIO()
+    sink = StreamSink(stream, buffer_size=1000)
+    sink.write_line("first")
+    assert stream.getvalue() == ""
+    run_sink(sink)
+    assert stream.getvalue() == "first\n" + "".join(lines), stream.getvalue()
+
+## Step granularity
+
+def step_lines(interpreter, code, granularity=None):
+    from pesci.errors import EnvExecEnd
+    sink = CaptureSink()
+    env = interpreter.create_env(code, {}, sink)
+    env.granularity = granularity
+    lines = []
+    while True:
+        try:
+            lines.append(interpreter.step(env).lineno)
+        except EnvExecEnd:
+            return lines, sink.getvalue()
+
+@check
+def step_granularity():
+    code = PesciCode.from_file(path("granularity", "lines.py"))
+    lines, output = step_lines(Interpreter(granularity="line"), code)
+    # the loop body line stops once per iteration, the for statement last
+    assert lines == [2, 3, 5, 5, 5, 4, 6, 7] and output == "4 4\n", (lines, output)
+    lines, output = step_lines(Interpreter(granularity="statement"), code)
+    assert lines == [2, 2, 3] + [5] * 6 + [4, 6, 6, 7] and output == "4 4\n", (lines, output)
+    # the environment overrides the interpreter granularity
+    assert step_lines(Interpreter(), code, "line") == step_lines(Interpreter(granularity="line"), code)
+    expect_error(ValueError, Interpreter, granularity="word")
+
+## Native mode
+
+@check
+def native_escapes():
+    from pesci.interpreter import BUILTINS
+    called = []
+    def danger(*args, **kwargs):
+        called.append(args)
+    symbols = {'danger':danger}
+    whitelist = [f for f in BUILTINS.values() if callable(f)]
+
+    # each script tries to reach the host internals, or to call a host
+    # function out of the whitelist
+    for source in sorted(glob.glob(path("native", "escape_*.py"))):
+        code = PesciCode.from_file(source)
+        expect_error((PesciSyntaxError, InterpretError), run, code, symbols=symbols,
+            native=True, whitelist=whitelist)
+        assert not called, (source, called)
+        if not os.path.basename(source).startswith("escape_call_"):
+            # the interpreter has no whitelist
+            expect_error((InterpretError, AttributeError), run, code)
+
+    # the allowed callables are called back as usual
+    code = PesciCode.from_string("def twice(v):\n    return v * 2\n"
+        "print map(twice, [1, 2]), sorted([3, -1], key=abs), map(str, [4])\n")
+    output = run(code, native=True, whitelist=whitelist)[1]
+    assert output == "[2, 4] [-1, 3] ['4']\n", output
+    expr = Interpreter().compile_expression("map(f, [1])", whitelist=whitelist)
+    expect_error(InterpretError, expr, {'f':danger})
+    assert not called, called
+
+@check
+def native_runtime_guard():
+    import os as host_os
+    class Point(object):
+        def __init__(self):
+            self.x = 0
+        def move(self):
+            self.x += 1
+    interpreter = Interpreter()
+    interpreter.register_host_type(Point, attributes=['x'], methods=['move'])
+    p = Point()
+
+    run(PesciCode.from_string("p.x = 5\np.move()\nprint p.x"), interpreter,
+        {'p':p}, native=True)
+    assert p.x == 6, p.x
+    # a method is not an attribute to assign
+    expect_error(InterpretError, run, PesciCode.from_string("p.move = 1"),
+        interpreter, {'p':p}, native=True)
+    # the introspection attributes are only denied on functions and the like
+    class Player(object):
+        f_score = 3
+        co_owner = "x"
+    interpreter.register_host_type(Player, attributes=['f_score', 'co_owner'])
+    output = run(PesciCode.from_string("print p.f_score, p.co_owner"), interpreter,
+        {'p':Player()}, native=True)[1]
+    assert output == "3 x\n", output
+    output = run(PesciCode.from_string("print p.f_score"), symbols={'p':Player()})[1]
+    assert output == "3\n", output
+    # the callables not injected are not allowed by default
+    expect_error(InterpretError, run, PesciCode.from_string("f = factory()\nf()"),
+        interpreter, {'factory':lambda: host_os.getcwd}, native=True)
+
+@check
+def compiled_expressions():
+    from pesci.interpreter import MAX_EXPRESSIONS
+    interpreter = Interpreter()
+    pred = interpreter.compile_expression("price > 10 and code in codes")
+    assert pred({'price':12, 'code':"a", 'codes':["a", "b"]}) is True
+    assert pred({'price':8, 'code':"a", 'codes':["a"]}) is False
+    assert interpreter.compile_expression("price > 10 and code in codes") is pred
+
+    expect_error(PesciSyntaxError, interpreter.compile_expression, "x.__class__")
+    expect_error(SyntaxError, interpreter.compile_expression, "x = 1")
+    expect_error(SyntaxError, interpreter.compile_expression, "print x")
+    expect_error(InterpretError, interpreter.compile_expression("y + 1"), {'x':1})
+
+    # the least recently used expressions are dropped
+    for i in range(MAX_EXPRESSIONS):
+        interpreter.compile_expression("x + %d" % i)
+        interpreter.compile_expression("price > 10 and code in codes")
+    assert len(interpreter._expressions) == MAX_EXPRESSIONS
+    assert interpreter.compile_expression("price > 10 and code in codes") is pred
+    assert not "x + 0" in interpreter._expressions
+
+## Environment pool
+
+@check
+def pool_restores_environments():
+    from pesci.pool import EnvironmentPool
+    from pesci.output import CaptureSink
+    interpreter = Interpreter()
+    pool = EnvironmentPool(interpreter, {'greeting':"hi", 'count':1}, size=1)
+    dirty = PesciCode.from_file(path("pool", "dirty.py"))
+    failing = PesciCode.from_file(path("pool", "failing.py"))
+
+    env = pool.acquire()
+    initial = dict(env.get_global_context())
+    pool.release(env)
+    for code in (dirty, failing, dirty):
+        sink = CaptureSink()
+        with pool.environment(code, sink) as env:
+            try:
+                interpreter.run(env)
+            except ZeroDivisionError:
+                assert code is failing
+        if code is dirty:
+            assert sink.getvalue() == "hi! 12 n012\n", sink.getvalue()
+        # the very same environment, back to its preloaded state
+        assert pool.acquire(timeout=0) is env
+        assert env.get_global_context() == initial, env.get_global_context()
+        pool.release(env)
+
+@check
+def pool_resets_settings():
+    from pesci.pool import EnvironmentPool
+    from pesci.profiler import SamplingProfiler
+    interpreter = Interpreter(tier_threshold=1)
+    pool = EnvironmentPool(interpreter, {'greeting':"hi", 'count':1}, size=1)
+    dirty = PesciCode.from_file(path("pool", "dirty.py"))
+    calls = []
+
+    with pool.environment(dirty) as env:
+        env.enable_metrics()
+        env.add_hook("call", lambda *args: calls.append(args))
+        env.enable_memory_accounting(hard_limit=10 ** 6)
+        SamplingProfiler().attach(env)
+        env.max_call_depth = 5
+        env.granularity = "line"
+        env.tiering = False
+        env.interactive = True
+        interpreter.run(env)
+        assert env.metrics.steps and env.memory.total and len(calls) == 1
+
+    # the next user gets an environment as created by the interpreter
+    with pool.environment(dirty) as env:
+        fresh = interpreter.create_env()
+        for name in ("max_call_depth", "metrics", "hooks", "instrumented", "profiler",
+                "memory", "granularity", "tiering", "interactive"):
+            assert getattr(env, name) == getattr(fresh, name), name
+        interpreter.run(env)
+    assert len(calls) == 1, calls
+    # the interpreter default settings are kept
+    interpreter.enable_metrics()
+    pool = EnvironmentPool(interpreter, {'greeting':"hi", 'count':1}, size=1)
+    with pool.environment(dirty) as env:
+        metrics = env.metrics
+        interpreter.run(env)
+    with pool.environment() as env:
+        assert env.metrics is metrics and env.instrumented and env.metrics.steps == 0
+
+## Memory accounting
+
+@check
+def memory_limit_by_appending():
+    from pesci.errors import EnvMemoryExceeded
+    code = PesciCode.from_file(path("memory", "append.py"))
+    interpreter = Interpreter()
+    env = interpreter.create_env(code, {'n':10})
+    env.enable_memory_accounting(hard_limit=1 << 20)
+    interpreter.run(env)
+    usage = env.get_memory_usage()['total']
+    # the grown list is accounted to its variable
+    assert env.get_top_variables(1)[0][1] == "rows", env.get_top_variables(1)
+    assert usage > 10 * 1000, usage
+
+    env = interpreter.create_env(code, {'n':1000})
+    env.enable_memory_accounting(hard_limit=1 << 20)
+    expect_error(EnvMemoryExceeded, interpreter.run, env)
+    assert env.get_memory_usage()['total'] > 1 << 20
+
+@check
+def memory_reads_not_sized():
+    from pesci import memory
+    sized = []
+    estimate_size = memory.estimate_size
+    def counting(value, *args, **kwargs):
+        sized.append(value)
+        return estimate_size(value, *args, **kwargs)
+    big = [[range(20) for i in range(100)] for j in range(100)]
+    code = PesciCode.from_string("for i in range(50):\n    n = len(big)\n")
+    interpreter = Interpreter()
+    env = interpreter.create_env(code, {'big':big})
+    env.enable_memory_accounting()
+    memory.estimate_size = counting
+    try:
+        interpreter.run(env)
+    finally:
+        memory.estimate_size = estimate_size
+    # only the stored values, not the operands
+    assert not [v for v in sized if v is big], len(sized)
+
+## Batch mode
+
+BATCH_COLUMNS = {
+    'price': [5, 20, 3000000000, -7],
+    'qty': [2, 1, 3, 4],
+    'big': [3, -2, 1 << 40, 1 << 62],
+}
+
+def batch_backends():
+    from pesci import batch
+    backends = [batch.ListBackend]
+    if batch.numpy is not None:
+        backends.append(batch.NumpyBackend)
+    return backends
+
+def run_batch(code, columns, backend):
+    from pesci.batch import BatchEvaluator
+    evaluator = BatchEvaluator(Interpreter(), code)
+    evaluator._select_backend = lambda columns: backend()
+    return evaluator.run(columns)
+
+@check
+def batch_matches_interpreter():
+    code = PesciCode.from_file(path("batch", "arithmetic.py"))
+    n = len(BATCH_COLUMNS['price'])
+    for backend in batch_backends():
+        results = run_batch(code, BATCH_COLUMNS, backend)
+        for i in range(n):
+            row = dict([(name, data[i]) for name,data in BATCH_COLUMNS.items()])
+            env = run(code, symbols=row)[0]
+            for name,data in results.items():
+                expected = env.getvar(name)
+                got = data[i]
+                # numpy scalars compare equal to the python values
+                assert got == expected, "%s %s[%d]: %r != %r" % (
+                    backend.__name__, name, i, got, expected)
+
+@check
+def batch_errors():
+    code = PesciCode.from_file(path("batch", "division.py"))
+    for backend in batch_backends():
+        columns = {'price':[1.0, 2.0], 'qty':[1.0, 0.0]}
+        expect_error(ZeroDivisionError, run_batch, code, columns, backend)
+        columns = {'price':[1, 2], 'qty':[1, 0]}
+        expect_error(ZeroDivisionError, run_batch, code, columns, backend)
+    # the unary operators which the interpreter does not support
+    for source in ("y = -price\n", "y = +price\n"):
+        code = PesciCode.from_string(source)
+        expect_error(AssertionError, run, code, symbols={'price':1})
+        for backend in batch_backends():
+            expect_error(AssertionError, run_batch, code, {'price':[1, 2]}, backend)
+
+@check
+def batch_strings():
+    code = PesciCode.from_file(path("batch", "strings.py"))
+    results = Interpreter().run_batch(code, {'name':["a", "b"], 'count':[1, 3]})
+    assert list(results['label']) == ["a!", "b!!!"], results
+
+## Strings
+
+@check
+def string_builder_size():
+    from pesci.builder import StringBuilder
+    builder = StringBuilder("a")
+    for i in range(100):
+        builder.append("b")
+    pieces = sys.getsizeof(builder.parts) + sum([sys.getsizeof(p) for p in builder.parts])
+    assert builder.estimate_size() >= pieces, (builder.estimate_size(), pieces)
+    assert builder.build() == "a" + "b" * 100
+
+## Metrics
+
+@check
+def tail_call_hooks():
+    from pesci.metrics import EVENT_CALL, EVENT_RETURN
+    events = []
+    interpreter = Interpreter()
+    interpreter.enable_metrics()
+    interpreter.add_hook(EVENT_CALL, lambda env, f, node: events.append(("call", f.name)))
+    interpreter.add_hook(EVENT_RETURN, lambda env, f, val: events.append(("return", f.name)))
+    env, output = run(PesciCode.from_file(path("metrics", "tail_calls.py")), interpreter)
+    assert output == "55\n30\n", output
+
+    # down(10..0), twice + down(5..0)
+    calls = [e for e in events if e[0] == "call"]
+    assert len(calls) == 11 + 1 + 6, calls
+    assert env.metrics.pesci_calls == len(calls), env.metrics.pesci_calls
+    # every call returns once, in order
+    depth = 0
+    for kind,name in events:
+        depth += 1 if kind == "call" else -1
+        assert 0 <= depth <= 2, events
+    assert depth == 0, events
+
+@check
+def profiler_samples():
+    from pesci.profiler import SamplingProfiler
+    interpreter = Interpreter()
+    interpreter.enable_metrics()
+    profiler = SamplingProfiler(interval=10)
+    profiler.attach(interpreter)
+    # no hooks: the profiled functions can still be tiered
+    assert not interpreter.hooks
+    env, output = run(PesciCode.from_file(path("metrics", "tail_calls.py")), interpreter)
+    profiler.detach()
+    assert interpreter.profiler is None
+
+    samples = profiler.get_samples()
+    assert sum(samples.values()) == env.metrics.steps // 10, samples
+    assert [s for s in samples if s.endswith(";down:5")], samples
+
+## Incremental execution
+
+@check
+def incremental_matches_full_run():
+    from pesci.incremental import IncrementalRunner
+    for script, names in (("collect", ('results', 'totals', 'count', 'log', 'size')),
+            ("parameters", ('results', 'pairs', 'count', 'kept'))):
+        code = PesciCode.from_file(path("incremental", script + ".py"))
+        symbols = {'a':1, 'b':2, 'factor':10}
+        interpreter = Interpreter()
+        runner = IncrementalRunner(interpreter, code, symbols)
+        runner.run()
+        for update in ({'a':4}, {'factor':3}, {'b':7}, {'a':5, 'b':1}):
+            symbols.update(update)
+            runner.update(update)
+            runner.run()
+            env = run(code, interpreter, symbols)[0]
+            for name in names:
+                assert runner.getvar(name) == env.getvar(name), "%s %s %s: %r != %r" % (
+                    script, update, name, runner.getvar(name), env.getvar(name))
+
+## Tiered execution
+
+@check
+def tier_matches_interpreter():
+    from pesci.code import TIER_COMPILED
+    code = PesciCode.from_file(path("tier", "semantics.py"))
+    expected = run(code)[1]
+    env, output = run(code, tier_threshold=1)
+    assert output == expected, output
+    for name in ("countdown", "gather", "options", "total", "alias"):
+        assert env.getvar(name).tier == TIER_COMPILED, name
+    # the native mode shares the tier code rewrite
+    output = run(code, native=True)[1]
+    assert output == expected, output
+
+    # not into the native mode: its functions cannot see the caller variables
+    code = PesciCode.from_file(path("tier", "caller_names.py"))
+    expected = run(code)[1]
+    env, output = run(code, tier_threshold=1)
+    assert output == expected, output
+    assert env.getvar("grow").tier == TIER_COMPILED
+
+@check
+def tier_internals_hidden():
+    # the compiled function, its template and its environment
+    for attribute in ("compiled", "template", "tier", "calls"):
+        code = PesciCode.from_string(read("tier", "internals.py").replace("attribute", attribute))
+        expect_error(InterpretError, run, code, tier_threshold=1)
+    env = run(PesciCode.from_string("def f():\n    pass\n"))[0]
+    for obj in (env.getvar("f"), env):
+        expect_error(InterpretError, Interpreter().host_types.setattr, obj, "tiering", False)
+
+@check
+def tier_is_opt_in():
+    from pesci.code import TIER_INTERPRETED
+    env = run(PesciCode.from_file(path("tier", "semantics.py")))[0]
+    assert env.getvar("countdown").tier == TIER_INTERPRETED
+
+## Worker
+
+def read(*names):
+    with open(path(*names)) as f:
+        return f.read()
+
+@check
+def worker_jobs():
+    from pesci.cost import AdmissionController
+    from pesci.worker import JobRunner
+    runner = JobRunner({'factor':2}, {'steps':10000},
+        admission=AdmissionController(max_loop_depth=1))
+    scale = read("worker", "scale.py")
+
+    response = runner.run({'id':1, 'script':scale, 'symbols':{'values':[1, 2, 3]}})
+    assert response['ok'] and response['result'] == {'scaled':[2, 4, 6], 'total':12, 'v':3}, response
+    assert response['output'] == "12\n" and response['cost']['max_loop_depth'] == 1, response
+    # the cached program, with other symbols
+    response = runner.run({'id':2, 'script':scale, 'symbols':{'values':[5], 'factor':3}})
+    assert response['result']['total'] == 15, response
+
+    response = runner.run({'id':3, 'script':read("worker", "endless.py")})
+    assert not response['ok'] and response['type'] == "EnvBudgetExceeded", response
+    response = runner.run({'id':4, 'script':"for i in x:\n    for j in i:\n        pass\n"})
+    assert not response['ok'] and response['type'] == "ScriptRejected", response
+
+    # the client limits cannot raise the interpreter stack bound
+    response = runner.run({'id':5, 'script':scale, 'symbols':{'values':[1]},
+        'limits':{'call_depth':10 ** 9}})
+    assert response['ok'] and runner._get_limits({'limits':{'call_depth':10 ** 9}})['call_depth'] == \
+        DEFAULT_MAX_CALL_DEPTH, response
+    response = runner.run(ValueError("No JSON object could be decoded"))
+    assert response == {'id':None, 'ok':False, 'type':"BadJob",
+        'error':"No JSON object could be decoded"}, response
+    assert runner.run([1, 2])['type'] == "BadJob"
+
+@check
+def worker_watchdog():
+    import time
+    from pesci.worker import JobRunner
+    runner = JobRunner({'pause':time.sleep}, {'time':0.2}, watchdog=True)
+    start = time.time()
+    response = runner.run({'id':1, 'script':read("worker", "stuck.py")})
+    assert not response['ok'] and response['type'] == "EnvTimeLimitExceeded", response
+    assert time.time() - start < 5, "long step not interrupted"
+    # the timers are cleared
+    assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+    assert signal.getitimer(signal.ITIMER_VIRTUAL) == (0.0, 0.0)
+    response = runner.run({'id':2, 'script':"pause(0.01)\nn = 1\n"})
+    assert response['ok'] and response['result'] == {'n':1}, response
+
+@check
+def worker_server():
+    import shutil, socket, tempfile, time
+    from pesci.errors import JobError
+    from pesci.worker import WorkerServer, WorkerClient
+    directory = tempfile.mkdtemp()
+    address = "unix:" + os.path.join(directory, "pesci.sock")
+    server = WorkerServer(address, workers=2, symbols={'factor':2, 'pause':time.sleep},
+        limits={'time':1.0})
+    server.bind()
+    pid = os.fork()
+    if not pid:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    server.socket.close()
+    try:
+        with WorkerClient(address, connections=2) as client:
+            scale = read("worker", "scale.py")
+            # pipelined, answered in order
+            jobs = [client.submit(scale, {'values':range(n)}) for n in range(10)]
+            totals = [job.result(timeout=10)['total'] for job in jobs]
+            assert totals == [n * (n - 1) for n in range(10)], totals
+            try:
+                client.run(read("worker", "endless.py"), timeout=10)
+            except JobError as e:
+                assert e.kind == "EnvTimeLimitExceeded", e
+            else:
+                raise AssertionError("time limit not enforced")
+            for name, kind in (("stuck.py", "EnvTimeLimitExceeded"), ("native_loop.py", "ConnectionError")):
+                start = time.time()
+                try:
+                    client.run(read("worker", name), timeout=30)
+                except JobError as e:
+                    assert e.kind == kind, e
+                else:
+                    raise AssertionError("time limit not enforced")
+                assert time.time() - start < 10, "%s not interrupted" % name
+
+        # a malformed line is answered, and the connection is still served
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address[5:])
+        sock.sendall('{"id": 1, "script\n{"id": 2, "script": "n = 2\\n"}\n')
+        data = ""
+        while data.count("\n") < 2:
+            data += sock.recv(4096)
+        sock.close()
+        bad, good = [json.loads(line) for line in data.splitlines()]
+        assert bad['id'] is None and bad['type'] == "BadJob", bad
+        assert good['id'] == 2 and good['result'] == {'n':2}, good
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+        shutil.rmtree(directory, ignore_errors=True)
+
+## Record and replay
+
+class Item(object):
+    def __init__(self, code, price):
+        self.code = code
+        self.price = price
+        self.category = code[0]
+
+class Store(object):
+    def find(self, code, currency="USD"):
+        return Item(code, len(code) * 10)
+
+    def available(self, item):
+        return item.code != "b2"
+
+def replay_symbols(codes):
+    return {'codes':codes, 'store':Store(), 'rate':lambda category: 2 if category == "a" else 1}
+
+@check
+def replay_round_trip():
+    from StringIO import StringIO
+    from pesci.replay import HostRecorder, HostReplayer
+    code = PesciCode.from_file(path("replay", "orders.py"))
+    interpreter = Interpreter()
+    interpreter.register_host_type(Item, attributes=['price', 'category'])
+    interpreter.register_host_type(Store, methods=['find', 'available'])
+
+    recorder = HostRecorder()
+    expected = run(code, interpreter, recorder.wrap(replay_symbols(["a1", "b2", "c33"])))[1]
+    assert expected == "70 3\n", expected
+    log = StringIO()
+    recorder.write(log)
+
+    log.seek(0)
+    replayer = HostReplayer(log)
+    output = run(code, interpreter, replayer.symbols())[1]
+    assert output == expected and not replayer.remaining(), (output, replayer.remaining())
+
+    # other arguments than the recorded ones
+    log.seek(0)
+    replayer = HostReplayer(log)
+    symbols = replayer.symbols()
+    symbols['codes'] = ["a1", "b2", "c34"]
+    expect_error(ReplayMismatch, run, code, interpreter, symbols)
+
+class Prices(object):
+    def price(self, code):
+        from decimal import Decimal
+        return Decimal(len(code) * 5)
+
+@check
+def replay_host_operators():
+    from StringIO import StringIO
+    from pesci.replay import HostRecorder, HostReplayer
+    code = PesciCode.from_file(path("replay", "prices.py"))
+    interpreter = Interpreter()
+    interpreter.register_host_type(Prices, methods=['price'])
+
+    expected = run(code, interpreter, {'store':Prices()})[1]
+    assert expected.startswith("True True True False True\n20 21 10 2.5\n"), expected
+    # the recorded values compare and compute like the host ones
+    recorder = HostRecorder()
+    output = run(code, interpreter, recorder.wrap({'store':Prices()}))[1]
+    assert output == expected, output
+
+    log = StringIO()
+    recorder.write(log)
+    log.seek(0)
+    replayer = HostReplayer(log)
+    output = run(code, interpreter, replayer.symbols())[1]
+    assert output == expected and not replayer.remaining(), (output, replayer.remaining())
+
+## Admission control
+
+@check
+def cost_folds_constants():
+    from pesci.cost import CostAnalyzer, AdmissionController, LOOP_CONSTANT
+    code = PesciCode.from_file(path("cost", "folded.py"))
+    profile = CostAnalyzer().analyze(code)
+    assert [loop[1:3] for loop in profile.loops] == [(LOOP_CONSTANT, 10 ** 9),
+        (LOOP_CONSTANT, 0)], profile.loops
+    assert profile.max_literal == 2 ** 20, profile.max_literal
+    expect_error(ScriptRejected, AdmissionController(max_steps=10 ** 6).admit, code)
+    expect_error(ScriptRejected, AdmissionController(max_literal=1000).admit, code)
+
+@check
+def cost_loop_depth_through_calls():
+    from pesci.cost import CostAnalyzer, AdmissionController
+    code = PesciCode.from_file(path("cost", "nested.py"))
+    assert CostAnalyzer().analyze(code).max_loop_depth == 3
+    expect_error(ScriptRejected, AdmissionController(max_loop_depth=2).admit, code)
+    assert AdmissionController(max_loop_depth=3).admit(code).max_loop_depth == 3
+
+## Interactive mode
+
+@check
+def interactive_stop():
+    import __builtin__
+    from StringIO import StringIO
+    interpreter = Interpreter()
+    env = interpreter.create_env()
+    commands = ["x = 1", "stop()", "x = 2"]
+    def read_command(prompt):
+        return commands.pop(0)
+    # the former form, without the environment
+    stop = pesci_function(lambda **kwargs: kwargs[PESCI_KEY_INTERPRETER].stop())
+    env.setvar("stop", stop)
+
+    stdout, raw_input = sys.stdout, __builtin__.raw_input
+    sys.stdout, __builtin__.raw_input = StringIO(), read_command
+    try:
+        interpreter.run_interactive(env)
+    finally:
+        sys.stdout, __builtin__.raw_input = stdout, raw_input
+    assert env.getvar("x") == 1 and commands == ["x = 2"], commands
+    assert not env.interactive
+
+if __name__ == "__main__":
+    failed = 0
+    checks = list(script_checks()) + CHECKS
+    for f in checks:
+        try:
+            f()
+        except Exception:
+            failed += 1
+            print "FAIL %s" % f.__name__
+            traceback.print_exc()
+    print "%d checks, %d failed" % (len(checks), failed)
+    sys.exit(1 if failed else 0)
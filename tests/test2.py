@@ -0,0 +1,49 @@
+# Return semantics
+def sign(x):
+    if x < 0:
+        return -1
+    elif x == 0:
+        return 0
+    return 1
+
+print sign(-5), sign(0), sign(7)
+
+def noret():
+    x = 1
+
+print noret()
+
+# Deep recursion
+def count(n):
+    if n == 0:
+        return 0
+    return 1 + count(n - 1)
+
+print count(3000)
+
+# Tail recursion runs in constant space
+def loop(n, acc):
+    if n == 0:
+        return acc
+    return loop(n - 1, acc + n)
+
+print loop(20000, 0)
+
+# Mutual tail recursion
+def is_even(n):
+    if n == 0:
+        return 1
+    return is_odd(n - 1)
+
+def is_odd(n):
+    if n == 0:
+        return 0
+    return is_even(n - 1)
+
+print is_even(5001)
+
+# Tail call to a host function
+def biggest(l):
+    return max(l)
+
+print biggest([3, 9, 2])
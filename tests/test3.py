@@ -0,0 +1,8 @@
+# constants which compare equal but differ
+a = 0.0
+b = -0.0
+print a, b
+print 1 / (a + 1), b * 2
+c = 1
+d = 1.0
+print c, d
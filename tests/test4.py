@@ -0,0 +1,47 @@
+# Argument binding
+def describe(a, b=2, c=None):
+    return [a, b, c]
+
+print describe(1)
+print describe(1, 3)
+print describe(1, c=4)
+print describe(c=5, a=6)
+print describe(1, 2, 3)
+
+# Defaults are evaluated once, at definition time
+base = 10
+def shifted(x, offset=base * 2):
+    return x + offset
+
+base = 100
+print shifted(1), shifted(1, 5), shifted(offset=0, x=7)
+
+# Mutable defaults are shared by the calls
+def collect(x, into=[]):
+    into.append(x)
+    return into
+
+collect(1)
+print collect(2)
+
+# Variable arguments
+def spread(first, *rest, **options):
+    return [first, tuple(rest), sorted(options.items())]
+
+print spread(1)
+print spread(1, 2, 3)
+print spread(1, 2, key=3, other=4)
+print spread(first=9)
+
+def tail(a, b=1, *rest):
+    return [a, b, tuple(rest)]
+
+print tail(1), tail(1, 2), tail(1, 2, 3, 4)
+
+# Every definition is a new function, sharing its code
+makers = []
+for n in range(3):
+    def scaled(x, factor=n):
+        return x * factor
+    makers.append(scaled)
+print makers[0](10), makers[1](10), makers[2](10)
@@ -0,0 +1,33 @@
+# Chained comparisons
+calls = []
+def value(v):
+    calls.append(v)
+    return v
+
+a = 1
+b = 2
+c = 3
+print a < b < c, a < c < b, c > b > a >= 1
+print 1 <= a == 1 < b != c, a in [1, 2] not in [[1]], a is not None
+
+# Evaluation stops at the first false comparison
+print value(3) < value(1) < value(2)
+print calls
+calls = []
+print value(1) < value(2) < value(3) < value(0)
+print calls
+
+# Each operand is evaluated once
+calls = []
+print 0 < value(5) <= 5
+print calls
+
+# Conditional expressions
+calls = []
+print value("yes") if a < b else value("no")
+print value("yes") if a > b else value("no")
+print calls
+print "low" if a > 2 else "mid" if a > 0 else "none"
+def sign(n):
+    return 1 if n > 0 else 0 if n == 0 else -1
+print sign(5), sign(0), sign(-5)
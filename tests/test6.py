@@ -0,0 +1,45 @@
+# Strings built by concatenation
+s = ""
+for i in range(5):
+    s += str(i)
+print s, len(s)
+
+# Reading the string while it grows
+s = "a"
+lengths = []
+for i in range(3):
+    s = s + "b"
+    lengths.append(len(s))
+print s, lengths
+
+# Copies do not see the later pieces
+s = "x"
+t = s
+s += "y"
+u = s
+s += "z"
+print s, t, u
+
+# Into functions, and through globals
+def build(n, sep):
+    out = ""
+    for i in range(n):
+        out += str(i) + sep
+    return out
+
+log = ""
+def record(line):
+    global log
+    log += line + ";"
+
+print build(3, ",")
+record("one")
+record("two")
+print log
+
+# Other values keep their own +=
+items = [1]
+items += [2]
+count = 1
+count += 2
+print items, count
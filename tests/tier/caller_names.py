@@ -0,0 +1,12 @@
+# hot functions reading the variables of their caller
+def grow(v):
+    base += [v]
+    return base
+
+def caller(v):
+    base = [v]
+    return grow(v)
+
+base = []
+for k in range(3):
+    print grow(k), caller(k), base
@@ -0,0 +1,7 @@
+# a hot function looks into its own internals
+def square(v):
+    return v * v
+
+for i in range(3):
+    square(i)
+print square.attribute
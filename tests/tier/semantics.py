@@ -0,0 +1,43 @@
+# hot functions whose results must not change once compiled
+def countdown(n):
+    # loops while n == True, i.e. n == 1
+    steps = 0
+    while n:
+        steps += 1
+        n -= 1
+    return steps
+
+def gather(first, *rest):
+    rest.append(first)
+    return rest
+
+def options(a, b=2, **kw):
+    return [a, b, sorted(kw.keys())]
+
+def scaled(v):
+    return v * factor
+
+def total(items):
+    t = 0
+    for i,v in items:
+        t += scaled(v) + i
+    return t
+
+def alias(b, v):
+    # assigned lists are copies, and += builds a new list
+    a = b
+    a.append(v)
+    c = b
+    c += [v]
+    return len(b) + len(a) * 10 + len(c) * 100
+
+factor = 3
+shared = []
+for k in range(5):
+    print countdown(k), countdown(1.0), countdown(k > 0)
+    print gather(k, 1, 2), gather(k)
+    print options(k), options(k, b=k, c=1, d=2)
+    print total([(1, k), (2, 5)])
+    print k if k > 2 else 0 - k
+    shared.append(k)
+    print alias(shared, k), shared
@@ -0,0 +1,4 @@
+# a job which never ends
+n = 0
+while 1:
+    n += 1
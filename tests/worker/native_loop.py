@@ -0,0 +1,2 @@
+# a job stuck into C code, which no signal handler can interrupt
+total = sum(xrange(10 ** 11))
@@ -0,0 +1,6 @@
+# a job: scales the input values
+scaled = []
+for v in values:
+    scaled.append(v * factor)
+total = sum(scaled)
+print total
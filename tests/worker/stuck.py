@@ -0,0 +1,2 @@
+# a job stuck into a single step, which the time checks never see
+pause(60)